@@ -2,7 +2,7 @@ from django.contrib import admin
 from django.utils.safestring import mark_safe
 from .models import (
     Specialization, Department, Doctor, Service, 
-    DoctorSchedule, Patient, Appointment, Review,
+    DoctorSchedule, ScheduleSlot, WeeklyScheduleTemplate, Patient, Appointment, WaitlistEntry, Review,
     News, Contact, Slider
 )
 
@@ -12,6 +12,13 @@ class DoctorScheduleInline(admin.TabularInline):
     extra = 1
     fields = ('date', 'start_time', 'end_time', 'is_available', 'room')
 
+# Inline для недельного шаблона расписания
+class WeeklyScheduleTemplateInline(admin.TabularInline):
+    model = WeeklyScheduleTemplate
+    extra = 0
+    fields = ('weekday', 'start_time', 'end_time', 'break_start', 'break_end',
+              'slot_duration', 'room', 'is_active')
+
 # Inline для услуг врача
 class ServiceDoctorsInline(admin.TabularInline):
     model = Service.doctors.through
@@ -57,7 +64,7 @@ class DoctorAdmin(admin.ModelAdmin):
     # filter_horizontal = ('specialties',)  # только для ManyToManyField
     
     readonly_fields = ('photo_preview', 'created_at')
-    inlines = [DoctorScheduleInline]
+    inlines = [WeeklyScheduleTemplateInline, DoctorScheduleInline]
     
     fieldsets = (
         ('Личная информация', {
@@ -101,6 +108,27 @@ class DoctorScheduleAdmin(admin.ModelAdmin):
     search_fields = ('doctor__last_name', 'doctor__first_name', 'room')
     date_hierarchy = 'date'
 
+@admin.register(WeeklyScheduleTemplate)
+class WeeklyScheduleTemplateAdmin(admin.ModelAdmin):
+    list_display = ('doctor', 'weekday', 'start_time', 'end_time', 'slot_duration', 'room', 'is_active')
+    list_filter = ('weekday', 'is_active', 'doctor')
+    search_fields = ('doctor__last_name', 'doctor__first_name', 'room')
+    actions = ['materialize_four_weeks']
+    
+    @admin.action(description='Создать расписание на 4 недели вперед')
+    def materialize_four_weeks(self, request, queryset):
+        doctors = Doctor.objects.filter(schedule_templates__in=queryset).distinct()
+        created = sum(WeeklyScheduleTemplate.materialize(doctor, weeks=4) for doctor in doctors)
+        self.message_user(request, f'Создано дней расписания: {created}')
+
+@admin.register(ScheduleSlot)
+class ScheduleSlotAdmin(admin.ModelAdmin):
+    list_display = ('doctor', 'start', 'end', 'state', 'appointment', 'held_until')
+    list_filter = ('state', 'doctor')
+    search_fields = ('doctor__last_name', 'appointment__appointment_number')
+    date_hierarchy = 'start'
+    raw_id_fields = ('schedule', 'appointment', 'held_by')
+
 @admin.register(Patient)
 class PatientAdmin(admin.ModelAdmin):
     list_display = ('user', 'birth_date', 'gender', 'insurance_policy', 'phone', 'created_at')
@@ -148,6 +176,13 @@ class AppointmentAdmin(admin.ModelAdmin):
         }),
     )
 
+@admin.register(WaitlistEntry)
+class WaitlistEntryAdmin(admin.ModelAdmin):
+    list_display = ('patient', 'doctor', 'specialization', 'date_from', 'date_to', 'status', 'offered_until', 'created_at')
+    list_filter = ('status', 'specialization')
+    search_fields = ('patient__user__last_name', 'patient__insurance_policy', 'doctor__last_name')
+    raw_id_fields = ('patient', 'offered_slot', 'appointment')
+
 @admin.register(Review)
 class ReviewAdmin(admin.ModelAdmin):
     list_display = ('patient', 'doctor', 'rating', 'is_published', 'created_at')
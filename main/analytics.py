@@ -0,0 +1,152 @@
+# main/analytics.py
+"""Аналитика клиники по таблице фактов записей"""
+from datetime import datetime
+
+from django.db.models import Count, Q, Sum
+from django.db.models.functions import TruncDate
+
+from . import stats
+from .models import Appointment, AppointmentFact, DoctorSchedule, Service
+
+WATERMARK = 'appointment_facts'
+
+# Разрезы отчета: (поле группировки, поле подписи)
+GROUPINGS = {
+    'department': ('doctor__department_id', 'doctor__department__name'),
+    'specialization': ('doctor__specialization_id', 'doctor__specialization__name'),
+    'category': ('service__category', None),
+    'service': ('service_id', 'service__name'),
+}
+
+# Разрезы по врачам: для них известна емкость расписания
+DOCTOR_GROUPINGS = {'department', 'specialization'}
+
+BOOKED_STATUSES = [*Appointment.ACTIVE_STATUSES, 'completed']
+
+
+def _facts(appointments):
+    """Строки фактов, сгруппированные в БД по дню, врачу, услуге и статусу"""
+    rows = appointments.annotate(day=TruncDate('appointment_time')).values(
+        'day', 'doctor_id', 'service_id', 'status'
+    ).annotate(count=Count('pk'), minutes=Sum('service__duration')).order_by()
+    return [
+        AppointmentFact(day=row['day'], doctor_id=row['doctor_id'], service_id=row['service_id'],
+                        status=row['status'], count=row['count'], minutes=row['minutes'] or 0)
+        for row in rows
+    ]
+
+
+def rebuild_facts(pairs):
+    """Пересчитывает факты для пар (id врача, день); None - всю таблицу"""
+    if pairs is None:
+        AppointmentFact.objects.all().delete()
+        facts = _facts(Appointment.objects.all())
+        AppointmentFact.objects.bulk_create(facts, batch_size=500)
+        return len(facts)
+
+    refreshed = 0
+    for wanted, appointments, rollup_days in stats.chunked_days(pairs):
+        facts = [fact for fact in _facts(appointments) if (fact.doctor_id, fact.day) in wanted]
+        AppointmentFact.objects.filter(rollup_days).delete()
+        AppointmentFact.objects.bulk_create(facts, batch_size=500)
+        refreshed += len(facts)
+    return refreshed
+
+
+def refresh(full=False):
+    """Учитывает в фактах записи, измененные после прошлого пересчета. Возвращает число строк фактов"""
+    return stats.refresh_rollup(WATERMARK, rebuild_facts, AppointmentFact, full=full)
+
+
+def mark_stale(doctor_id, day):
+    """Помечает факты дня врача для пересчета"""
+    AppointmentFact.objects.filter(doctor_id=doctor_id, day=day).update(is_stale=True)
+
+
+def _schedule_minutes(schedule):
+    """Минуты приема по расписанию без перерыва; некорректные интервалы дают 0"""
+    def minutes(start, end):
+        delta = datetime.combine(schedule['date'], end) - datetime.combine(schedule['date'], start)
+        return max(int(delta.total_seconds()) // 60, 0)
+
+    total = minutes(schedule['start_time'], schedule['end_time'])
+    if schedule['break_start'] and schedule['break_end']:
+        total -= minutes(schedule['break_start'], schedule['break_end'])
+    return max(total, 0)
+
+
+def _capacity(group_field, start_date, end_date, doctor_filters):
+    """Минуты приема по расписанию в разрезе отделения или специализации.
+
+    Поля группировки через doctor__ одинаковы для фактов и расписаний.
+    """
+    schedules = DoctorSchedule.objects.filter(
+        date__range=[start_date, end_date], is_available=True, is_working_day=True, **doctor_filters
+    ).values(group_field, 'date', 'start_time', 'end_time', 'break_start', 'break_end')
+    capacity = {}
+    for schedule in schedules:
+        capacity[schedule[group_field]] = capacity.get(schedule[group_field], 0) + _schedule_minutes(schedule)
+    return capacity
+
+
+def report(start_date, end_date, group_by='department', department=None, specialization=None, category=None):
+    """Показатели клиники за период в выбранном разрезе.
+
+    Читает только факты и справочники. Для каждой группы возвращает
+    число записей по статусам, долю неявок среди состоявшихся и
+    несостоявшихся приемов, занятые минуты и - для разрезов по врачам -
+    загрузку расписания.
+    """
+    group_field, label_field = GROUPINGS[group_by]
+    filters = {}
+    if department:
+        filters['doctor__department_id'] = department
+    if specialization:
+        filters['doctor__specialization_id'] = specialization
+    doctor_filters = dict(filters)
+    if category:
+        filters['service__category'] = category
+
+    values = [group_field] + ([label_field] if label_field else [])
+    rows = AppointmentFact.objects.filter(day__range=[start_date, end_date], **filters).values(*values).annotate(
+        total=Sum('count'),
+        completed=Sum('count', filter=Q(status='completed')),
+        no_show=Sum('count', filter=Q(status='no_show')),
+        cancelled=Sum('count', filter=Q(status='cancelled')),
+        active=Sum('count', filter=Q(status__in=Appointment.ACTIVE_STATUSES)),
+        booked_minutes=Sum('minutes', filter=Q(status__in=BOOKED_STATUSES)),
+    ).order_by('-total')
+
+    # Емкость расписания имеет смысл только без отбора по услугам
+    capacity = None
+    if group_by in DOCTOR_GROUPINGS and not category:
+        capacity = _capacity(group_field, start_date, end_date, doctor_filters)
+
+    categories = dict(Service.SERVICE_CATEGORIES)
+    result = []
+    for row in rows:
+        key = row[group_field]
+        if label_field:
+            label = row[label_field] or 'Не указано'
+        else:
+            label = categories.get(key, key)
+        item = {
+            'key': key,
+            'label': label,
+            'total': row['total'] or 0,
+            'completed': row['completed'] or 0,
+            'no_show': row['no_show'] or 0,
+            'cancelled': row['cancelled'] or 0,
+            'active': row['active'] or 0,
+            'booked_minutes': row['booked_minutes'] or 0,
+        }
+        visited = item['completed'] + item['no_show']
+        item['no_show_rate'] = round(100 * item['no_show'] / visited, 1) if visited else None
+        if capacity is not None:
+            item['capacity_minutes'] = capacity.get(key, 0)
+            item['utilization'] = (
+                round(100 * item['booked_minutes'] / item['capacity_minutes'], 1)
+                if item['capacity_minutes'] else None
+            )
+        result.append(item)
+    return result
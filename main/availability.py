@@ -0,0 +1,161 @@
+# main/availability.py
+"""Кэш свободных слотов по ключу (врач, дата) с инвалидацией по событиям"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+
+from .models import DoctorSchedule, ScheduleSlot
+
+CACHE_PREFIX = 'availability'
+STATS_HITS_KEY = f'{CACHE_PREFIX}:stats:hits'
+STATS_MISSES_KEY = f'{CACHE_PREFIX}:stats:misses'
+
+
+def _cache_timeout():
+    return getattr(settings, 'AVAILABILITY_CACHE_TIMEOUT', 300)
+
+
+def cache_key(doctor_id, day):
+    """Ключ кэша для врача и даты"""
+    return f'{CACHE_PREFIX}:{doctor_id}:{day.isoformat()}'
+
+
+def _increment(key, delta):
+    if not delta:
+        return
+    cache.add(key, 0, timeout=None)
+    try:
+        cache.incr(key, delta)
+    except ValueError:
+        # Счетчик мог быть вытеснен между add и incr
+        cache.set(key, delta, timeout=None)
+
+
+def get_availability_matrix(doctor_ids, dates):
+    """Свободные слоты для всех пар (врач, дата): {(id врача, дата): [время, ...]}.
+
+    Попадания читаются одним get_many, промахи досчитываются двумя
+    запросами для всех недостающих пар сразу.
+    """
+    keys = {cache_key(doctor_id, day): (doctor_id, day) for doctor_id in doctor_ids for day in dates}
+    cached = cache.get_many(list(keys))
+    result = {keys[key]: slots for key, slots in cached.items()}
+
+    missing = [pair for key, pair in keys.items() if key not in cached]
+    _increment(STATS_HITS_KEY, len(cached))
+    _increment(STATS_MISSES_KEY, len(missing))
+
+    if missing:
+        computed = {pair: [] for pair in missing}
+        schedules = [
+            schedule for schedule in DoctorSchedule.objects.filter(
+                doctor_id__in={doctor_id for doctor_id, _ in missing},
+                date__in={day for _, day in missing},
+                is_available=True,
+                is_working_day=True
+            )
+            if (schedule.doctor_id, schedule.date) in computed
+        ]
+        slots_by_schedule = DoctorSchedule.get_available_slots_bulk(schedules)
+        for schedule in schedules:
+            computed[(schedule.doctor_id, schedule.date)] = slots_by_schedule[schedule.pk]
+
+        cache.set_many(
+            {cache_key(doctor_id, day): slots for (doctor_id, day), slots in computed.items()},
+            timeout=_cache_timeout()
+        )
+        result.update(computed)
+
+    return result
+
+
+def get_availability(doctor_id, start_date, end_date):
+    """Свободные слоты врача по датам диапазона: {дата: [время, ...]}"""
+    days = (end_date - start_date).days + 1
+    dates = [start_date + timedelta(days=i) for i in range(days)]
+    matrix = get_availability_matrix([doctor_id], dates)
+    return {day: matrix[(doctor_id, day)] for day in dates}
+
+
+def get_free_slots(doctor_id, day):
+    """Свободные слоты врача на дату"""
+    return get_availability_matrix([doctor_id], [day])[(doctor_id, day)]
+
+
+def invalidate(doctor_id, *days):
+    """Сбрасывает кэш врача на даты после фиксации транзакции"""
+    keys = [cache_key(doctor_id, day) for day in days if day is not None]
+    if keys:
+        transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+def get_cache_stats():
+    """Счетчики попаданий и промахов кэша"""
+    hits = cache.get(STATS_HITS_KEY, 0)
+    misses = cache.get(STATS_MISSES_KEY, 0)
+    total = hits + misses
+    return {
+        'hits': hits,
+        'misses': misses,
+        'hit_ratio': round(hits / total, 4) if total else None,
+    }
+
+
+def reset_cache_stats():
+    """Обнуляет счетчики попаданий и промахов"""
+    cache.delete_many([STATS_HITS_KEY, STATS_MISSES_KEY])
+
+
+# Кандидатов на одну проверку непрерывности в find_earliest_slots
+EARLIEST_BATCH = 50
+
+
+def find_earliest_slots(doctors, limit=1, after=None, duration=None):
+    """Ближайшие начала приема среди врачей в порядке времени.
+
+    Слияние потоков слотов всех врачей выполняет сама БД: выборка идет по
+    индексу (state, start) в порядке времени. Начало подходит, только если
+    за ним подряд идут свободные слоты на всю длительность приема -
+    duration минут или consultation_duration врача. Кандидаты проверяются
+    порциями по EARLIEST_BATCH: один дополнительный запрос на порцию.
+    """
+    after = after or timezone.now()
+    free = ScheduleSlot.objects.filter(
+        ScheduleSlot.available_q(),
+        doctor__in=doctors,
+        start__gte=after,
+        schedule__is_available=True,
+        schedule__is_working_day=True
+    )
+    candidates = free.select_related('doctor', 'schedule').order_by('start', 'id')
+
+    found = []
+    offset = 0
+    while len(found) < limit:
+        batch = list(candidates[offset:offset + EARLIEST_BATCH])
+        if not batch:
+            break
+        offset += len(batch)
+
+        longest = timedelta(minutes=max(duration or slot.doctor.consultation_duration or 30 for slot in batch))
+        # Свободные слоты, которыми могут продолжаться кандидаты порции: (врач, начало) -> конец
+        following = dict(
+            ((doctor_id, start), end) for doctor_id, start, end in free.filter(
+                doctor_id__in={slot.doctor_id for slot in batch},
+                start__gte=batch[0].start,
+                start__lt=batch[-1].start + longest,
+            ).values_list('doctor_id', 'start', 'end')
+        )
+        for slot in batch:
+            target = slot.start + timedelta(minutes=duration or slot.doctor.consultation_duration or 30)
+            end = slot.end
+            while end < target and (slot.doctor_id, end) in following:
+                end = following[(slot.doctor_id, end)]
+            if end >= target:
+                found.append(slot)
+                if len(found) == limit:
+                    break
+    return found
@@ -0,0 +1,42 @@
+# main/background.py
+"""Фоновые задачи после фиксации транзакции: по одному рабочему потоку на очередь"""
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connections, transaction
+
+logger = logging.getLogger(__name__)
+
+_executors = {}
+_lock = threading.Lock()
+
+
+def _executor(queue):
+    # Очереди не делят поток: долгий пересчет не задерживает другие задачи
+    with _lock:
+        if queue not in _executors:
+            _executors[queue] = ThreadPoolExecutor(max_workers=1, thread_name_prefix=queue)
+        return _executors[queue]
+
+
+def _run_in_background(func, *args):
+    try:
+        func(*args)
+    except Exception:
+        logger.exception('Ошибка фоновой задачи %s', getattr(func, '__name__', func))
+    finally:
+        connections.close_all()
+
+
+def schedule(queue, func, *args):
+    """Запускает func(*args) после фиксации транзакции.
+
+    По умолчанию задача уходит в рабочий поток очереди queue; при
+    BACKGROUND_ASYNC = False выполняется сразу после коммита в текущем потоке.
+    """
+    if getattr(settings, 'BACKGROUND_ASYNC', True):
+        transaction.on_commit(lambda: _executor(queue).submit(_run_in_background, func, *args))
+    else:
+        transaction.on_commit(lambda: func(*args))
@@ -0,0 +1,275 @@
+# main/booking.py
+import csv
+import io
+import json
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.db.models import Case, IntegerField, Value, When
+from django.utils import timezone
+
+from . import availability, waitlist
+from .models import (Appointment, AppointmentCounter, Doctor, DoctorSchedule, Patient,
+                     ScheduleSlot, Service, WaitlistEntry)
+from .scheduling import covers_interval
+
+HOLD_SWEEP_KEY = 'booking:holds:sweep'
+
+
+class SlotUnavailable(Exception):
+    """Выбранное время занято или не входит в сетку приема"""
+
+
+def book_appointment(patient, doctor, service, schedule, appointment_time, created_by=None, **extra):
+    """Создает запись и атомарно занимает ее слоты в инвентаре.
+    
+    Слоты занимаются условным UPDATE (только свободные), а уникальный
+    частичный индекс по (врач, время) для активных записей не дает
+    создать вторую запись даже при гонке. В обоих случаях транзакция
+    откатывается и выбрасывается SlotUnavailable.
+    """
+    try:
+        with transaction.atomic():
+            appointment = Appointment.objects.create(
+                patient=patient,
+                doctor=doctor,
+                service=service,
+                schedule=schedule,
+                appointment_time=appointment_time,
+                status='pending',
+                created_by=created_by,
+                **extra
+            )
+            if not appointment.owns_all_slots():
+                raise SlotUnavailable
+    except IntegrityError:
+        # Нарушение уникальности может относиться и к другим полям
+        if Appointment.objects.filter(
+            doctor=doctor,
+            appointment_time=appointment_time,
+            status__in=Appointment.ACTIVE_STATUSES
+        ).exists():
+            raise SlotUnavailable
+        raise
+    return appointment
+
+
+def _hold_minutes():
+    return getattr(settings, 'SLOT_HOLD_MINUTES', 5)
+
+
+def hold_slot(user, doctor, appointment_time, duration):
+    """Удерживает слоты выбранного времени за пользователем на SLOT_HOLD_MINUTES.
+    
+    Прежние удержания пользователя снимаются, кроме слотов, предложенных
+    ему из листа ожидания. Если слоты не покрывают интервал без разрывов
+    или хотя бы один из них уже занят или удерживается другим, ничего не
+    меняется и выбрасывается SlotUnavailable. Возвращает время окончания
+    удержания.
+    """
+    end = appointment_time + timedelta(minutes=duration)
+    held_until = timezone.now() + timedelta(minutes=_hold_minutes())
+    
+    with transaction.atomic():
+        previous = ScheduleSlot.objects.filter(state=ScheduleSlot.HELD, held_by=user).exclude(
+            waitlist_offers__status=WaitlistEntry.OFFERED
+        )
+        released = set(previous.values_list('doctor_id', 'start'))
+        previous.update(state=ScheduleSlot.FREE, held_until=None, held_by=None)
+        
+        slots = ScheduleSlot.objects.filter(doctor=doctor, start__lt=end, end__gt=appointment_time)
+        bounds = list(slots.values_list('start', 'end'))
+        if not covers_interval(bounds, appointment_time, end):
+            raise SlotUnavailable
+        held = slots.filter(ScheduleSlot.available_q(user.pk)).update(
+            state=ScheduleSlot.HELD, held_until=held_until, held_by=user
+        )
+        if held != len(bounds):
+            raise SlotUnavailable
+    
+    availability.invalidate(doctor.id, timezone.localtime(appointment_time).date())
+    for doctor_id, start in released:
+        availability.invalidate(doctor_id, timezone.localtime(start).date())
+    return held_until
+
+
+def sweep_expired_holds(interval=60):
+    """Освобождает истекшие удержания не чаще раза в interval секунд на все процессы"""
+    if cache.add(HOLD_SWEEP_KEY, True, timeout=interval):
+        # Просроченные предложения листа ожидания сначала передаются дальше
+        waitlist.expire_offers()
+        return ScheduleSlot.release_expired_holds()
+    return 0
+
+
+BATCH_FIELDS = ('insurance_policy', 'doctor', 'service', 'datetime')
+
+
+def parse_batch(content, fmt):
+    """Строки пакета из CSV (с заголовком) или JSON-списка объектов"""
+    if fmt == 'json':
+        rows = json.loads(content)
+        if not isinstance(rows, list) or not all(isinstance(row, dict) for row in rows):
+            raise ValueError('Ожидается JSON-список объектов')
+        return rows
+    if fmt == 'csv':
+        return list(csv.DictReader(io.StringIO(content)))
+    raise ValueError(f'Неизвестный формат: {fmt}')
+
+
+def _parse_batch_row(row):
+    """Приводит строку пакета к (полис, id врача, id услуги, aware datetime)"""
+    if not isinstance(row, dict):
+        raise ValueError('Строка пакета должна быть объектом')
+    missing = [field for field in BATCH_FIELDS if not str(row.get(field) or '').strip()]
+    if missing:
+        raise ValueError(f"Не заполнены поля: {', '.join(missing)}")
+    try:
+        doctor_id = int(row['doctor'])
+        service_id = int(row['service'])
+        appointment_time = datetime.fromisoformat(str(row['datetime']).strip())
+    except (TypeError, ValueError):
+        raise ValueError('Некорректный врач, услуга или дата и время')
+    if timezone.is_naive(appointment_time):
+        appointment_time = timezone.make_aware(appointment_time)
+    return str(row['insurance_policy']).strip(), doctor_id, service_id, appointment_time
+
+
+def book_batch(rows, created_by=None, dry_run=False):
+    """Пакетная запись пациентов на прием.
+    
+    Все пациенты, врачи, услуги, расписания и слоты загружаются несколькими
+    запросами по множествам ключей, конфликты (в том числе между строками
+    пакета) проверяются в памяти. Прошедшие проверку записи создаются одним
+    bulk_create в одной транзакции, их слоты занимаются одним UPDATE.
+    
+    Возвращает результаты по строкам: {'row', 'status', 'appointment_number'
+    или 'error'}. Если за время импорта слоты успели занять, транзакция
+    откатывается и все строки помечаются ошибкой.
+    """
+    results = [{'row': index, 'status': 'error'} for index in range(1, len(rows) + 1)]
+    parsed = {}
+    for index, row in enumerate(rows):
+        try:
+            parsed[index] = _parse_batch_row(row)
+        except ValueError as exc:
+            results[index]['error'] = str(exc)
+    
+    policies = {item[0] for item in parsed.values()}
+    patients = {patient.insurance_policy: patient
+                for patient in Patient.objects.filter(insurance_policy__in=policies)}
+    doctors = Doctor.objects.filter(
+        id__in={item[1] for item in parsed.values()}, is_active=True
+    ).in_bulk()
+    services = Service.objects.filter(
+        id__in={item[2] for item in parsed.values()}, is_active=True
+    ).in_bulk()
+    
+    days = {timezone.localtime(item[3]).date() for item in parsed.values()}
+    schedules = {
+        (schedule.doctor_id, schedule.date): schedule
+        for schedule in DoctorSchedule.objects.filter(
+            doctor_id__in=list(doctors), date__in=days, is_available=True, is_working_day=True
+        )
+    }
+    
+    # Все слоты нужных дней с признаком доступности - одним запросом
+    slots_by_schedule = {schedule.pk: [] for schedule in schedules.values()}
+    slot_rows = ScheduleSlot.objects.filter(schedule_id__in=list(slots_by_schedule)).annotate(
+        is_available=Case(When(ScheduleSlot.available_q(created_by.pk if created_by else None),
+                               then=Value(1)), default=Value(0), output_field=IntegerField())
+    ).order_by('start').values_list('id', 'schedule_id', 'start', 'end', 'is_available')
+    taken = set()
+    for slot_id, schedule_id, start, end, is_available in slot_rows:
+        slots_by_schedule[schedule_id].append((slot_id, start, end))
+        if not is_available:
+            taken.add(slot_id)
+    
+    now = timezone.now()
+    accepted = []
+    for index, (policy, doctor_id, service_id, appointment_time) in parsed.items():
+        patient = patients.get(policy)
+        doctor = doctors.get(doctor_id)
+        service = services.get(service_id)
+        schedule = schedules.get((doctor_id, timezone.localtime(appointment_time).date()))
+        
+        error = None
+        if patient is None:
+            error = 'Пациент с таким полисом не найден'
+        elif doctor is None:
+            error = 'Врач не найден или недоступен'
+        elif service is None:
+            error = 'Услуга не найдена'
+        elif appointment_time < now:
+            error = 'Нельзя записаться на прошедшее время'
+        elif schedule is None:
+            error = 'Врач не ведет прием в этот день'
+        
+        if error is None:
+            end = appointment_time + timedelta(minutes=service.duration or doctor.consultation_duration)
+            overlapping = [(slot_id, start, slot_end) for slot_id, start, slot_end in slots_by_schedule[schedule.pk]
+                           if start < end and slot_end > appointment_time]
+            slot_ids = [slot_id for slot_id, _, _ in overlapping]
+            if not covers_interval([(start, slot_end) for _, start, slot_end in overlapping], appointment_time, end):
+                error = 'Время не совпадает с сеткой приема врача'
+            elif taken.intersection(slot_ids):
+                error = 'Это время уже занято'
+        
+        if error:
+            results[index]['error'] = error
+            continue
+        
+        # Следующие строки пакета видят эти слоты занятыми
+        taken.update(slot_ids)
+        accepted.append((index, slot_ids, Appointment(
+            patient=patient,
+            doctor=doctor,
+            service=service,
+            schedule=schedule,
+            appointment_time=appointment_time,
+            status='pending',
+            created_by=created_by,
+        )))
+    
+    if dry_run or not accepted:
+        for index, slot_ids, appointment in accepted:
+            results[index]['status'] = 'ok'
+        return results
+    
+    try:
+        with transaction.atomic():
+            numbers = AppointmentCounter.allocate_numbers(count=len(accepted))
+            for number, (index, slot_ids, appointment) in zip(numbers, accepted):
+                appointment.appointment_number = number
+            # bulk_create не вызывает save() и сигналы - слоты и кэш обновляются ниже
+            created = Appointment.objects.bulk_create([item[2] for item in accepted])
+            
+            owners = {slot_id: appointment.pk
+                      for (index, slot_ids, _), appointment in zip(accepted, created)
+                      for slot_id in slot_ids}
+            claimed = ScheduleSlot.objects.filter(
+                ScheduleSlot.available_q(created_by.pk if created_by else None),
+                id__in=list(owners)
+            ).update(
+                state=ScheduleSlot.BOOKED,
+                appointment_id=Case(*[When(id=slot_id, then=Value(appointment_id))
+                                      for slot_id, appointment_id in owners.items()],
+                                    output_field=IntegerField()),
+                held_until=None,
+                held_by=None,
+            )
+            if claimed != len(owners):
+                raise SlotUnavailable
+    except (SlotUnavailable, IntegrityError):
+        for index, slot_ids, appointment in accepted:
+            results[index]['error'] = 'Расписание изменилось во время импорта, повторите пакет'
+        return results
+    
+    for index, slot_ids, appointment in accepted:
+        results[index].update(status='booked', appointment_number=appointment.appointment_number)
+    for doctor_id, day in {(item[2].doctor_id, timezone.localtime(item[2].appointment_time).date())
+                           for item in accepted}:
+        availability.invalidate(doctor_id, day)
+    return results
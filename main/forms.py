@@ -1,7 +1,7 @@
 from django import forms
 from django.contrib.auth.forms import UserCreationForm, AuthenticationForm
 from django.contrib.auth.models import User
-from .models import Patient, Appointment, Review
+from .models import Patient, Appointment, Review, WaitlistEntry
 
 class PatientRegistrationForm(UserCreationForm):
     """Форма регистрации пациента"""
@@ -72,6 +72,31 @@ class ReviewForm(forms.ModelForm):
         }
 
 
+class WaitlistForm(forms.ModelForm):
+    """Форма постановки в лист ожидания"""
+    class Meta:
+        model = WaitlistEntry
+        fields = ['doctor', 'specialization', 'service', 'date_from', 'date_to']
+        widgets = {
+            'date_from': forms.DateInput(attrs={'type': 'date'}),
+            'date_to': forms.DateInput(attrs={'type': 'date'}),
+        }
+    
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.fields['doctor'].queryset = self.fields['doctor'].queryset.filter(is_active=True)
+        self.fields['service'].queryset = self.fields['service'].queryset.filter(is_active=True)
+        for field in self.fields.values():
+            field.widget.attrs.setdefault('class', 'form-select' if isinstance(field.widget, forms.Select) else 'form-control')
+    
+    def clean_date_from(self):
+        from django.utils import timezone
+        date_from = self.cleaned_data['date_from']
+        if date_from < timezone.localdate():
+            raise forms.ValidationError('Дата начала не может быть в прошлом')
+        return date_from
+
+
 class DoctorLoginForm(AuthenticationForm):
     """Форма входа для врачей"""
     username = forms.CharField(
@@ -0,0 +1,35 @@
+# main/management/commands/import_appointments.py
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+from main.booking import book_batch, parse_batch
+
+
+class Command(BaseCommand):
+    help = ('Пакетная запись на прием из CSV или JSON '
+            '(поля: insurance_policy, doctor, service, datetime)')
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Путь к файлу пакета')
+        parser.add_argument('--format', choices=['csv', 'json'],
+                            help='Формат файла (по умолчанию - по расширению)')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Только проверить строки, не создавая записи')
+
+    def handle(self, *args, **options):
+        path = Path(options['path'])
+        fmt = options['format'] or path.suffix.lstrip('.').lower()
+        try:
+            rows = parse_batch(path.read_text(encoding='utf-8-sig'), fmt)
+        except (OSError, ValueError) as exc:
+            raise CommandError(f'Не удалось прочитать пакет: {exc}')
+
+        results = book_batch(rows, dry_run=options['dry_run'])
+        for result in results:
+            if result['status'] == 'error':
+                self.stdout.write(self.style.WARNING(f"Строка {result['row']}: {result['error']}"))
+
+        succeeded = sum(result['status'] != 'error' for result in results)
+        verb = 'Прошли проверку' if options['dry_run'] else 'Создано записей'
+        self.stdout.write(self.style.SUCCESS(f'{verb}: {succeeded} из {len(results)}'))
@@ -0,0 +1,29 @@
+# main/management/commands/materialize_schedules.py
+from django.core.management.base import BaseCommand
+
+from main.models import Doctor, WeeklyScheduleTemplate
+
+
+class Command(BaseCommand):
+    help = 'Создает расписания врачей по недельным шаблонам на несколько недель вперед'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--weeks', type=int, default=4, help='Количество недель (по умолчанию 4)')
+        parser.add_argument('--doctor', type=int, help='ID врача (по умолчанию - все врачи клиники)')
+
+    def handle(self, *args, **options):
+        doctors = Doctor.objects.filter(
+            is_active=True,
+            schedule_templates__is_active=True
+        ).distinct()
+        if options['doctor']:
+            doctors = doctors.filter(id=options['doctor'])
+
+        total = 0
+        for doctor in doctors:
+            created = WeeklyScheduleTemplate.materialize(doctor, weeks=options['weeks'])
+            total += created
+            if created:
+                self.stdout.write(f'{doctor.short_name()}: создано дней - {created}')
+
+        self.stdout.write(self.style.SUCCESS(f'Всего создано дней расписания: {total}'))
@@ -0,0 +1,19 @@
+# main/management/commands/rebuild_doctor_ratings.py
+from django.core.management.base import BaseCommand
+
+from main.models import Doctor
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает рейтинги и индекс популярности врачей по опубликованным отзывам (можно по cron)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--doctor', type=int, help='ID врача (по умолчанию - все врачи)')
+
+    def handle(self, *args, **options):
+        doctors = Doctor.objects.all()
+        if options['doctor']:
+            doctors = doctors.filter(id=options['doctor'])
+
+        updated = Doctor.rebuild_ratings(doctors)
+        self.stdout.write(self.style.SUCCESS(f'Обновлено врачей: {updated}'))
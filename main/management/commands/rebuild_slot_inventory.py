@@ -0,0 +1,24 @@
+# main/management/commands/rebuild_slot_inventory.py
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from main.models import DoctorSchedule
+
+
+class Command(BaseCommand):
+    help = 'Пересоздает инвентарь слотов из расписаний врачей'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true',
+                            help='Включая прошедшие даты (по умолчанию - с сегодняшнего дня)')
+        parser.add_argument('--doctor', type=int, help='ID врача')
+
+    def handle(self, *args, **options):
+        schedules = DoctorSchedule.objects.all()
+        if not options['all']:
+            schedules = schedules.filter(date__gte=timezone.now().date())
+        if options['doctor']:
+            schedules = schedules.filter(doctor_id=options['doctor'])
+
+        created = DoctorSchedule.regenerate_slots_bulk(schedules)
+        self.stdout.write(self.style.SUCCESS(f'Создано слотов: {created}'))
@@ -0,0 +1,16 @@
+# main/management/commands/refresh_appointment_facts.py
+from django.core.management.base import BaseCommand
+
+from main import analytics
+
+
+class Command(BaseCommand):
+    help = 'Обновляет таблицу фактов записей для аналитики клиники по изменениям с прошлого запуска (можно по cron)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true',
+                            help='Построить таблицу фактов заново по всем записям')
+
+    def handle(self, *args, **options):
+        refreshed = analytics.refresh(full=options['full'])
+        self.stdout.write(self.style.SUCCESS(f'Записано строк фактов: {refreshed}'))
@@ -0,0 +1,16 @@
+# main/management/commands/refresh_doctor_stats.py
+from django.core.management.base import BaseCommand
+
+from main import stats
+
+
+class Command(BaseCommand):
+    help = 'Обновляет дневную сводку записей врачей по изменениям с прошлого запуска (можно по cron)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true',
+                            help='Построить сводку заново по всем записям')
+
+    def handle(self, *args, **options):
+        refreshed = stats.refresh(full=options['full'])
+        self.stdout.write(self.style.SUCCESS(f'Пересчитано дней: {refreshed}'))
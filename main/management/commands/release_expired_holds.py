@@ -0,0 +1,16 @@
+# main/management/commands/release_expired_holds.py
+from django.core.management.base import BaseCommand
+
+from main import waitlist
+from main.models import ScheduleSlot
+
+
+class Command(BaseCommand):
+    help = 'Освобождает слоты с истекшим удержанием и передает просроченные предложения листа ожидания (для cron)'
+
+    def handle(self, *args, **options):
+        expired = waitlist.expire_offers()
+        if expired:
+            self.stdout.write(f'Истекло предложений листа ожидания: {expired}')
+        released = ScheduleSlot.release_expired_holds()
+        self.stdout.write(self.style.SUCCESS(f'Освобождено слотов: {released}'))
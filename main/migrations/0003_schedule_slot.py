@@ -0,0 +1,69 @@
+# Generated by Django 6.0 on 2026-10-17 05:50
+
+import django.db.models.deletion
+from datetime import timedelta
+
+from django.db import migrations, models
+
+from main.scheduling import assign_intervals, build_bookable_grid
+
+
+def materialize_slots(apps, schema_editor):
+    """Генерирует слоты для уже существующих расписаний"""
+    DoctorSchedule = apps.get_model('main', 'DoctorSchedule')
+    Appointment = apps.get_model('main', 'Appointment')
+    ScheduleSlot = apps.get_model('main', 'ScheduleSlot')
+
+    booked = {}
+    rows = Appointment.objects.filter(
+        status__in=['pending', 'confirmed']
+    ).values_list('schedule_id', 'appointment_time', 'service__duration', 'id')
+    for schedule_id, start, duration, appointment_id in rows:
+        booked.setdefault(schedule_id, []).append(
+            (start, start + timedelta(minutes=duration or 30), appointment_id)
+        )
+
+    slots = []
+    for schedule in DoctorSchedule.objects.iterator():
+        grid = build_bookable_grid(schedule.date, schedule.start_time, schedule.end_time,
+                                   schedule.slot_duration, schedule.break_start, schedule.break_end)
+        for start, end, appointment_id in assign_intervals(grid, booked.get(schedule.pk, [])):
+            slots.append(ScheduleSlot(
+                schedule_id=schedule.pk,
+                doctor_id=schedule.doctor_id,
+                start=start,
+                end=end,
+                state='booked' if appointment_id else 'free',
+                appointment_id=appointment_id,
+            ))
+    ScheduleSlot.objects.bulk_create(slots, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0002_alter_doctor_user'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ScheduleSlot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('start', models.DateTimeField(verbose_name='Начало слота')),
+                ('end', models.DateTimeField(verbose_name='Конец слота')),
+                ('state', models.CharField(choices=[('free', 'Свободен'), ('booked', 'Занят')], default='free', max_length=10, verbose_name='Состояние')),
+                ('appointment', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='slots', to='main.appointment', verbose_name='Запись')),
+                ('doctor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='slots', to='main.doctor', verbose_name='Врач')),
+                ('schedule', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='slots', to='main.doctorschedule', verbose_name='Расписание')),
+            ],
+            options={
+                'verbose_name': 'Слот расписания',
+                'verbose_name_plural': 'Слоты расписания',
+                'ordering': ['start'],
+                'indexes': [models.Index(fields=['schedule', 'state', 'start'], name='slot_schedule_state_idx')],
+                'unique_together': {('doctor', 'start')},
+            },
+        ),
+        migrations.RunPython(materialize_slots, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 6.0 on 2026-10-17 05:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0003_schedule_slot'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='scheduleslot',
+            index=models.Index(fields=['state', 'start'], name='slot_state_start_idx'),
+        ),
+    ]
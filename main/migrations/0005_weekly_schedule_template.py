@@ -0,0 +1,36 @@
+# Generated by Django 6.0 on 2026-10-17 05:53
+
+import datetime
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0004_slot_state_start_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WeeklyScheduleTemplate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('weekday', models.IntegerField(choices=[(0, 'Понедельник'), (1, 'Вторник'), (2, 'Среда'), (3, 'Четверг'), (4, 'Пятница'), (5, 'Суббота'), (6, 'Воскресенье')], verbose_name='День недели')),
+                ('start_time', models.TimeField(default=datetime.time(9, 0), verbose_name='Время начала приема')),
+                ('end_time', models.TimeField(default=datetime.time(18, 0), verbose_name='Время окончания приема')),
+                ('break_start', models.TimeField(blank=True, null=True, verbose_name='Начало перерыва')),
+                ('break_end', models.TimeField(blank=True, null=True, verbose_name='Конец перерыва')),
+                ('slot_duration', models.IntegerField(default=30, verbose_name='Длительность слота (минут)')),
+                ('room', models.CharField(blank=True, max_length=20, verbose_name='Кабинет')),
+                ('is_active', models.BooleanField(default=True, verbose_name='Используется')),
+                ('doctor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='schedule_templates', to='main.doctor', verbose_name='Врач')),
+            ],
+            options={
+                'verbose_name': 'Шаблон расписания',
+                'verbose_name_plural': 'Шаблоны расписания',
+                'ordering': ['doctor', 'weekday'],
+                'unique_together': {('doctor', 'weekday')},
+            },
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 6.0 on 2026-10-17 05:55
+
+from django.conf import settings
+from django.db import migrations, models
+
+ACTIVE_STATUSES = ['pending', 'confirmed']
+
+
+def cancel_duplicate_appointments(apps, schema_editor):
+    """Оставляет одну активную запись на врача и время - созданную раньше остальных"""
+    Appointment = apps.get_model('main', 'Appointment')
+    active = Appointment.objects.filter(status__in=ACTIVE_STATUSES)
+    duplicates = active.values('doctor_id', 'appointment_time').annotate(
+        count=models.Count('id')
+    ).filter(count__gt=1)
+    for row in duplicates:
+        ids = list(active.filter(
+            doctor_id=row['doctor_id'], appointment_time=row['appointment_time']
+        ).order_by('created_at', 'id').values_list('id', flat=True))
+        Appointment.objects.filter(id__in=ids[1:]).update(status='cancelled')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0005_weekly_schedule_template'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(cancel_duplicate_appointments, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='appointment',
+            constraint=models.UniqueConstraint(condition=models.Q(('status__in', ['pending', 'confirmed'])), fields=('doctor', 'appointment_time'), name='unique_active_appointment_time'),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 6.0 on 2026-10-17 05:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0006_unique_active_appointment_time'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AppointmentCounter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(unique=True, verbose_name='День')),
+                ('last_number', models.PositiveIntegerField(default=0, verbose_name='Последний номер')),
+            ],
+            options={
+                'verbose_name': 'Счетчик номеров записей',
+                'verbose_name_plural': 'Счетчики номеров записей',
+            },
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 6.0 on 2026-10-17 05:59
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0007_appointment_counter'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='scheduleslot',
+            name='held_by',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='held_slots', to=settings.AUTH_USER_MODEL, verbose_name='Удерживается пользователем'),
+        ),
+        migrations.AddField(
+            model_name='scheduleslot',
+            name='held_until',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Удерживается до'),
+        ),
+        migrations.AlterField(
+            model_name='scheduleslot',
+            name='state',
+            field=models.CharField(choices=[('free', 'Свободен'), ('held', 'Удерживается'), ('booked', 'Занят')], default='free', max_length=10, verbose_name='Состояние'),
+        ),
+    ]
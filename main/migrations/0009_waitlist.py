@@ -0,0 +1,37 @@
+# Generated by Django 6.0 on 2026-10-17 06:04
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0008_slot_hold'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WaitlistEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date_from', models.DateField(verbose_name='Начиная с')),
+                ('date_to', models.DateField(verbose_name='По')),
+                ('status', models.CharField(choices=[('waiting', 'Ожидает'), ('offered', 'Предложено время'), ('booked', 'Записан'), ('expired', 'Предложение истекло'), ('cancelled', 'Отменена')], default='waiting', max_length=20, verbose_name='Статус')),
+                ('offered_until', models.DateTimeField(blank=True, null=True, verbose_name='Предложение действует до')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Дата постановки')),
+                ('appointment', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='waitlist_entries', to='main.appointment', verbose_name='Запись')),
+                ('doctor', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='waitlist_entries', to='main.doctor', verbose_name='Врач')),
+                ('offered_slot', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='waitlist_offers', to='main.scheduleslot', verbose_name='Предложенный слот')),
+                ('patient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='waitlist_entries', to='main.patient', verbose_name='Пациент')),
+                ('service', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='main.service', verbose_name='Услуга')),
+                ('specialization', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='waitlist_entries', to='main.specialization', verbose_name='Специализация')),
+            ],
+            options={
+                'verbose_name': 'Заявка в листе ожидания',
+                'verbose_name_plural': 'Лист ожидания',
+                'ordering': ['created_at'],
+                'indexes': [models.Index(fields=['status', 'doctor', 'date_from'], name='waitlist_doctor_idx'), models.Index(fields=['status', 'specialization', 'date_from'], name='waitlist_spec_idx')],
+            },
+        ),
+    ]
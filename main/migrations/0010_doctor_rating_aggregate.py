@@ -0,0 +1,44 @@
+# Generated by Django 6.0 on 2026-10-17 06:05
+
+from django.db import migrations, models
+
+
+def fill_ratings(apps, schema_editor):
+    """Начальный расчет рейтингов по опубликованным отзывам"""
+    Doctor = apps.get_model('main', 'Doctor')
+    Review = apps.get_model('main', 'Review')
+    totals = Review.objects.filter(is_published=True).values('doctor_id').annotate(
+        total=models.Sum('rating'), count=models.Count('id')
+    )
+    for row in totals:
+        Doctor.objects.filter(pk=row['doctor_id']).update(
+            rating_sum=row['total'],
+            rating_count=row['count'],
+            rating_avg=row['total'] / row['count'],
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0009_waitlist'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='doctor',
+            name='rating_avg',
+            field=models.FloatField(default=0, editable=False, verbose_name='Средняя оценка'),
+        ),
+        migrations.AddField(
+            model_name='doctor',
+            name='rating_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Количество оценок'),
+        ),
+        migrations.AddField(
+            model_name='doctor',
+            name='rating_sum',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Сумма оценок'),
+        ),
+        migrations.RunPython(fill_ratings, migrations.RunPython.noop),
+    ]
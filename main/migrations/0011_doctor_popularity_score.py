@@ -0,0 +1,38 @@
+# Generated by Django 6.0 on 2026-10-17 06:06
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models.functions import Cast
+
+
+def fill_popularity(apps, schema_editor):
+    """Начальный расчет индекса популярности (байесовское среднее)"""
+    Doctor = apps.get_model('main', 'Doctor')
+    prior_weight = getattr(settings, 'POPULARITY_PRIOR_WEIGHT', 5)
+    totals = Doctor.objects.aggregate(total=models.Sum('rating_sum'), count=models.Sum('rating_count'))
+    prior_mean = totals['total'] / totals['count'] if totals['count'] else 0
+    Doctor.objects.update(popularity_score=(
+        (models.F('rating_sum') + prior_weight * prior_mean) /
+        (Cast(models.F('rating_count'), models.FloatField()) + prior_weight)
+    ))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0010_doctor_rating_aggregate'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='doctor',
+            name='popularity_score',
+            field=models.FloatField(default=0, editable=False, verbose_name='Индекс популярности'),
+        ),
+        migrations.AddIndex(
+            model_name='doctor',
+            index=models.Index(fields=['is_active', '-popularity_score'], name='doctor_popularity_idx'),
+        ),
+        migrations.RunPython(fill_popularity, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,52 @@
+# Generated by Django 6.0 on 2026-10-17 06:18
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0011_doctor_popularity_score'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RollupWatermark',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True, verbose_name='Сводная таблица')),
+                ('value', models.DateTimeField(blank=True, null=True, verbose_name='Учтено до')),
+            ],
+            options={
+                'verbose_name': 'Отметка пересчета',
+                'verbose_name_plural': 'Отметки пересчета',
+            },
+        ),
+        migrations.CreateModel(
+            name='DoctorDailyStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(verbose_name='День')),
+                ('total', models.PositiveIntegerField(default=0, verbose_name='Всего записей')),
+                ('pending', models.PositiveIntegerField(default=0, verbose_name='Ожидают подтверждения')),
+                ('confirmed', models.PositiveIntegerField(default=0, verbose_name='Подтверждены')),
+                ('cancelled', models.PositiveIntegerField(default=0, verbose_name='Отменены')),
+                ('completed', models.PositiveIntegerField(default=0, verbose_name='Завершены')),
+                ('no_show', models.PositiveIntegerField(default=0, verbose_name='Неявки')),
+                ('morning', models.PositiveIntegerField(default=0, verbose_name='Утро (9-12)')),
+                ('afternoon', models.PositiveIntegerField(default=0, verbose_name='День (12-17)')),
+                ('evening', models.PositiveIntegerField(default=0, verbose_name='Вечер (17-20)')),
+                ('services', models.JSONField(blank=True, default=dict, verbose_name='Записи по услугам')),
+                ('is_stale', models.BooleanField(default=False, verbose_name='Требует пересчета')),
+                ('refreshed_at', models.DateTimeField(auto_now=True, verbose_name='Пересчитано')),
+                ('doctor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_stats', to='main.doctor', verbose_name='Врач')),
+            ],
+            options={
+                'verbose_name': 'Дневная статистика врача',
+                'verbose_name_plural': 'Дневная статистика врачей',
+                'ordering': ['doctor', 'day'],
+                'constraints': [models.UniqueConstraint(fields=('doctor', 'day'), name='unique_doctor_daily_stats')],
+            },
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 6.0 on 2026-10-17 06:31
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0012_doctor_daily_stats'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AppointmentFact',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(verbose_name='День')),
+                ('status', models.CharField(choices=[('pending', 'Ожидает подтверждения'), ('confirmed', 'Подтверждена'), ('cancelled', 'Отменена'), ('completed', 'Завершена'), ('no_show', 'Не явился')], max_length=20, verbose_name='Статус')),
+                ('count', models.PositiveIntegerField(default=0, verbose_name='Записей')),
+                ('minutes', models.PositiveIntegerField(default=0, verbose_name='Минут приема')),
+                ('is_stale', models.BooleanField(default=False, verbose_name='Требует пересчета')),
+                ('doctor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='appointment_facts', to='main.doctor', verbose_name='Врач')),
+                ('service', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='appointment_facts', to='main.service', verbose_name='Услуга')),
+            ],
+            options={
+                'verbose_name': 'Факт записей',
+                'verbose_name_plural': 'Факты записей',
+                'indexes': [models.Index(fields=['doctor', 'day'], name='appointment_fact_doctor_idx')],
+                'constraints': [models.UniqueConstraint(fields=('day', 'doctor', 'service', 'status'), name='unique_appointment_fact')],
+            },
+        ),
+    ]
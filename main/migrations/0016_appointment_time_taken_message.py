@@ -0,0 +1,20 @@
+# Generated by Django 6.0 on 2026-10-17 13:05
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0015_appointment_page_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterConstraint(
+            model_name='appointment',
+            name='unique_active_appointment_time',
+            constraint=models.UniqueConstraint(condition=models.Q(('status__in', ['pending', 'confirmed'])), fields=('doctor', 'appointment_time'), name='unique_active_appointment_time', violation_error_message='Это время уже занято другой записью'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 6.0 on 2026-10-17 14:20
+
+from django.conf import settings
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0016_appointment_time_taken_message'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='appointment',
+            name='appointment_doctor_time_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='appointment',
+            name='appointment_patient_idx',
+        ),
+    ]
@@ -1,8 +1,15 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models.functions import Cast, Coalesce
+from django.db.models.lookups import GreaterThan
 from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
 from django.core.validators import MinValueValidator, MaxValueValidator
 from django.utils import timezone
-from datetime import time, datetime
+from datetime import time, datetime, timedelta
+
+from .scheduling import (assign_intervals, build_bookable_grid, covers_interval, make_aware_datetime,
+                         sweep_free_slots)
+from .timeranges import on_day
 
 # Модель для специализации врача
 class Specialization(models.Model):
@@ -82,6 +89,12 @@ class Doctor(models.Model):
     consultation_price = models.DecimalField(max_digits=10, decimal_places=2, default=0,
                                              verbose_name='Стоимость консультации')
     
+    # Рейтинг по опубликованным отзывам (обновляется сигналами Review)
+    rating_avg = models.FloatField(default=0, editable=False, verbose_name='Средняя оценка')
+    rating_count = models.PositiveIntegerField(default=0, editable=False, verbose_name='Количество оценок')
+    rating_sum = models.PositiveIntegerField(default=0, editable=False, verbose_name='Сумма оценок')
+    popularity_score = models.FloatField(default=0, editable=False, verbose_name='Индекс популярности')
+    
     # Метаданные
     created_at = models.DateTimeField(auto_now_add=True, verbose_name='Дата добавления')
     order = models.IntegerField(default=0, verbose_name='Порядок отображения')
@@ -90,6 +103,9 @@ class Doctor(models.Model):
         verbose_name = 'Врач'
         verbose_name_plural = 'Врачи'
         ordering = ['order', 'last_name', 'first_name']
+        indexes = [
+            models.Index(fields=['is_active', '-popularity_score'], name='doctor_popularity_idx'),
+        ]
     
     def __str__(self):
         return f"{self.last_name} {self.first_name} {self.middle_name}"
@@ -104,9 +120,8 @@ class Doctor(models.Model):
     
     def get_available_slots(self, date):
         """Получить доступные слоты на указанную дату"""
-        from datetime import date as date_type
-        if isinstance(date, date_type):
-            date = timezone.make_aware(datetime.combine(date, time.min))
+        if isinstance(date, datetime):
+            date = timezone.localtime(date).date() if timezone.is_aware(date) else date.date()
         
         # Получаем расписание врача на указанную дату
         schedule = self.schedules.filter(date=date, is_available=True).first()
@@ -117,10 +132,72 @@ class Doctor(models.Model):
     @property
     def rating(self):
         """Средний рейтинг врача"""
-        reviews = self.reviews.filter(is_published=True)
-        if reviews.exists():
-            return reviews.aggregate(models.Avg('rating'))['rating__avg']
-        return 0
+        return self.rating_avg
+    
+    @classmethod
+    def apply_rating_delta(cls, doctor_id, sum_delta, count_delta):
+        """Изменяет сумму и количество оценок врача одним UPDATE без чтения строки.
+        
+        Индекс популярности после всех изменений пересчитывает refresh_popularity.
+        """
+        if not count_delta and not sum_delta:
+            return
+        new_sum = models.F('rating_sum') + sum_delta
+        new_count = models.F('rating_count') + count_delta
+        cls.objects.filter(pk=doctor_id).update(
+            rating_sum=new_sum,
+            rating_count=new_count,
+            rating_avg=models.Case(
+                models.When(GreaterThan(new_count, 0),
+                            then=Cast(new_sum, models.FloatField()) / new_count),
+                default=models.Value(0.0),
+            ),
+        )
+    
+    @classmethod
+    def refresh_popularity(cls, doctor_ids=None):
+        """Пересчитывает индекс популярности врачей одним UPDATE.
+        
+        Индекс - байесовское среднее: оценки врача дополняются
+        POPULARITY_PRIOR_WEIGHT условными оценками, равными среднему по
+        клинике. Врач с одной пятеркой не обгоняет врача с сотней
+        оценок 4.8, а врачи без отзывов получают среднее по клинике.
+        
+        doctor_ids ограничивает пересчет этими врачами: после отзыва
+        обновляется только его врач, а сдвиг среднего по клинике для
+        остальных учитывает периодический rebuild_doctor_ratings.
+        """
+        from django.conf import settings
+        prior_weight = getattr(settings, 'POPULARITY_PRIOR_WEIGHT', 5)
+        totals = cls.objects.aggregate(total=models.Sum('rating_sum'), count=models.Sum('rating_count'))
+        prior_mean = totals['total'] / totals['count'] if totals['count'] else 0
+        doctors = cls.objects.all() if doctor_ids is None else cls.objects.filter(pk__in=doctor_ids)
+        return doctors.update(popularity_score=(
+            (models.F('rating_sum') + prior_weight * prior_mean) /
+            (Cast(models.F('rating_count'), models.FloatField()) + prior_weight)
+        ))
+    
+    @classmethod
+    def rebuild_ratings(cls, doctors=None):
+        """Пересчитывает рейтинги врачей по опубликованным отзывам.
+        
+        Возвращает количество обновленных врачей.
+        """
+        doctors = list(cls.objects.all() if doctors is None else doctors)
+        totals = {
+            row['doctor_id']: row
+            for row in Review.objects.filter(
+                doctor__in=doctors, is_published=True
+            ).values('doctor_id').annotate(total=models.Sum('rating'), count=models.Count('id'))
+        }
+        for doctor in doctors:
+            row = totals.get(doctor.pk, {'total': 0, 'count': 0})
+            doctor.rating_sum = row['total']
+            doctor.rating_count = row['count']
+            doctor.rating_avg = row['total'] / row['count'] if row['count'] else 0
+        updated = cls.objects.bulk_update(doctors, ['rating_sum', 'rating_count', 'rating_avg'], batch_size=500)
+        cls.refresh_popularity()
+        return updated
 
     def is_doctor_user(self):
         """Проверяет, является ли пользователь врачом"""
@@ -173,6 +250,11 @@ class Service(models.Model):
         verbose_name = 'Услуга'
         verbose_name_plural = 'Услуги'
         ordering = ['order', 'name']
+        indexes = [
+            # Каталог услуг: только активные в порядке отображения
+            models.Index(fields=['order', 'name'], condition=models.Q(is_active=True),
+                         name='service_active_order_idx'),
+        ]
     
     def __str__(self):
         return self.name
@@ -207,59 +289,191 @@ class DoctorSchedule(models.Model):
         verbose_name_plural = 'Расписания врачей'
         ordering = ['date', 'start_time']
         unique_together = ['doctor', 'date']
+        indexes = [
+            # Дни, на которые можно записаться (поиск свободного времени)
+            models.Index(fields=['doctor', 'date'],
+                         condition=models.Q(is_available=True, is_working_day=True),
+                         name='schedule_bookable_idx'),
+        ]
+    
+    # Поля, от которых зависит сетка слотов
+    SLOT_FIELDS = ('date', 'start_time', 'end_time', 'slot_duration', 'break_start', 'break_end')
     
     def __str__(self):
         return f"{self.doctor} - {self.date}"
     
-    def get_available_slots(self):
-        """Генерирует список доступных временных слотов"""
-        import datetime
-        from django.utils import timezone
+    def save(self, *args, **kwargs):
+        """Сохранение с перегенерацией слотов при изменении часов приема"""
+        # Время может быть передано строкой ('09:00') - приводим к типам полей
+        for field in self.SLOT_FIELDS:
+            setattr(self, field, self._meta.get_field(field).to_python(getattr(self, field)))
         
-        slots = []
-        current_time = datetime.datetime.combine(self.date, self.start_time)
-        end_datetime = datetime.datetime.combine(self.date, self.end_time)
+        regenerate = self.pk is None
+        self._previous_date = None
+        if not regenerate:
+            previous = DoctorSchedule.objects.filter(pk=self.pk).values(*self.SLOT_FIELDS).first()
+            regenerate = previous is None or any(
+                previous[field] != getattr(self, field) for field in self.SLOT_FIELDS
+            )
+            if previous and previous['date'] != self.date:
+                # Дата перенесена - кэш старой даты тоже нужно сбросить
+                self._previous_date = previous['date']
+        
+        super().save(*args, **kwargs)
         
-        # Преобразуем в aware datetime если нужно
-        if timezone.is_naive(current_time):
-            current_time = timezone.make_aware(current_time)
-        if timezone.is_naive(end_datetime):
-            end_datetime = timezone.make_aware(end_datetime)
+        if regenerate:
+            self.regenerate_slots()
+    
+    def get_slot_grid(self):
+        """Сетка слотов дня без перерыва: [(начало, конец), ...]"""
+        return build_bookable_grid(self.date, self.start_time, self.end_time,
+                                   self.slot_duration, self.break_start, self.break_end)
+    
+    @classmethod
+    def get_booked_intervals_bulk(cls, schedules):
+        """Занятые интервалы для набора расписаний: {id расписания: [(начало, конец, id записи)]}"""
+        slot_durations = {schedule.pk: schedule.slot_duration for schedule in schedules}
+        intervals = {pk: [] for pk in slot_durations}
+        if not intervals:
+            return intervals
         
-        # Проверяем перерыв
-        break_start_dt = None
-        break_end_dt = None
+        rows = Appointment.objects.filter(
+            schedule_id__in=list(intervals),
+            status__in=Appointment.ACTIVE_STATUSES
+        ).values_list('schedule_id', 'appointment_time', 'service__duration', 'id')
+        for schedule_id, start, duration, appointment_id in rows:
+            duration = duration or slot_durations[schedule_id]
+            intervals[schedule_id].append((start, start + timedelta(minutes=duration), appointment_id))
+        return intervals
+    
+    def get_working_intervals(self):
+        """Рабочие интервалы дня без перерыва: [(начало, конец), ...]"""
+        start = make_aware_datetime(self.date, self.start_time)
+        end = make_aware_datetime(self.date, self.end_time)
         if self.break_start and self.break_end:
-            break_start_dt = datetime.datetime.combine(self.date, self.break_start)
-            break_end_dt = datetime.datetime.combine(self.date, self.break_end)
-            if timezone.is_naive(break_start_dt):
-                break_start_dt = timezone.make_aware(break_start_dt)
-            if timezone.is_naive(break_end_dt):
-                break_end_dt = timezone.make_aware(break_end_dt)
+            break_start = make_aware_datetime(self.date, self.break_start)
+            break_end = make_aware_datetime(self.date, self.break_end)
+            return [(start, break_start), (break_end, end)]
+        return [(start, end)]
+    
+    @classmethod
+    def regenerate_slots_bulk(cls, schedules):
+        """Пересоздает инвентарь слотов для набора расписаний.
         
-        slot_duration = datetime.timedelta(minutes=self.slot_duration)
+        Занятые и удерживаемые слоты, которые по-прежнему лежат в рабочих
+        часах дня, сохраняются как есть: на них ссылаются записи, оформление
+        записи и предложения листа ожидания. Свободные слоты строятся заново
+        в промежутках между ними; слоты, пересекающиеся с активными записями,
+        сразу помечаются занятыми.
+        """
+        schedules = list(schedules)
+        if not schedules:
+            return 0
         
-        while current_time + slot_duration <= end_datetime:
-            # Проверяем, не попадает ли слот в перерыв
-            in_break = False
-            if break_start_dt and break_end_dt:
-                if break_start_dt <= current_time < break_end_dt:
-                    in_break = True
-            
-            # Проверяем, не занят ли слот
-            is_booked = self.appointments.filter(
-                appointment_time__gte=current_time,
-                appointment_time__lt=current_time + slot_duration,
-                status__in=['confirmed', 'pending']
-            ).exists()
-            
-            if not in_break and not is_booked:
-                slots.append(current_time.time())
+        in_use = ScheduleSlot.objects.filter(schedule__in=schedules).exclude(
+            ScheduleSlot.available_q()
+        ).values_list('id', 'schedule_id', 'start', 'end')
+        kept = {schedule.pk: [] for schedule in schedules}
+        for slot_id, schedule_id, start, end in in_use:
+            kept[schedule_id].append((slot_id, start, end))
+        
+        booked = cls.get_booked_intervals_bulk(schedules)
+        kept_ids = []
+        slots = []
+        for schedule in schedules:
+            working = schedule.get_working_intervals()
+            kept_intervals = []
+            for slot_id, start, end in kept[schedule.pk]:
+                if any(work_start <= start and end <= work_end for work_start, work_end in working):
+                    kept_ids.append(slot_id)
+                    kept_intervals.append((start, end))
             
-            current_time += slot_duration
+            grid = sweep_free_slots(schedule.get_slot_grid(), kept_intervals)
+            for start, end, appointment_id in assign_intervals(grid, booked[schedule.pk]):
+                slots.append(ScheduleSlot(
+                    schedule=schedule,
+                    doctor_id=schedule.doctor_id,
+                    start=start,
+                    end=end,
+                    state=ScheduleSlot.BOOKED if appointment_id else ScheduleSlot.FREE,
+                    appointment_id=appointment_id,
+                ))
+        
+        with transaction.atomic():
+            ScheduleSlot.objects.filter(schedule__in=schedules).exclude(id__in=kept_ids).delete()
+            ScheduleSlot.objects.bulk_create(slots)
+        
+        from .availability import invalidate
+        for schedule in schedules:
+            invalidate(schedule.doctor_id, schedule.date)
+        return len(slots) + len(kept_ids)
+    
+    @classmethod
+    def bulk_create_with_slots(cls, doctor, schedules, existing=None):
+        """Создает расписания врача одним bulk_create и генерирует их слоты.
+        
+        Дни, на которые расписание уже есть, пропускаются. existing -
+        уже известные даты существующих расписаний (иначе читаются из БД).
+        Возвращает количество созданных дней.
+        """
+        if not schedules:
+            return 0
         
+        dates = {schedule.date for schedule in schedules}
+        with transaction.atomic():
+            if existing is None:
+                existing = set(doctor.schedules.filter(date__in=dates).values_list('date', flat=True))
+            cls.objects.bulk_create(schedules, ignore_conflicts=True)
+            # bulk_create с ignore_conflicts не возвращает первичные ключи -
+            # новые строки находим по датам, которых до вставки не было
+            created = list(doctor.schedules.filter(date__in=dates - set(existing)))
+            cls.regenerate_slots_bulk(created)
+        return len(created)
+    
+    def regenerate_slots(self):
+        """Пересоздает инвентарь слотов расписания"""
+        return DoctorSchedule.regenerate_slots_bulk([self])
+    
+    @classmethod
+    def get_available_slots_bulk(cls, schedules):
+        """Свободные слоты для набора расписаний одним запросом к инвентарю"""
+        slots = {schedule.pk: [] for schedule in schedules}
+        if not slots:
+            return slots
+        
+        rows = ScheduleSlot.objects.filter(
+            ScheduleSlot.available_q(),
+            schedule_id__in=list(slots)
+        ).order_by('start').values_list('schedule_id', 'start')
+        for schedule_id, start in rows:
+            slots[schedule_id].append(timezone.localtime(start).time())
         return slots
     
+    @classmethod
+    def annotate_counts(cls, queryset):
+        """Добавляет к расписаниям appointments_total, appointments_active и free_slots.
+
+        Счетчики - коррелированные подзапросы в том же SELECT, поэтому
+        календарь любого размера читается одним запросом, а соединения
+        с записями и слотами не размножают строки.
+        """
+        def count(model, *conditions, **filters):
+            rows = model.objects.filter(*conditions, schedule=models.OuterRef('pk'), **filters)
+            return Coalesce(models.Subquery(
+                rows.order_by().values('schedule').annotate(total=models.Count('pk')).values('total'),
+                output_field=models.IntegerField()
+            ), 0)
+
+        return queryset.annotate(
+            appointments_total=count(Appointment),
+            appointments_active=count(Appointment, status__in=Appointment.ACTIVE_STATUSES),
+            free_slots=count(ScheduleSlot, ScheduleSlot.available_q()),
+        )
+
+    def get_available_slots(self):
+        """Список доступных временных слотов"""
+        return DoctorSchedule.get_available_slots_bulk([self])[self.pk]
+    
     @property
     def is_past(self):
         """Проверяет, прошла ли дата расписания"""
@@ -268,6 +482,158 @@ class DoctorSchedule(models.Model):
         return self.date < today
 
 
+# Модель недельного шаблона расписания
+class WeeklyScheduleTemplate(models.Model):
+    """Шаблон рабочего дня врача для дня недели"""
+    WEEKDAY_CHOICES = [
+        (0, 'Понедельник'),
+        (1, 'Вторник'),
+        (2, 'Среда'),
+        (3, 'Четверг'),
+        (4, 'Пятница'),
+        (5, 'Суббота'),
+        (6, 'Воскресенье'),
+    ]
+    
+    doctor = models.ForeignKey(Doctor, on_delete=models.CASCADE,
+                               related_name='schedule_templates', verbose_name='Врач')
+    weekday = models.IntegerField(choices=WEEKDAY_CHOICES, verbose_name='День недели')
+    
+    # Время работы
+    start_time = models.TimeField(default=time(9, 0), verbose_name='Время начала приема')
+    end_time = models.TimeField(default=time(18, 0), verbose_name='Время окончания приема')
+    break_start = models.TimeField(null=True, blank=True, verbose_name='Начало перерыва')
+    break_end = models.TimeField(null=True, blank=True, verbose_name='Конец перерыва')
+    
+    # Настройки
+    slot_duration = models.IntegerField(default=30, verbose_name='Длительность слота (минут)')
+    room = models.CharField(max_length=20, blank=True, verbose_name='Кабинет')
+    is_active = models.BooleanField(default=True, verbose_name='Используется')
+    
+    class Meta:
+        verbose_name = 'Шаблон расписания'
+        verbose_name_plural = 'Шаблоны расписания'
+        ordering = ['doctor', 'weekday']
+        unique_together = ['doctor', 'weekday']
+    
+    def __str__(self):
+        return f"{self.doctor} - {self.get_weekday_display()}"
+    
+    def build_schedule(self, day):
+        """Несохраненное расписание на дату по шаблону"""
+        return DoctorSchedule(
+            doctor_id=self.doctor_id,
+            date=day,
+            start_time=self.start_time,
+            end_time=self.end_time,
+            slot_duration=self.slot_duration,
+            break_start=self.break_start,
+            break_end=self.break_end,
+            room=self.room,
+            is_available=True,
+            is_working_day=True,
+        )
+    
+    @classmethod
+    def materialize(cls, doctor, weeks=4, start_date=None):
+        """Разворачивает шаблоны врача в расписания на weeks недель вперед.
+        
+        Существующие дни не трогаются. Новые расписания создаются одним
+        bulk_create, слоты для них - одной пакетной генерацией.
+        Возвращает количество созданных дней.
+        """
+        templates = {template.weekday: template
+                     for template in doctor.schedule_templates.filter(is_active=True)}
+        if not templates:
+            return 0
+        
+        start_date = start_date or timezone.now().date()
+        end_date = start_date + timedelta(weeks=weeks) - timedelta(days=1)
+        existing = set(doctor.schedules.filter(
+            date__range=[start_date, end_date]
+        ).values_list('date', flat=True))
+        
+        schedules = []
+        for offset in range(weeks * 7):
+            day = start_date + timedelta(days=offset)
+            if day.weekday() in templates and day not in existing:
+                schedules.append(templates[day.weekday()].build_schedule(day))
+        if not schedules:
+            return 0
+        
+        return DoctorSchedule.bulk_create_with_slots(doctor, schedules, existing)
+
+
+# Модель слота расписания (материализованная сетка приема)
+class ScheduleSlot(models.Model):
+    """Слот приема врача, сгенерированный из расписания"""
+    FREE = 'free'
+    HELD = 'held'
+    BOOKED = 'booked'
+    STATE_CHOICES = [
+        (FREE, 'Свободен'),
+        (HELD, 'Удерживается'),
+        (BOOKED, 'Занят'),
+    ]
+    
+    schedule = models.ForeignKey(DoctorSchedule, on_delete=models.CASCADE,
+                                 related_name='slots', verbose_name='Расписание')
+    doctor = models.ForeignKey(Doctor, on_delete=models.CASCADE,
+                               related_name='slots', verbose_name='Врач')
+    start = models.DateTimeField(verbose_name='Начало слота')
+    end = models.DateTimeField(verbose_name='Конец слота')
+    
+    state = models.CharField(max_length=10, choices=STATE_CHOICES, default=FREE,
+                             verbose_name='Состояние')
+    appointment = models.ForeignKey('Appointment', on_delete=models.SET_NULL, null=True,
+                                    blank=True, related_name='slots', verbose_name='Запись')
+    
+    # Временное удержание слота на время оформления записи
+    held_until = models.DateTimeField(null=True, blank=True, verbose_name='Удерживается до')
+    held_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True,
+                                related_name='held_slots', verbose_name='Удерживается пользователем')
+    
+    class Meta:
+        verbose_name = 'Слот расписания'
+        verbose_name_plural = 'Слоты расписания'
+        ordering = ['start']
+        unique_together = ['doctor', 'start']
+        indexes = [
+            models.Index(fields=['schedule', 'state', 'start'], name='slot_schedule_state_idx'),
+            models.Index(fields=['state', 'start'], name='slot_state_start_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.doctor} - {timezone.localtime(self.start):%d.%m.%Y %H:%M} ({self.get_state_display()})"
+    
+    @classmethod
+    def available_q(cls, user_id=None):
+        """Условие доступности слота: свободен, удержание истекло или принадлежит user_id"""
+        condition = models.Q(state=cls.FREE) | models.Q(state=cls.HELD, held_until__lte=timezone.now())
+        if user_id:
+            condition |= models.Q(state=cls.HELD, held_by_id=user_id)
+        return condition
+    
+    @classmethod
+    def release_expired_holds(cls):
+        """Возвращает в свободные слоты с истекшим удержанием.
+        
+        Один UPDATE по индексу (state, start); кэш сбрасывается только для
+        затронутых пар (врач, дата). Возвращает количество освобожденных слотов.
+        """
+        expired = cls.objects.filter(state=cls.HELD, held_until__lte=timezone.now())
+        affected = set(expired.values_list('doctor_id', 'start'))
+        if not affected:
+            return 0
+        
+        released = expired.update(state=cls.FREE, held_until=None, held_by=None)
+        
+        from .availability import invalidate
+        for doctor_id, start in affected:
+            invalidate(doctor_id, timezone.localtime(start).date())
+        return released
+
+
 # Модель пациента (расширение User)
 class Patient(models.Model):
     """Пациент - расширение стандартной модели User"""
@@ -336,6 +702,32 @@ class Appointment(models.Model):
         ('no_show', 'Не явился'),
     ]
     
+    # Статусы, при которых запись занимает время врача
+    ACTIVE_STATUSES = ['pending', 'confirmed']
+
+    @classmethod
+    def status_counts(cls, **filters):
+        """Счетчики записей по статусам одним агрегирующим запросом.
+
+        filters отбирают записи (patient=..., doctor=...). Возвращает
+        словарь с total, количеством по каждому статусу, active
+        (ожидают или подтверждены), а также today и upcoming - активные
+        записи на сегодня и предстоящие.
+        """
+        now = timezone.now()
+        active = models.Q(status__in=cls.ACTIVE_STATUSES)
+        aggregates = {
+            status: models.Count('pk', filter=models.Q(status=status))
+            for status, _ in cls.STATUS_CHOICES
+        }
+        return cls.objects.filter(**filters).aggregate(
+            total=models.Count('pk'),
+            active=models.Count('pk', filter=active),
+            today=models.Count('pk', filter=active & on_day('appointment_time', timezone.localdate(now))),
+            upcoming=models.Count('pk', filter=active & models.Q(appointment_time__gte=now)),
+            **aggregates
+        )
+    
     # Основная информация
     patient = models.ForeignKey(Patient, on_delete=models.CASCADE, 
                                 related_name='appointments', verbose_name='Пациент')
@@ -367,28 +759,109 @@ class Appointment(models.Model):
         verbose_name = 'Запись на прием'
         verbose_name_plural = 'Записи на прием'
         ordering = ['-appointment_time']
+        constraints = [
+            # Одно активное бронирование на врача и время - гарантия на уровне БД
+            models.UniqueConstraint(
+                fields=['doctor', 'appointment_time'],
+                condition=models.Q(status__in=['pending', 'confirmed']),
+                name='unique_active_appointment_time',
+                violation_error_message='Это время уже занято другой записью',
+            ),
+        ]
+        indexes = [
+            # Записи врача и пациента по времени, в том числе постраничная
+            # история в порядке (время, id)
+            models.Index(fields=['doctor', 'appointment_time', 'id'], name='appointment_doctor_page_idx'),
+            models.Index(fields=['patient', 'appointment_time', 'id'], name='appointment_patient_page_idx'),
+            # Инкрементальный пересчет сводок по измененным записям
+            models.Index(fields=['updated_at'], name='appointment_updated_idx'),
+        ]
     
     def __str__(self):
         return f"Запись #{self.appointment_number}: {self.patient} -> {self.doctor}"
     
     def save(self, *args, **kwargs):
-        """Автоматическая генерация номера записи при создании"""
+        """Автоматическая генерация номера записи при создании.
+        
+        Запись и синхронизация ее слотов (сигнал post_save) выполняются
+        одной транзакцией: если слоты занять не удалось, откатывается и запись.
+        """
         if not self.appointment_number:
-            from datetime import datetime
-            date_str = datetime.now().strftime('%Y%m%d')
-            last_appointment = Appointment.objects.filter(
-                appointment_number__startswith=f"APT-{date_str}-"
-            ).order_by('-appointment_number').first()
-            
-            if last_appointment:
-                last_num = int(last_appointment.appointment_number.split('-')[-1])
-                new_num = last_num + 1
-            else:
-                new_num = 1
-            
-            self.appointment_number = f"APT-{date_str}-{new_num:04d}"
+            self.appointment_number = AppointmentCounter.allocate_numbers()[0]
         
-        super().save(*args, **kwargs)
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+    
+    def clean(self):
+        """Вернуть запись в активный статус или перенести ее можно, только если новые слоты свободны"""
+        super().clean()
+        if self.pk and self.status in self.ACTIVE_STATUSES:
+            previous = Appointment.objects.filter(pk=self.pk).values(
+                'status', 'doctor_id', 'service_id', 'appointment_time'
+            ).first()
+            if previous and (previous['status'] not in self.ACTIVE_STATUSES or self.interval_changed(previous)) \
+                    and not self.can_claim_slots():
+                raise ValidationError({'status': 'Это время уже занято или удерживается другим пользователем'})
+    
+    def interval_changed(self, previous):
+        """Изменились ли врач, время или услуга (длительность) по сравнению с сохраненными значениями"""
+        return (previous['doctor_id'], previous['service_id'], previous['appointment_time']) != (
+            self.doctor_id, self.service_id, self.appointment_time
+        )
+    
+    def get_interval(self):
+        """Интервал приема (начало, конец)"""
+        return self.appointment_time, self.appointment_time + timedelta(minutes=self.duration)
+    
+    def get_overlapping_slots(self):
+        """Слоты врача, пересекающиеся с временем записи"""
+        start, end = self.get_interval()
+        return ScheduleSlot.objects.filter(doctor_id=self.doctor_id, start__lt=end, end__gt=start)
+    
+    def claim_slots(self):
+        """Занимает доступные слоты записи одним условным UPDATE.
+        
+        Слоты, удерживаемые автором записи, тоже считаются доступными.
+        """
+        return self.get_overlapping_slots().filter(
+            ScheduleSlot.available_q(self.created_by_id)
+        ).update(state=ScheduleSlot.BOOKED, appointment=self, held_until=None, held_by=None)
+    
+    def release_slots(self):
+        """Освобождает слоты, занятые записью"""
+        return ScheduleSlot.objects.filter(appointment=self).update(
+            state=ScheduleSlot.FREE, appointment=None, held_until=None, held_by=None
+        )
+    
+    def release_stale_slots(self):
+        """Освобождает слоты записи вне ее текущего интервала (после переноса).
+        
+        Возвращает (врач, начало, конец) освобожденного промежутка или None.
+        """
+        stale = ScheduleSlot.objects.filter(appointment=self).exclude(
+            pk__in=self.get_overlapping_slots().values('pk')
+        )
+        bounds = stale.aggregate(doctor_id=models.Min('doctor_id'), start=models.Min('start'),
+                                 end=models.Max('end'))
+        if bounds['start'] is None:
+            return None
+        stale.update(state=ScheduleSlot.FREE, appointment=None, held_until=None, held_by=None)
+        return bounds['doctor_id'], bounds['start'], bounds['end']
+    
+    def can_claim_slots(self):
+        """Слоты без разрывов покрывают интервал записи и свободны для нее или уже принадлежат ей"""
+        start, end = self.get_interval()
+        slots = self.get_overlapping_slots()
+        return covers_interval(slots.values_list('start', 'end'), start, end) and not slots.exclude(
+            appointment_id=self.pk
+        ).exclude(ScheduleSlot.available_q(self.created_by_id)).exists()
+    
+    def owns_all_slots(self):
+        """Слоты интервала записи заняты именно ею и покрывают его без разрывов"""
+        start, end = self.get_interval()
+        slots = list(self.get_overlapping_slots().values_list('start', 'end', 'appointment_id'))
+        return (all(owner == self.pk for _, _, owner in slots)
+                and covers_interval([(slot_start, slot_end) for slot_start, slot_end, _ in slots], start, end))
     
     @property
     def is_upcoming(self):
@@ -402,6 +875,205 @@ class Appointment(models.Model):
         return self.service.duration if self.service else self.doctor.consultation_duration
 
 
+# Счетчик номеров записей по дням
+class AppointmentCounter(models.Model):
+    """Последний выданный номер записи за день"""
+    day = models.DateField(unique=True, verbose_name='День')
+    last_number = models.PositiveIntegerField(default=0, verbose_name='Последний номер')
+    
+    class Meta:
+        verbose_name = 'Счетчик номеров записей'
+        verbose_name_plural = 'Счетчики номеров записей'
+    
+    def __str__(self):
+        return f"{self.day}: {self.last_number}"
+    
+    @staticmethod
+    def format_number(day, number):
+        """Номер записи в формате APT-YYYYMMDD-NNNN"""
+        return f"APT-{day.strftime('%Y%m%d')}-{number:04d}"
+    
+    @classmethod
+    def _seed(cls, day):
+        """Наибольший номер, уже выданный за день до появления счетчика"""
+        numbers = Appointment.objects.filter(
+            appointment_number__startswith=cls.format_number(day, 0)[:-4]
+        ).values_list('appointment_number', flat=True)
+        return max((int(number.rsplit('-', 1)[-1]) for number in numbers), default=0)
+    
+    @classmethod
+    def allocate_numbers(cls, count=1, day=None):
+        """Резервирует count номеров подряд за день и возвращает их строками.
+        
+        Номер выдается атомарным UPDATE счетчика вместо поиска последней
+        записи по префиксу, поэтому параллельные вставки из разных процессов
+        не получают одинаковых номеров. Блок из count номеров стоит столько
+        же, сколько один, что удобно для массового создания записей.
+        Номера откатившихся транзакций не переиспользуются.
+        """
+        day = day or timezone.localdate()
+        with transaction.atomic():
+            updated = cls.objects.filter(day=day).update(last_number=models.F('last_number') + count)
+            if not updated:
+                # Первая запись за день: счетчик продолжает уже выданные номера
+                counter, created = cls.objects.get_or_create(
+                    day=day, defaults={'last_number': cls._seed(day) + count}
+                )
+                if not created:
+                    cls.objects.filter(pk=counter.pk).update(last_number=models.F('last_number') + count)
+            last_number = cls.objects.filter(day=day).values_list('last_number', flat=True).get()
+        first_number = last_number - count + 1
+        return [cls.format_number(day, number) for number in range(first_number, last_number + 1)]
+
+
+# Отметка инкрементального пересчета сводных таблиц
+class RollupWatermark(models.Model):
+    """Момент, до которого изменения записей уже учтены в сводной таблице"""
+    name = models.CharField(max_length=50, unique=True, verbose_name='Сводная таблица')
+    value = models.DateTimeField(null=True, blank=True, verbose_name='Учтено до')
+
+    class Meta:
+        verbose_name = 'Отметка пересчета'
+        verbose_name_plural = 'Отметки пересчета'
+
+    def __str__(self):
+        return f"{self.name}: {self.value}"
+
+
+# Дневная сводка записей врача
+class DoctorDailyStats(models.Model):
+    """Счетчики записей врача за день для страницы статистики.
+
+    Строка пересчитывается целиком по записям дня, поэтому повторный
+    пересчет безопасен. services - {id услуги: количество записей}.
+    """
+    doctor = models.ForeignKey(Doctor, on_delete=models.CASCADE,
+                               related_name='daily_stats', verbose_name='Врач')
+    day = models.DateField(verbose_name='День')
+
+    total = models.PositiveIntegerField(default=0, verbose_name='Всего записей')
+    pending = models.PositiveIntegerField(default=0, verbose_name='Ожидают подтверждения')
+    confirmed = models.PositiveIntegerField(default=0, verbose_name='Подтверждены')
+    cancelled = models.PositiveIntegerField(default=0, verbose_name='Отменены')
+    completed = models.PositiveIntegerField(default=0, verbose_name='Завершены')
+    no_show = models.PositiveIntegerField(default=0, verbose_name='Неявки')
+
+    # Время суток приема (по местному времени)
+    morning = models.PositiveIntegerField(default=0, verbose_name='Утро (9-12)')
+    afternoon = models.PositiveIntegerField(default=0, verbose_name='День (12-17)')
+    evening = models.PositiveIntegerField(default=0, verbose_name='Вечер (17-20)')
+
+    services = models.JSONField(default=dict, blank=True, verbose_name='Записи по услугам')
+    is_stale = models.BooleanField(default=False, verbose_name='Требует пересчета')
+    refreshed_at = models.DateTimeField(auto_now=True, verbose_name='Пересчитано')
+
+    class Meta:
+        verbose_name = 'Дневная статистика врача'
+        verbose_name_plural = 'Дневная статистика врачей'
+        ordering = ['doctor', 'day']
+        constraints = [
+            models.UniqueConstraint(fields=['doctor', 'day'], name='unique_doctor_daily_stats'),
+        ]
+
+    def __str__(self):
+        return f"{self.doctor} - {self.day}: {self.total}"
+
+
+# Факты записей для аналитики клиники
+class AppointmentFact(models.Model):
+    """Число записей и минут приема с разбивкой день x врач x услуга x статус.
+
+    Отделение, специализация и категория берутся из справочников врача
+    и услуги, поэтому аналитика не обращается к таблице записей.
+    """
+    day = models.DateField(verbose_name='День')
+    doctor = models.ForeignKey(Doctor, on_delete=models.CASCADE,
+                               related_name='appointment_facts', verbose_name='Врач')
+    service = models.ForeignKey(Service, on_delete=models.CASCADE,
+                                related_name='appointment_facts', verbose_name='Услуга')
+    status = models.CharField(max_length=20, choices=Appointment.STATUS_CHOICES, verbose_name='Статус')
+    count = models.PositiveIntegerField(default=0, verbose_name='Записей')
+    minutes = models.PositiveIntegerField(default=0, verbose_name='Минут приема')
+    is_stale = models.BooleanField(default=False, verbose_name='Требует пересчета')
+
+    class Meta:
+        verbose_name = 'Факт записей'
+        verbose_name_plural = 'Факты записей'
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'doctor', 'service', 'status'],
+                                    name='unique_appointment_fact'),
+        ]
+        indexes = [
+            models.Index(fields=['doctor', 'day'], name='appointment_fact_doctor_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.day} {self.doctor} {self.service} {self.status}: {self.count}"
+
+
+# Модель листа ожидания
+class WaitlistEntry(models.Model):
+    """Заявка пациента на освободившееся время у врача или специалиста"""
+    WAITING = 'waiting'
+    OFFERED = 'offered'
+    BOOKED = 'booked'
+    EXPIRED = 'expired'
+    CANCELLED = 'cancelled'
+    STATUS_CHOICES = [
+        (WAITING, 'Ожидает'),
+        (OFFERED, 'Предложено время'),
+        (BOOKED, 'Записан'),
+        (EXPIRED, 'Предложение истекло'),
+        (CANCELLED, 'Отменена'),
+    ]
+    
+    patient = models.ForeignKey(Patient, on_delete=models.CASCADE,
+                                related_name='waitlist_entries', verbose_name='Пациент')
+    doctor = models.ForeignKey(Doctor, on_delete=models.CASCADE, null=True, blank=True,
+                               related_name='waitlist_entries', verbose_name='Врач')
+    specialization = models.ForeignKey(Specialization, on_delete=models.CASCADE, null=True, blank=True,
+                                       related_name='waitlist_entries', verbose_name='Специализация')
+    service = models.ForeignKey(Service, on_delete=models.SET_NULL, null=True, blank=True,
+                                verbose_name='Услуга')
+    date_from = models.DateField(verbose_name='Начиная с')
+    date_to = models.DateField(verbose_name='По')
+    
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=WAITING,
+                              verbose_name='Статус')
+    offered_slot = models.ForeignKey(ScheduleSlot, on_delete=models.SET_NULL, null=True, blank=True,
+                                     related_name='waitlist_offers', verbose_name='Предложенный слот')
+    offered_until = models.DateTimeField(null=True, blank=True, verbose_name='Предложение действует до')
+    appointment = models.ForeignKey(Appointment, on_delete=models.SET_NULL, null=True, blank=True,
+                                    related_name='waitlist_entries', verbose_name='Запись')
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='Дата постановки')
+    
+    class Meta:
+        verbose_name = 'Заявка в листе ожидания'
+        verbose_name_plural = 'Лист ожидания'
+        ordering = ['created_at']
+        indexes = [
+            models.Index(fields=['status', 'doctor', 'date_from'], name='waitlist_doctor_idx'),
+            models.Index(fields=['status', 'specialization', 'date_from'], name='waitlist_spec_idx'),
+        ]
+    
+    def __str__(self):
+        target = self.doctor or self.specialization
+        return f"{self.patient} -> {target} ({self.date_from} - {self.date_to})"
+    
+    def clean(self):
+        from django.core.exceptions import ValidationError
+        if not self.doctor_id and not self.specialization_id:
+            raise ValidationError('Укажите врача или специализацию')
+        if self.date_from and self.date_to and self.date_to < self.date_from:
+            raise ValidationError('Дата окончания раньше даты начала')
+    
+    @property
+    def offer_is_active(self):
+        """Предложенное время еще можно принять"""
+        return (self.status == self.OFFERED and self.offered_until is not None
+                and self.offered_until > timezone.now())
+
+
 # Модель отзыва о враче
 class Review(models.Model):
     """Отзывы пациентов о врачах"""
@@ -464,6 +1136,11 @@ class News(models.Model):
         verbose_name = 'Новость'
         verbose_name_plural = 'Новости'
         ordering = ['-published_at', '-created_at']
+        indexes = [
+            # Лента опубликованных новостей
+            models.Index(fields=['-published_at'], condition=models.Q(is_published=True),
+                         name='news_published_idx'),
+        ]
     
     def __str__(self):
         return self.title
@@ -0,0 +1,73 @@
+# main/pagination.py
+"""Постраничный вывод по ключу (keyset) для длинных списков записей.
+
+Вместо OFFSET страница начинается после ключа (время, id) последней
+строки предыдущей страницы. Запрос - поиск по диапазону индекса
+(врач или пациент, время, id) и LIMIT, поэтому стоимость страницы
+не зависит от того, насколько далеко пролистана история.
+"""
+import base64
+from datetime import datetime
+
+from django.db.models import Q
+
+PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+
+def encode_cursor(moment, pk):
+    """Курсор - непрозрачная строка с ключом последней строки страницы"""
+    raw = f'{moment.isoformat()}|{pk}'.encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Ключ (время, id) из курсора; None для пустого или испорченного курсора"""
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        moment, pk = raw.split('|')
+        return datetime.fromisoformat(moment), int(pk)
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+
+def page_size(value, default=PAGE_SIZE):
+    """Размер страницы из параметра запроса, в пределах [1, MAX_PAGE_SIZE]"""
+    try:
+        return min(max(int(value), 1), MAX_PAGE_SIZE)
+    except (TypeError, ValueError):
+        return default
+
+
+def keyset_queryset(queryset, cursor=None, field='appointment_time', descending=False):
+    """queryset в порядке (field, id), начиная после ключа из cursor.
+
+    Условие записано как field >= t AND (field > t OR id > pk), чтобы
+    по field оставался поиск по диапазону индекса.
+    """
+    after = 'lt' if descending else 'gt'
+    key = decode_cursor(cursor)
+    if key:
+        moment, pk = key
+        queryset = queryset.filter(
+            Q(**{f'{field}__{after}e': moment}),
+            Q(**{f'{field}__{after}': moment}) | Q(**{f'pk__{after}': pk}),
+        )
+    prefix = '-' if descending else ''
+    return queryset.order_by(f'{prefix}{field}', f'{prefix}pk')
+
+
+def keyset_page(queryset, cursor=None, size=PAGE_SIZE, field='appointment_time', descending=False):
+    """Страница queryset после ключа из cursor.
+
+    Возвращает (строки страницы, курсор следующей страницы или None).
+    Лишняя строка в выборке показывает, есть ли следующая страница.
+    """
+    rows = list(keyset_queryset(queryset, cursor, field, descending)[:size + 1])
+    if len(rows) <= size:
+        return rows, None
+    rows = rows[:size]
+    last = rows[-1]
+    return rows, encode_cursor(getattr(last, field), last.pk)
@@ -0,0 +1,103 @@
+# main/scheduling.py
+"""Расчет сетки слотов и свободного времени по интервалам занятости"""
+import datetime
+
+from django.utils import timezone
+
+
+def make_aware_datetime(day, value):
+    """Объединяет дату и время в aware datetime текущего часового пояса"""
+    result = datetime.datetime.combine(day, value)
+    if timezone.is_naive(result):
+        result = timezone.make_aware(result)
+    return result
+
+
+def build_slot_grid(day, start_time, end_time, slot_duration):
+    """Сетка слотов рабочего дня: список пар (начало, конец)"""
+    step = datetime.timedelta(minutes=slot_duration)
+    current = make_aware_datetime(day, start_time)
+    end = make_aware_datetime(day, end_time)
+
+    grid = []
+    while current + step <= end:
+        grid.append((current, current + step))
+        current += step
+    return grid
+
+
+def merge_intervals(intervals):
+    """Объединяет пересекающиеся интервалы и сортирует их по началу"""
+    merged = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1]:
+            if end > merged[-1][1]:
+                merged[-1] = (merged[-1][0], end)
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def sweep_free_slots(grid, busy_intervals):
+    """Возвращает слоты сетки, не пересекающиеся ни с одним занятым интервалом.
+
+    Сетка и объединенные интервалы отсортированы, поэтому достаточно одного
+    прохода с указателем: занятия длиннее слота и записи не по сетке
+    корректно блокируют все слоты, которые они задевают.
+    """
+    busy = merge_intervals(busy_intervals)
+    free = []
+    index = 0
+    for slot_start, slot_end in grid:
+        # Пропускаем интервалы, закончившиеся до начала слота
+        while index < len(busy) and busy[index][1] <= slot_start:
+            index += 1
+        if index < len(busy) and busy[index][0] < slot_end:
+            continue
+        free.append((slot_start, slot_end))
+    return free
+
+
+def covers_interval(slots, start, end):
+    """Слоты (пары начало, конец) без разрывов покрывают интервал [start, end).
+
+    Первый слот должен начинаться ровно в start, каждый следующий - там,
+    где закончился предыдущий, последний - заканчиваться не раньше end.
+    """
+    current = start
+    for slot_start, slot_end in sorted(slots):
+        if slot_start != current:
+            return False
+        current = slot_end
+        if current >= end:
+            return True
+    return False
+
+
+def build_bookable_grid(day, start_time, end_time, slot_duration, break_start=None, break_end=None):
+    """Сетка слотов рабочего дня без слотов, задевающих перерыв"""
+    grid = build_slot_grid(day, start_time, end_time, slot_duration)
+    if break_start and break_end:
+        break_interval = (make_aware_datetime(day, break_start), make_aware_datetime(day, break_end))
+        grid = sweep_free_slots(grid, [break_interval])
+    return grid
+
+
+def assign_intervals(grid, tagged_intervals):
+    """Сопоставляет слотам сетки пересекающиеся интервалы.
+
+    tagged_intervals - тройки (начало, конец, метка). Возвращает тройки
+    (начало слота, конец слота, метка или None).
+    """
+    intervals = sorted(tagged_intervals, key=lambda item: item[0])
+    result = []
+    for slot_start, slot_end in grid:
+        tag = None
+        for start, end, interval_tag in intervals:
+            if start >= slot_end:
+                break
+            if end > slot_start:
+                tag = interval_tag
+                break
+        result.append((slot_start, slot_end, tag))
+    return result
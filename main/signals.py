@@ -0,0 +1,144 @@
+# main/signals.py
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from . import analytics, availability, stats, waitlist
+from .booking import SlotUnavailable
+from .models import Appointment, Doctor, DoctorSchedule, Review
+
+
+def offer_released_time(appointment):
+    """Предлагает освободившееся время листу ожидания (в фоне после коммита)"""
+    start, end = appointment.get_interval()
+    waitlist.schedule(waitlist.offer_freed_slots, appointment.doctor_id, start, end)
+
+
+@receiver(pre_save, sender=Appointment)
+def remember_appointment_state(sender, instance, **kwargs):
+    """Запоминает статус, врача, услугу и время записи до сохранения"""
+    instance._previous_state = None
+    if instance.pk:
+        instance._previous_state = Appointment.objects.filter(pk=instance.pk).values(
+            'status', 'doctor_id', 'service_id', 'appointment_time'
+        ).first()
+
+
+@receiver(post_save, sender=Appointment)
+def sync_appointment_slots(sender, instance, **kwargs):
+    """Занимает или освобождает слоты инвентаря при изменении записи.
+    
+    При переносе активной записи (другие врач, время или услуга) слоты
+    прежнего интервала освобождаются. Если запись вернулась в активный
+    статус или перенесена, а новые слоты не покрывают ее интервал или
+    заняты другими, выбрасывается SlotUnavailable - транзакция
+    Appointment.save откатывает изменение.
+    """
+    if instance.status in Appointment.ACTIVE_STATUSES:
+        previous = getattr(instance, '_previous_state', None)
+        moved = bool(previous) and instance.interval_changed(previous)
+        released = instance.release_stale_slots() if moved else None
+        instance.claim_slots()
+        if previous and (moved or previous['status'] not in Appointment.ACTIVE_STATUSES) \
+                and not instance.owns_all_slots():
+            raise SlotUnavailable
+        if released:
+            waitlist.schedule(waitlist.offer_freed_slots, *released)
+    elif instance.release_slots():
+        offer_released_time(instance)
+
+
+@receiver(pre_delete, sender=Appointment)
+def release_deleted_appointment_slots(sender, instance, **kwargs):
+    """Освобождает слоты удаляемой записи"""
+    if instance.release_slots():
+        offer_released_time(instance)
+
+
+@receiver(post_save, sender=Appointment)
+@receiver(post_delete, sender=Appointment)
+def invalidate_appointment_availability(sender, instance, **kwargs):
+    """Сбрасывает кэш свободных слотов врача на дату записи.
+    
+    Для перенесенной записи сбрасывается и кэш прежних врача и даты:
+    там освободились ее слоты.
+    """
+    day = timezone.localtime(instance.appointment_time).date()
+    availability.invalidate(instance.doctor_id, day)
+    previous = getattr(instance, '_previous_state', None)
+    if previous:
+        previous_day = timezone.localtime(previous['appointment_time']).date()
+        if (previous['doctor_id'], previous_day) != (instance.doctor_id, day):
+            availability.invalidate(previous['doctor_id'], previous_day)
+
+
+@receiver(post_delete, sender=Appointment)
+def mark_deleted_appointment_rollups(sender, instance, **kwargs):
+    """Помечает день удаленной записи для пересчета дневной сводки и фактов"""
+    day = timezone.localtime(instance.appointment_time).date()
+    stats.mark_stale(instance.doctor_id, day)
+    analytics.mark_stale(instance.doctor_id, day)
+
+
+@receiver(post_save, sender=Appointment)
+def mark_moved_appointment_rollups(sender, instance, **kwargs):
+    """Помечает прежний день и врача перенесенной записи для пересчета сводки и фактов.
+
+    Инкрементальный пересчет находит только текущий день измененной записи,
+    и без отметки строки прежнего дня продолжали бы ее учитывать.
+    """
+    previous = getattr(instance, '_previous_state', None)
+    if not previous:
+        return
+    day = timezone.localtime(previous['appointment_time']).date()
+    if (previous['doctor_id'], day) != (instance.doctor_id, timezone.localtime(instance.appointment_time).date()):
+        stats.mark_stale(previous['doctor_id'], day)
+        analytics.mark_stale(previous['doctor_id'], day)
+
+
+@receiver(post_save, sender=DoctorSchedule)
+@receiver(post_delete, sender=DoctorSchedule)
+def invalidate_schedule_availability(sender, instance, **kwargs):
+    """Сбрасывает кэш свободных слотов врача на дату расписания"""
+    availability.invalidate(instance.doctor_id, instance.date, getattr(instance, '_previous_date', None))
+
+
+@receiver(post_save, sender=Doctor)
+def init_doctor_popularity(sender, instance, created, **kwargs):
+    """Новый врач без отзывов получает индекс популярности по среднему клиники"""
+    if created:
+        Doctor.refresh_popularity([instance.pk])
+        instance.refresh_from_db(fields=['popularity_score'])
+
+
+@receiver(pre_save, sender=Review)
+def remember_review_rating(sender, instance, **kwargs):
+    """Запоминает вклад отзыва в рейтинг до сохранения"""
+    instance._previous_rating = None
+    if instance.pk:
+        instance._previous_rating = Review.objects.filter(
+            pk=instance.pk, is_published=True
+        ).values_list('doctor_id', 'rating').first()
+
+
+@receiver(post_save, sender=Review)
+def update_doctor_rating(sender, instance, **kwargs):
+    """Учитывает публикацию, снятие с публикации и изменение оценки отзыва"""
+    previous = getattr(instance, '_previous_rating', None)
+    current = (instance.doctor_id, instance.rating) if instance.is_published else None
+    if previous == current:
+        return
+    if previous:
+        Doctor.apply_rating_delta(previous[0], -previous[1], -1)
+    if current:
+        Doctor.apply_rating_delta(current[0], current[1], 1)
+    # Индекс популярности - после обоих изменений, по итоговому среднему клиники
+    Doctor.refresh_popularity({doctor_id for doctor_id, _ in filter(None, [previous, current])})
+
+
+@receiver(post_delete, sender=Review)
+def remove_doctor_rating(sender, instance, **kwargs):
+    """Убирает оценку удаленного опубликованного отзыва"""
+    if instance.is_published:
+        Doctor.apply_rating_delta(instance.doctor_id, -instance.rating, -1)
+        Doctor.refresh_popularity([instance.doctor_id])
@@ -0,0 +1,159 @@
+# main/sql_profiling.py
+"""Профилирование SQL по запросам: число запросов, время в БД и поиск N+1"""
+import logging
+import random
+import re
+import threading
+import time
+from collections import Counter, deque
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+_STRING_RE = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_RE = re.compile(r'\b\d+(?:\.\d+)?\b')
+_IN_LIST_RE = re.compile(r'\bIN \((?:\s*%s\s*,)*\s*%s\s*\)', re.IGNORECASE)
+_SPACE_RE = re.compile(r'\s+')
+
+_buffer = deque(maxlen=getattr(settings, 'SQL_PROFILE_BUFFER_SIZE', 500))
+_lock = threading.Lock()
+
+
+def sample_rate():
+    return getattr(settings, 'SQL_PROFILE_SAMPLE_RATE', 0.0)
+
+
+def _repeat_threshold():
+    return getattr(settings, 'SQL_PROFILE_N_PLUS_ONE_THRESHOLD', 10)
+
+
+def fingerprint(sql):
+    """Текст запроса без литералов: одинаковые по форме запросы дают один отпечаток"""
+    sql = _STRING_RE.sub('%s', sql)
+    sql = _NUMBER_RE.sub('%s', sql)
+    sql = _IN_LIST_RE.sub('IN (...)', sql)
+    return _SPACE_RE.sub(' ', sql).strip()
+
+
+class QueryRecorder:
+    """Обертка execute_wrapper, считающая запросы и время выполнения"""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.fingerprints = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - started
+            self.count += 1
+            self.fingerprints[fingerprint(sql)] += 1
+
+    def repeated(self, threshold):
+        """Отпечатки, повторенные больше threshold раз - вероятные N+1"""
+        return [
+            {'fingerprint': sql, 'count': count}
+            for sql, count in self.fingerprints.most_common()
+            if count > threshold
+        ]
+
+
+class SQLProfilingMiddleware:
+    """Профилирует выборку запросов (SQL_PROFILE_SAMPLE_RATE) и пишет итоги в кольцевой буфер.
+
+    Запросы вне выборки проходят без обертки, поэтому при малой доле
+    выборки накладные расходы в продакшене пренебрежимо малы.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        rate = sample_rate()
+        if rate <= 0 or random.random() >= rate:
+            return self.get_response(request)
+
+        recorder = QueryRecorder()
+        started = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(recorder))
+            response = self.get_response(request)
+        record(request, response, recorder, time.perf_counter() - started)
+        return response
+
+
+def record(request, response, recorder, duration):
+    """Сохраняет итоги запроса в буфер и предупреждает о вероятном N+1"""
+    match = getattr(request, 'resolver_match', None)
+    repeated = recorder.repeated(_repeat_threshold())
+    entry = {
+        'url_name': match.view_name if match else None,
+        'path': request.path,
+        'method': request.method,
+        'status': response.status_code,
+        'queries': recorder.count,
+        'sql_ms': round(recorder.duration * 1000, 2),
+        'total_ms': round(duration * 1000, 2),
+        'n_plus_one': repeated,
+        'timestamp': timezone.now().isoformat(),
+    }
+    with _lock:
+        _buffer.append(entry)
+
+    if repeated:
+        logger.warning(
+            'Вероятный N+1 на %s %s: %s',
+            request.method, entry['url_name'] or request.path,
+            '; '.join(f"{item['count']}x {item['fingerprint'][:200]}" for item in repeated)
+        )
+    return entry
+
+
+def recent(limit=None):
+    """Последние записи буфера, новые первыми"""
+    with _lock:
+        entries = list(_buffer)
+    entries.reverse()
+    return entries[:limit] if limit else entries
+
+
+def summary():
+    """Итоги буфера по имени URL: число запросов к странице, запросы к БД и время SQL"""
+    groups = {}
+    for entry in recent():
+        name = entry['url_name'] or entry['path']
+        group = groups.setdefault(name, {
+            'url_name': name,
+            'requests': 0,
+            'queries_total': 0,
+            'queries_max': 0,
+            'sql_ms_total': 0.0,
+            'sql_ms_max': 0.0,
+            'n_plus_one_requests': 0,
+        })
+        group['requests'] += 1
+        group['queries_total'] += entry['queries']
+        group['queries_max'] = max(group['queries_max'], entry['queries'])
+        group['sql_ms_total'] += entry['sql_ms']
+        group['sql_ms_max'] = max(group['sql_ms_max'], entry['sql_ms'])
+        group['n_plus_one_requests'] += bool(entry['n_plus_one'])
+
+    for group in groups.values():
+        group['queries_avg'] = round(group['queries_total'] / group['requests'], 1)
+        group['sql_ms_avg'] = round(group['sql_ms_total'] / group['requests'], 2)
+        group['sql_ms_total'] = round(group['sql_ms_total'], 2)
+    return sorted(groups.values(), key=lambda group: group['sql_ms_total'], reverse=True)
+
+
+def reset():
+    """Очищает буфер"""
+    with _lock:
+        _buffer.clear()
@@ -0,0 +1,191 @@
+# main/stats.py
+"""Дневная сводка записей врачей и статистика по ней"""
+from collections import Counter
+from datetime import timedelta
+from functools import reduce
+from operator import or_
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, Q
+from django.db.models.functions import ExtractHour, TruncDate
+from django.utils import timezone
+
+from . import background
+from .models import Appointment, DoctorDailyStats, RollupWatermark, Service
+from .timeranges import between_days
+
+WATERMARK = 'doctor_daily_stats'
+REFRESH_KEY = 'stats:daily:refresh'
+
+# Время суток приема: (поле сводки, час начала, час окончания)
+DAY_PARTS = (('morning', 9, 12), ('afternoon', 12, 17), ('evening', 17, 20))
+STATUS_FIELDS = [status for status, _ in Appointment.STATUS_CHOICES]
+WEEKDAYS = ['Понедельник', 'Вторник', 'Среда', 'Четверг', 'Пятница', 'Суббота', 'Воскресенье']
+
+# Пар (врач, день) на один запрос при инкрементальном пересчете
+CHUNK_SIZE = 200
+
+
+def _overlap():
+    # Запас на транзакции, зафиксированные позже своего updated_at
+    return timedelta(seconds=getattr(settings, 'STATS_REFRESH_OVERLAP', 300))
+
+
+def _aggregate(appointments):
+    """Строки сводки по записям: {(id врача, день): DoctorDailyStats}.
+
+    Группировка по дню и часу выполняется в БД переносимыми
+    TruncDate/ExtractHour в текущем часовом поясе.
+    """
+    rows = appointments.annotate(
+        day=TruncDate('appointment_time'),
+        hour=ExtractHour('appointment_time'),
+    ).values('doctor_id', 'day', 'hour', 'status', 'service_id').annotate(count=Count('pk')).order_by()
+
+    result = {}
+    for row in rows:
+        key = (row['doctor_id'], row['day'])
+        stats = result.get(key)
+        if stats is None:
+            stats = result[key] = DoctorDailyStats(doctor_id=row['doctor_id'], day=row['day'], services={})
+        count = row['count']
+        stats.total += count
+        setattr(stats, row['status'], getattr(stats, row['status']) + count)
+        for field, start, end in DAY_PARTS:
+            if start <= row['hour'] < end:
+                setattr(stats, field, getattr(stats, field) + count)
+        service_key = str(row['service_id'])
+        stats.services[service_key] = stats.services.get(service_key, 0) + count
+    return result
+
+
+def _day_filter(doctor_id, days):
+    return Q(doctor_id=doctor_id) & between_days('appointment_time', min(days), max(days))
+
+
+def chunked_days(pairs):
+    """Пары (id врача, день) порциями по CHUNK_SIZE: (пары, записи этих дней, условие по дням)"""
+    pairs = sorted(set(pairs))
+    for offset in range(0, len(pairs), CHUNK_SIZE):
+        chunk = pairs[offset:offset + CHUNK_SIZE]
+        days_by_doctor = {}
+        for doctor_id, day in chunk:
+            days_by_doctor.setdefault(doctor_id, []).append(day)
+        appointments = Appointment.objects.filter(
+            reduce(or_, (_day_filter(doctor_id, days) for doctor_id, days in days_by_doctor.items()))
+        )
+        rollup_days = reduce(or_, (
+            Q(doctor_id=doctor_id, day__in=days) for doctor_id, days in days_by_doctor.items()
+        ))
+        yield set(chunk), appointments, rollup_days
+
+
+def refresh_rollup(name, rebuild, stale_model, full=False):
+    """Общий цикл инкрементального пересчета сводной таблицы по отметке name.
+
+    rebuild(pairs) пересчитывает пары (id врача, день), а rebuild(None) -
+    всю таблицу. Затронутыми считаются дни записей, измененных после
+    отметки (с запасом на поздние коммиты), и строки stale_model,
+    помеченные устаревшими при удалении записи. Возвращает результат
+    rebuild.
+    """
+    started = timezone.now()
+    with transaction.atomic():
+        RollupWatermark.objects.get_or_create(name=name)
+        watermark = RollupWatermark.objects.select_for_update().get(name=name)
+
+        if full or watermark.value is None:
+            refreshed = rebuild(None)
+        else:
+            changed = Appointment.objects.filter(
+                updated_at__gt=watermark.value - _overlap()
+            ).annotate(day=TruncDate('appointment_time')).values_list('doctor_id', 'day').distinct()
+            stale = stale_model.objects.filter(is_stale=True).values_list('doctor_id', 'day').distinct()
+            refreshed = rebuild([*changed, *stale])
+
+        watermark.value = started
+        watermark.save(update_fields=['value'])
+    return refreshed
+
+
+def rebuild_days(pairs):
+    """Пересчитывает дневную сводку для пар (id врача, день); None - всю таблицу"""
+    if pairs is None:
+        DoctorDailyStats.objects.all().delete()
+        computed = _aggregate(Appointment.objects.all())
+        DoctorDailyStats.objects.bulk_create(computed.values(), batch_size=500)
+        return len(computed)
+
+    refreshed = 0
+    for wanted, appointments, rollup_days in chunked_days(pairs):
+        computed = _aggregate(appointments)
+        DoctorDailyStats.objects.filter(rollup_days).delete()
+        DoctorDailyStats.objects.bulk_create(
+            [stats for key, stats in computed.items() if key in wanted], batch_size=500
+        )
+        refreshed += len(wanted)
+    return refreshed
+
+
+def refresh(full=False):
+    """Учитывает в дневной сводке записи, измененные после прошлого пересчета.
+
+    Каждый затронутый день врача пересчитывается целиком; при full или
+    первом запуске сводка строится заново. Возвращает число
+    пересчитанных дней.
+    """
+    return refresh_rollup(WATERMARK, rebuild_days, DoctorDailyStats, full=full)
+
+
+def sweep(interval=300):
+    """Инкрементальный пересчет не чаще раза в interval секунд на все процессы"""
+    if cache.add(REFRESH_KEY, True, timeout=interval):
+        return refresh()
+    return 0
+
+
+def schedule_sweep():
+    """Запускает sweep в фоне после ответа, не задерживая запрос.
+
+    Страница читает уже посчитанную сводку, а пересчет - в том числе
+    полный при первом запуске - выполняется вне запроса или командой
+    refresh_doctor_stats по cron.
+    """
+    if not cache.get(REFRESH_KEY):
+        background.schedule('stats', sweep)
+
+
+def mark_stale(doctor_id, day):
+    """Помечает день врача для пересчета (удаление записи не меняет updated_at)"""
+    DoctorDailyStats.objects.filter(doctor_id=doctor_id, day=day).update(is_stale=True)
+
+
+def doctor_summary(doctor, start_date, end_date, top_services=5):
+    """Статистика врача за период по строкам дневной сводки.
+
+    Читается по строке на день с записями, так что время ответа не
+    зависит от числа записей и почти не зависит от длины периода.
+    """
+    days = list(DoctorDailyStats.objects.filter(doctor=doctor, day__range=[start_date, end_date]))
+
+    by_weekday = [0] * 7
+    services = Counter()
+    totals = Counter()
+    for stats in days:
+        by_weekday[stats.day.weekday()] += stats.total
+        services.update({int(service_id): count for service_id, count in stats.services.items()})
+        for field in ['total', *STATUS_FIELDS, *(part for part, _, _ in DAY_PARTS)]:
+            totals[field] += getattr(stats, field)
+
+    popular = services.most_common(top_services)
+    names = dict(Service.objects.filter(pk__in=[service_id for service_id, _ in popular]).values_list('pk', 'name'))
+    return {
+        'total': totals['total'],
+        'by_status': {status: totals[status] for status in STATUS_FIELDS},
+        'by_weekday': list(zip(WEEKDAYS, by_weekday)),
+        'by_day_part': {part: totals[part] for part, _, _ in DAY_PARTS},
+        'popular_services': [(names.get(service_id, '—'), count) for service_id, count in popular],
+        'active_days': len(days),
+    }
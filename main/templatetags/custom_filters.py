@@ -1,3 +1,5 @@
+from datetime import timedelta
+
 from django import template
 
 register = template.Library()
@@ -7,4 +9,9 @@ def get_item(dictionary, key):
     """Получает значение из словаря по ключу"""
     if isinstance(dictionary, dict):
         return dictionary.get(key)
-    return None
\ No newline at end of file
+    return None
+
+@register.filter
+def add_days(value, days):
+    """Прибавляет к дате указанное количество дней"""
+    return value + timedelta(days=int(days))
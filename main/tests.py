@@ -1,3 +1,1443 @@
-from django.test import TestCase
+import json
+import threading
+import time as timer
+from collections import deque
+from datetime import date, time, timedelta
+from io import StringIO
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.management import call_command
+from django.db import IntegrityError, connection, transaction
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import get_resolver, reverse
+from django.utils import timezone
+
+from . import analytics, availability, background, pagination, sql_profiling, stats, waitlist
+from .booking import SlotUnavailable, book_appointment, book_batch, hold_slot
+from .models import (Appointment, AppointmentCounter, AppointmentFact, Department, Doctor, DoctorDailyStats,
+                     DoctorSchedule, News, Patient, Review, ScheduleSlot, Service, Specialization,
+                     WaitlistEntry, WeeklyScheduleTemplate)
+from .scheduling import build_slot_grid, covers_interval, make_aware_datetime, sweep_free_slots
+from .timeranges import between_days, in_hours, in_slot, on_day
+
+
+def create_doctor(username='doctor', **kwargs):
+    specialization = Specialization.objects.get_or_create(name='Терапевт')[0]
+    defaults = {
+        'user': User.objects.create_user(username=username, password='password'),
+        'first_name': 'Иван',
+        'last_name': 'Петров',
+        'specialization': specialization,
+        'experience': 10,
+        'education': 'СПбГМУ',
+    }
+    defaults.update(kwargs)
+    return Doctor.objects.create(**defaults)
+
+
+def create_patient(index, **kwargs):
+    user = User.objects.create_user(username=f'patient{index}', password='password',
+                                    first_name='Пациент', last_name=str(index))
+    defaults = {
+        'birth_date': date(1990, 1, 1),
+        'gender': 'M',
+        'insurance_policy': f'{index:016d}',
+        'phone': '+70000000000',
+        'address': 'Москва',
+    }
+    defaults.update(kwargs)
+    return Patient.objects.create(user=user, **defaults)
+
+
+def create_schedule(doctor, day=None):
+    return DoctorSchedule.objects.create(
+        doctor=doctor,
+        date=day or date.today() + timedelta(days=1),
+        start_time=time(9, 0),
+        end_time=time(18, 0),
+    )
+
+
+def create_service(doctor):
+    service = Service.objects.create(
+        name='Консультация',
+        category='consultation',
+        description='Первичный прием',
+        price=1000,
+    )
+    service.doctors.add(doctor)
+    return service
+
+
+class SweepFreeSlotsTests(SimpleTestCase):
+    """Свободные слоты сетки за вычетом интервалов занятости"""
+
+    day = date(2026, 3, 2)
+
+    def at(self, hour, minute=0):
+        return make_aware_datetime(self.day, time(hour, minute))
+
+    def setUp(self):
+        # 9:00-12:00 по 30 минут
+        self.grid = build_slot_grid(self.day, time(9, 0), time(12, 0), 30)
+
+    def free_starts(self, busy):
+        return [start for start, _ in sweep_free_slots(self.grid, busy)]
+
+    def test_overlapping_busy_intervals(self):
+        busy = [(self.at(9, 15), self.at(10, 0)), (self.at(9, 45), self.at(10, 20))]
+        self.assertEqual(self.free_starts(busy), [self.at(10, 30), self.at(11), self.at(11, 30)])
+
+    def test_touching_busy_intervals(self):
+        # Интервалы стык в стык и интервал, кончающийся ровно в начале слота
+        busy = [(self.at(9), self.at(9, 30)), (self.at(9, 30), self.at(10)), (self.at(10, 30), self.at(11))]
+        self.assertEqual(self.free_starts(busy), [self.at(10), self.at(11), self.at(11, 30)])
+
+    def test_busy_intervals_past_the_grid(self):
+        busy = [(self.at(8), self.at(9, 10)), (self.at(11, 50), self.at(13)), (self.at(14), self.at(15))]
+        self.assertEqual(self.free_starts(busy), [self.at(9, 30), self.at(10), self.at(10, 30), self.at(11)])
+
+    def test_unsorted_busy_intervals(self):
+        busy = [(self.at(11), self.at(11, 30)), (self.at(9), self.at(9, 30))]
+        self.assertEqual(self.free_starts(busy), [self.at(9, 30), self.at(10), self.at(10, 30), self.at(11, 30)])
+
+    def test_empty_grid_and_no_busy(self):
+        self.assertEqual(sweep_free_slots([], [(self.at(9), self.at(10))]), [])
+        self.assertEqual(sweep_free_slots(self.grid, []), self.grid)
+
+
+class BookingConstraintTests(TestCase):
+    """Уникальность активной записи на врача и время"""
+
+    def setUp(self):
+        self.doctor = create_doctor()
+        self.service = create_service(self.doctor)
+        self.schedule = create_schedule(self.doctor)
+        self.appointment_time = make_aware_datetime(self.schedule.date, time(10, 0))
+
+    def create_appointment(self, patient, status='pending'):
+        return Appointment.objects.create(
+            patient=patient,
+            doctor=self.doctor,
+            service=self.service,
+            schedule=self.schedule,
+            appointment_time=self.appointment_time,
+            status=status,
+        )
+
+    def test_second_active_appointment_rejected_by_database(self):
+        self.create_appointment(create_patient(1))
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            self.create_appointment(create_patient(2))
+
+    def test_cancelled_appointment_frees_time(self):
+        first = self.create_appointment(create_patient(1))
+        first.status = 'cancelled'
+        first.save()
+        self.create_appointment(create_patient(2))
+        self.assertEqual(
+            Appointment.objects.filter(status__in=Appointment.ACTIVE_STATUSES).count(), 1
+        )
+
+    def reactivation_target(self):
+        cancelled = self.create_appointment(create_patient(1))
+        cancelled.status = 'cancelled'
+        cancelled.save()
+        self.create_appointment(create_patient(2))
+        return cancelled
+
+    def test_doctor_cannot_reactivate_onto_taken_time(self):
+        cancelled = self.reactivation_target()
+        self.client.force_login(self.doctor.user)
+        response = self.client.post(reverse('doctor_appointment_detail', args=[cancelled.pk]),
+                                    {'status': 'confirmed'}, follow=True)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Это время уже занято')
+        cancelled.refresh_from_db()
+        self.assertEqual(cancelled.status, 'cancelled')
+
+    def test_admin_cannot_reactivate_onto_taken_time(self):
+        cancelled = self.reactivation_target()
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'password'))
+        local = timezone.localtime(cancelled.appointment_time)
+        response = self.client.post(reverse('admin:main_appointment_change', args=[cancelled.pk]), {
+            'patient': cancelled.patient_id,
+            'doctor': self.doctor.pk,
+            'service': self.service.pk,
+            'schedule': self.schedule.pk,
+            'appointment_time_0': local.date().isoformat(),
+            'appointment_time_1': local.strftime('%H:%M:%S'),
+            'status': 'confirmed',
+            'symptoms': '',
+            'notes': '',
+            'created_by': '',
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Это время уже занято')
+        cancelled.refresh_from_db()
+        self.assertEqual(cancelled.status, 'cancelled')
+
+    def held_by_other(self):
+        cancelled = self.create_appointment(create_patient(1))
+        cancelled.status = 'cancelled'
+        cancelled.save()
+        other = User.objects.create_user(username='other', password='password')
+        cancelled.get_overlapping_slots().update(
+            state=ScheduleSlot.HELD, held_by=other, held_until=timezone.now() + timedelta(minutes=5)
+        )
+        return cancelled
+
+    def test_reactivation_onto_held_slots_is_rolled_back(self):
+        cancelled = self.held_by_other()
+        cancelled.status = 'pending'
+        with self.assertRaises(SlotUnavailable):
+            cancelled.save()
+        cancelled.refresh_from_db()
+        self.assertEqual(cancelled.status, 'cancelled')
+        self.assertFalse(cancelled.get_overlapping_slots().exclude(state=ScheduleSlot.HELD).exists())
+
+    def test_doctor_cannot_reactivate_onto_held_slots(self):
+        cancelled = self.held_by_other()
+        self.client.force_login(self.doctor.user)
+        response = self.client.post(reverse('doctor_appointment_detail', args=[cancelled.pk]),
+                                    {'status': 'confirmed'}, follow=True)
+        self.assertContains(response, 'Это время уже занято')
+        cancelled.refresh_from_db()
+        self.assertEqual(cancelled.status, 'cancelled')
+
+    def test_clean_rejects_reactivation_onto_held_slots(self):
+        cancelled = self.held_by_other()
+        cancelled.status = 'confirmed'
+        with self.assertRaises(ValidationError):
+            cancelled.clean()
+
+    def test_book_appointment_reports_taken_slot(self):
+        book_appointment(create_patient(1), self.doctor, self.service, self.schedule,
+                         self.appointment_time)
+        with self.assertRaises(SlotUnavailable):
+            book_appointment(create_patient(2), self.doctor, self.service, self.schedule,
+                             self.appointment_time)
+
+
+class AvailabilityCacheTests(TestCase):
+    """Кэш свободных слотов (врач, дата): попадания, промахи и сброс по событиям"""
+
+    def setUp(self):
+        cache.clear()
+        self.doctor = create_doctor()
+        self.service = create_service(self.doctor)
+        self.schedule = create_schedule(self.doctor)
+        self.day = self.schedule.date
+        self.patient = create_patient(1)
+
+    def cached(self, doctor=None, day=None):
+        return cache.get(availability.cache_key((doctor or self.doctor).pk, day or self.day))
+
+    def book(self, hour=10):
+        with self.captureOnCommitCallbacks(execute=True):
+            return book_appointment(self.patient, self.doctor, self.service, self.schedule,
+                                    make_aware_datetime(self.day, time(hour, 0)))
+
+    def test_hits_and_misses_counted(self):
+        availability.reset_cache_stats()
+        first = availability.get_free_slots(self.doctor.pk, self.day)
+        with self.assertNumQueries(0):
+            second = availability.get_free_slots(self.doctor.pk, self.day)
+        self.assertEqual(first, second)
+        self.assertIn(time(10, 0), first)
+        counters = availability.get_cache_stats()
+        self.assertEqual((counters['hits'], counters['misses'], counters['hit_ratio']), (1, 1, 0.5))
+
+    def test_booking_invalidates_day(self):
+        availability.get_free_slots(self.doctor.pk, self.day)
+        self.book()
+        self.assertIsNone(self.cached())
+        self.assertNotIn(time(10, 0), availability.get_free_slots(self.doctor.pk, self.day))
+
+    def test_status_change_invalidates_day(self):
+        appointment = self.book()
+        availability.get_free_slots(self.doctor.pk, self.day)
+        appointment.status = 'cancelled'
+        with self.captureOnCommitCallbacks(execute=True):
+            appointment.save()
+        self.assertIsNone(self.cached())
+        self.assertIn(time(10, 0), availability.get_free_slots(self.doctor.pk, self.day))
+
+    def test_deleting_appointment_invalidates_day(self):
+        appointment = self.book()
+        availability.get_free_slots(self.doctor.pk, self.day)
+        with self.captureOnCommitCallbacks(execute=True):
+            appointment.delete()
+        self.assertIsNone(self.cached())
+
+    def test_move_invalidates_previous_doctor_and_day(self):
+        appointment = self.book()
+        other = create_doctor('other')
+        self.service.doctors.add(other)
+        next_day = create_schedule(other, self.day + timedelta(days=1))
+        availability.get_free_slots(self.doctor.pk, self.day)
+        availability.get_free_slots(other.pk, next_day.date)
+
+        appointment.doctor = other
+        appointment.schedule = next_day
+        appointment.appointment_time = make_aware_datetime(next_day.date, time(11, 0))
+        with self.captureOnCommitCallbacks(execute=True):
+            appointment.save()
+
+        self.assertIsNone(self.cached())
+        self.assertIsNone(self.cached(other, next_day.date))
+        self.assertIn(time(10, 0), availability.get_free_slots(self.doctor.pk, self.day))
+
+    def test_schedule_save_and_delete_invalidate_day(self):
+        availability.get_free_slots(self.doctor.pk, self.day)
+        self.schedule.end_time = time(12, 0)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.schedule.save()
+        self.assertIsNone(self.cached())
+        self.assertNotIn(time(15, 0), availability.get_free_slots(self.doctor.pk, self.day))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.schedule.delete()
+        self.assertIsNone(self.cached())
+        self.assertEqual(availability.get_free_slots(self.doctor.pk, self.day), [])
+
+    def test_schedule_date_change_invalidates_both_days(self):
+        next_day = self.day + timedelta(days=1)
+        availability.get_free_slots(self.doctor.pk, self.day)
+        availability.get_free_slots(self.doctor.pk, next_day)
+        self.schedule.date = next_day
+        with self.captureOnCommitCallbacks(execute=True):
+            self.schedule.save()
+        self.assertIsNone(self.cached())
+        self.assertIsNone(self.cached(day=next_day))
+
+
+class ScheduleMaterializeTests(TestCase):
+    """Развертывание недельных шаблонов пропускает существующие дни и создает слоты новым"""
+
+    def setUp(self):
+        self.doctor = create_doctor()
+        for weekday in range(5):
+            WeeklyScheduleTemplate.objects.create(doctor=self.doctor, weekday=weekday, room='101')
+        today = timezone.localdate()
+        self.monday = today + timedelta(days=7 - today.weekday())
+        # Существующий день без слотов (например, закрытый вручную) не считается новым
+        self.existing = create_schedule(self.doctor, self.monday)
+        self.existing.slots.all().delete()
+
+    def test_existing_days_skipped(self):
+        created = WeeklyScheduleTemplate.materialize(self.doctor, weeks=1, start_date=self.monday)
+
+        self.assertEqual(created, 4)
+        self.assertFalse(self.existing.slots.exists())
+        new_days = DoctorSchedule.objects.filter(doctor=self.doctor).exclude(pk=self.existing.pk)
+        self.assertEqual(sorted(new_days.values_list('date', flat=True)),
+                         [self.monday + timedelta(days=offset) for offset in range(1, 5)])
+        for schedule in new_days:
+            self.assertEqual(schedule.slots.count(), 18)
+
+    def test_bulk_create_counts_only_new_days(self):
+        schedules = [DoctorSchedule(doctor=self.doctor, date=self.monday + timedelta(days=offset),
+                                    start_time=time(9, 0), end_time=time(12, 0))
+                     for offset in range(2)]
+        self.assertEqual(DoctorSchedule.bulk_create_with_slots(self.doctor, schedules), 1)
+        self.assertFalse(self.existing.slots.exists())
+        self.assertEqual(ScheduleSlot.objects.filter(doctor=self.doctor).count(), 6)
+
+    def test_command_is_idempotent(self):
+        output = StringIO()
+        call_command('materialize_schedules', weeks=2, stdout=output)
+        days = DoctorSchedule.objects.filter(doctor=self.doctor).count()
+        self.assertGreater(days, 1)
+
+        output = StringIO()
+        call_command('materialize_schedules', weeks=2, stdout=output)
+        self.assertIn('Всего создано дней расписания: 0', output.getvalue())
+        self.assertEqual(DoctorSchedule.objects.filter(doctor=self.doctor).count(), days)
+
+
+class MovedAppointmentSlotTests(TestCase):
+    """Перенос активной записи освобождает прежние слоты и занимает новые целиком"""
+
+    def setUp(self):
+        self.doctor = create_doctor()
+        self.service = create_service(self.doctor)
+        self.schedule = create_schedule(self.doctor)
+
+    def at(self, hour, minute=0):
+        return make_aware_datetime(self.schedule.date, time(hour, minute))
+
+    def book(self, index, moment):
+        return book_appointment(create_patient(index), self.doctor, self.service, self.schedule, moment)
+
+    def slot(self, moment):
+        return ScheduleSlot.objects.get(doctor=self.doctor, start=moment)
+
+    def test_move_releases_previous_slots(self):
+        appointment = self.book(1, self.at(10))
+        appointment.appointment_time = self.at(11)
+        appointment.save()
+
+        self.assertEqual(self.slot(self.at(10)).state, ScheduleSlot.FREE)
+        self.assertIsNone(self.slot(self.at(10)).appointment_id)
+        self.assertEqual(self.slot(self.at(11)).appointment_id, appointment.pk)
+        self.assertTrue(appointment.owns_all_slots())
+
+    def test_move_onto_overlapping_booking_rejected(self):
+        first = self.book(1, self.at(10))
+        second = self.book(2, self.at(12))
+        second.appointment_time = self.at(10, 15)
+        with self.assertRaises(SlotUnavailable):
+            second.save()
+
+        second.refresh_from_db()
+        self.assertEqual(second.appointment_time, self.at(12))
+        self.assertEqual(self.slot(self.at(10)).appointment_id, first.pk)
+        self.assertEqual(self.slot(self.at(12)).appointment_id, second.pk)
+
+    def test_clean_rejects_move_onto_taken_slots(self):
+        self.book(1, self.at(10))
+        second = self.book(2, self.at(12))
+        second.appointment_time = self.at(10)
+        with self.assertRaises(ValidationError):
+            second.clean()
+
+
+class SlotCoverageTests(TestCase):
+    """Слоты записи и удержания без разрывов покрывают весь интервал приема"""
+
+    def setUp(self):
+        self.doctor = create_doctor()
+        self.service = create_service(self.doctor)
+        self.schedule = create_schedule(self.doctor)
+        self.patient = create_patient(1)
+
+    def at(self, hour, minute=0):
+        return make_aware_datetime(self.schedule.date, time(hour, minute))
+
+    def test_covers_interval(self):
+        slots = [(self.at(9), self.at(9, 30)), (self.at(9, 30), self.at(10))]
+        self.assertTrue(covers_interval(slots, self.at(9), self.at(10)))
+        self.assertTrue(covers_interval(slots, self.at(9), self.at(9, 20)))
+        self.assertFalse(covers_interval(slots, self.at(8, 50), self.at(9, 20)))
+        self.assertFalse(covers_interval(slots, self.at(9, 30), self.at(10, 30)))
+        self.assertFalse(covers_interval(slots[::2] + [(self.at(10), self.at(10, 30))],
+                                         self.at(9), self.at(10, 30)))
+        self.assertFalse(covers_interval([], self.at(9), self.at(9, 30)))
+
+    def test_booking_outside_schedule_rejected(self):
+        for moment in (self.at(8, 50), self.at(17, 50), self.at(10, 15)):
+            with self.subTest(moment=moment), self.assertRaises(SlotUnavailable):
+                book_appointment(self.patient, self.doctor, self.service, self.schedule, moment)
+        self.assertFalse(Appointment.objects.exists())
+
+    def test_hold_outside_schedule_rejected(self):
+        with self.assertRaises(SlotUnavailable):
+            hold_slot(self.patient.user, self.doctor, self.at(8, 50), 30)
+        self.assertFalse(ScheduleSlot.objects.filter(state=ScheduleSlot.HELD).exists())
+
+    def test_batch_row_outside_schedule_rejected(self):
+        rows = [{'insurance_policy': self.patient.insurance_policy, 'doctor': self.doctor.pk,
+                 'service': self.service.pk, 'datetime': self.at(hour, minute).isoformat()}
+                for hour, minute in ((8, 50), (17, 50), (10, 0))]
+        results = book_batch(rows, dry_run=True)
+        self.assertEqual([result['status'] for result in results], ['error', 'error', 'ok'])
+
+
+class ScheduleRangeRemoveTests(TestCase):
+    """Удаление расписания на диапазон (отпуск) не удаляет записи пациентов"""
+
+    def setUp(self):
+        self.doctor = create_doctor()
+        self.service = create_service(self.doctor)
+        self.first_day = date.today() + timedelta(days=1)
+        self.schedules = [create_schedule(self.doctor, self.first_day + timedelta(days=offset)) for offset in range(3)]
+        self.appointment = book_appointment(create_patient(1), self.doctor, self.service, self.schedules[1],
+                                            make_aware_datetime(self.schedules[1].date, time(10, 0)))
+        self.client.force_login(self.doctor.user)
+
+    def remove(self, start, end):
+        return self.client.post(reverse('doctor_working_schedule'), {
+            'action': 'remove', 'start_date': start.isoformat(), 'end_date': end.isoformat(),
+        }, follow=True)
+
+    def test_booked_days_survive_vacation_remove(self):
+        response = self.remove(self.first_day, self.first_day + timedelta(days=2))
+
+        self.assertTrue(Appointment.objects.filter(pk=self.appointment.pk, status='pending').exists())
+        kept = DoctorSchedule.objects.get(doctor=self.doctor)
+        self.assertEqual(kept.pk, self.schedules[1].pk)
+        self.assertFalse(kept.is_available)
+        self.assertContains(response, self.schedules[1].date.strftime('%d.%m.%Y'))
+
+    def test_single_day_remove_keeps_booked_day(self):
+        self.client.post(reverse('doctor_working_schedule'), {
+            'action': 'remove', 'date': self.schedules[1].date.isoformat(),
+        })
+        self.assertTrue(DoctorSchedule.objects.filter(pk=self.schedules[1].pk).exists())
+        self.assertTrue(Appointment.objects.filter(pk=self.appointment.pk).exists())
+
+
+class SlotRegenerationTests(TestCase):
+    """Изменение часов приема не сбрасывает удержания и занятые слоты"""
+
+    def setUp(self):
+        self.doctor = create_doctor()
+        self.service = create_service(self.doctor)
+        self.schedule = create_schedule(self.doctor)
+        day = self.schedule.date
+        self.appointment = book_appointment(create_patient(1), self.doctor, self.service, self.schedule,
+                                            make_aware_datetime(day, time(11, 0)))
+        self.holder = User.objects.create_user(username='holder', password='password')
+        self.held = ScheduleSlot.objects.get(doctor=self.doctor, start=make_aware_datetime(day, time(10, 0)))
+        self.held.state, self.held.held_by = ScheduleSlot.HELD, self.holder
+        self.held.held_until = timezone.now() + timedelta(minutes=5)
+        self.held.save()
+
+    def test_edit_keeps_held_and_booked_slots_inside_hours(self):
+        booked_ids = set(self.appointment.slots.values_list('id', flat=True))
+        self.schedule.end_time = time(17, 0)
+        self.schedule.save()
+
+        self.held.refresh_from_db()
+        self.assertEqual((self.held.state, self.held.held_by), (ScheduleSlot.HELD, self.holder))
+        self.assertEqual(set(self.appointment.slots.values_list('id', flat=True)), booked_ids)
+        slots = ScheduleSlot.objects.filter(schedule=self.schedule)
+        self.assertFalse(slots.filter(end__gt=make_aware_datetime(self.schedule.date, time(17, 0))).exists())
+        self.assertEqual(slots.count(), 16)
+
+    def test_edit_rebuilds_free_slots_around_kept_ones(self):
+        # Новая длительность слота: свободные слоты не пересекают сохраненные
+        self.schedule.slot_duration = 20
+        self.schedule.save()
+
+        slots = list(ScheduleSlot.objects.filter(schedule=self.schedule).order_by('start'))
+        self.assertTrue(all(first.end <= second.start for first, second in zip(slots, slots[1:])))
+        self.assertIn(self.held.pk, [slot.pk for slot in slots])
+
+    def test_slots_outside_new_hours_are_dropped(self):
+        self.schedule.start_time = time(10, 30)
+        self.schedule.save()
+        self.assertFalse(ScheduleSlot.objects.filter(pk=self.held.pk).exists())
+        self.assertTrue(self.appointment.slots.exists())
+
+
+class EarliestSlotTests(TestCase):
+    """Ближайшее время учитывает длительность услуги"""
+
+    def setUp(self):
+        self.doctor = create_doctor()
+        self.service = create_service(self.doctor)
+        self.service.duration = 60
+        self.service.save()
+        self.schedule = create_schedule(self.doctor)
+        self.day = self.schedule.date
+        self.patient = create_patient(1)
+        ScheduleSlot.objects.filter(doctor=self.doctor, start=self.at(9, 30)).update(state=ScheduleSlot.BOOKED)
+
+    def at(self, hour, minute=0):
+        return make_aware_datetime(self.day, time(hour, minute))
+
+    def test_start_needs_free_slots_for_whole_duration(self):
+        # 9:00 свободно, но 9:30 занято - часовой прием начнется не раньше 10:00
+        slots = availability.find_earliest_slots([self.doctor], limit=2, duration=60)
+        self.assertEqual([slot.start for slot in slots], [self.at(10), self.at(10, 30)])
+        self.assertEqual(availability.find_earliest_slots([self.doctor])[0].start, self.at(9))
+
+    def test_quick_booking_tries_next_start_when_hold_fails(self):
+        stale = availability.find_earliest_slots([self.doctor], limit=3, duration=60)
+        other = User.objects.create_user(username='other', password='password')
+        ScheduleSlot.objects.filter(doctor=self.doctor, start=self.at(10)).update(
+            state=ScheduleSlot.HELD, held_by=other, held_until=timezone.now() + timedelta(minutes=5)
+        )
+        self.client.force_login(self.patient.user)
+        with mock.patch('main.views.availability.find_earliest_slots', return_value=stale):
+            response = self.client.post(reverse('appointment_step2_service', args=[self.service.pk]),
+                                        {'earliest': '1'})
+        self.assertRedirects(response, reverse('appointment_step5'), fetch_redirect_response=False)
+        self.assertEqual(self.client.session['appointment_time'], '10:30:00')
+
+
+class AppointmentNumberTests(TestCase):
+    """Выдача номеров записей счетчиком по дням"""
+
+    day = date(2026, 3, 2)
+
+    def numbers(self, *numbers, day=None):
+        return [AppointmentCounter.format_number(day or self.day, number) for number in numbers]
+
+    def test_sequential_allocation(self):
+        self.assertEqual(AppointmentCounter.allocate_numbers(day=self.day), self.numbers(1))
+        self.assertEqual(AppointmentCounter.allocate_numbers(day=self.day), self.numbers(2))
+        self.assertEqual(self.numbers(2), ['APT-20260302-0002'])
+
+    def test_block_allocation(self):
+        AppointmentCounter.allocate_numbers(day=self.day)
+        self.assertEqual(AppointmentCounter.allocate_numbers(3, day=self.day), self.numbers(2, 3, 4))
+        self.assertEqual(AppointmentCounter.allocate_numbers(day=self.day), self.numbers(5))
+
+    def test_day_rollover(self):
+        next_day = self.day + timedelta(days=1)
+        AppointmentCounter.allocate_numbers(2, day=self.day)
+        self.assertEqual(AppointmentCounter.allocate_numbers(day=next_day), self.numbers(1, day=next_day))
+        self.assertEqual(AppointmentCounter.allocate_numbers(day=self.day), self.numbers(3))
+
+    def test_seed_continues_existing_numbers(self):
+        doctor = create_doctor()
+        schedule = create_schedule(doctor)
+        for number in (7, 41):
+            Appointment.objects.create(
+                patient=create_patient(number), doctor=doctor, service=create_service(doctor),
+                schedule=schedule, appointment_time=make_aware_datetime(schedule.date, time(9, 0)),
+                status='completed', appointment_number=self.numbers(number)[0],
+            )
+        self.assertFalse(AppointmentCounter.objects.filter(day=self.day).exists())
+        self.assertEqual(AppointmentCounter.allocate_numbers(day=self.day), self.numbers(42))
+        # Номера других дней на затравку не влияют
+        self.assertEqual(AppointmentCounter.allocate_numbers(day=self.day - timedelta(days=1)),
+                         self.numbers(1, day=self.day - timedelta(days=1)))
+
+
+class BookingApiValidationTests(TestCase):
+    """Некорректные данные API записи дают 400, а не ошибку сервера"""
+
+    def setUp(self):
+        self.doctor = create_doctor()
+        self.service = create_service(self.doctor)
+        self.schedule = create_schedule(self.doctor)
+        self.client.force_login(create_patient(1).user)
+
+    def test_time_with_offset_rejected(self):
+        response = self.client.post(reverse('api_book_appointment'), json.dumps({
+            'doctor': self.doctor.pk, 'service': self.service.pk,
+            'date': self.schedule.date.isoformat(), 'time': '10:00+03:00',
+        }), content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Appointment.objects.exists())
+
+    def book(self, value):
+        return self.client.post(reverse('api_book_appointment'), json.dumps({
+            'doctor': self.doctor.pk, 'service': self.service.pk,
+            'date': self.schedule.date.isoformat(), 'time': value,
+        }), content_type='application/json')
+
+    def test_time_outside_working_hours_rejected(self):
+        for value in ('08:50', '17:50', '18:00'):
+            with self.subTest(time=value):
+                response = self.book(value)
+                self.assertEqual(response.status_code, 400)
+                self.assertIn('рабочие часы', response.json()['error'])
+        self.assertFalse(Appointment.objects.exists())
+
+    def test_time_off_slot_grid_rejected(self):
+        response = self.book('10:15')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('сеткой', response.json()['error'])
+        self.assertEqual(self.book('10:30').status_code, 201)
+
+
+class BatchRowValidationTests(TestCase):
+    """Строки пакета неверной формы дают ошибку строки, а не 500"""
+
+    def test_malformed_rows_reported_per_row(self):
+        rows = [
+            ['not', 'an', 'object'],
+            {'insurance_policy': 'P1', 'doctor': [1], 'service': 1, 'datetime': '2030-01-01T10:00'},
+            {'insurance_policy': 'P1', 'doctor': 1, 'service': {'id': 1}, 'datetime': '2030-01-01T10:00'},
+        ]
+        results = book_batch(rows, dry_run=True)
+        self.assertEqual([result['status'] for result in results], ['error'] * 3)
+        self.assertTrue(all(result['error'] for result in results))
+
+
+class HoldSlotTests(TestCase):
+    """Новое удержание не снимает слот, предложенный из листа ожидания"""
+
+    def setUp(self):
+        self.doctor = create_doctor()
+        self.schedule = create_schedule(self.doctor)
+        self.patient = create_patient(1)
+        self.moment = make_aware_datetime(self.schedule.date, time(10, 0))
+
+    def test_waitlist_offer_survives_new_hold(self):
+        WaitlistEntry.objects.create(patient=self.patient, doctor=self.doctor,
+                                     date_from=self.schedule.date, date_to=self.schedule.date)
+        offered = ScheduleSlot.objects.get(doctor=self.doctor, start=self.moment)
+        entry = waitlist.offer_slot(offered)
+        self.assertIsNotNone(entry)
+
+        hold_slot(self.patient.user, self.doctor, self.moment + timedelta(hours=2), 30)
+
+        offered.refresh_from_db()
+        self.assertEqual(offered.state, ScheduleSlot.HELD)
+        self.assertEqual(offered.held_by, self.patient.user)
+
+    def test_previous_hold_released(self):
+        first = self.moment
+        hold_slot(self.patient.user, self.doctor, first, 30)
+        hold_slot(self.patient.user, self.doctor, first + timedelta(hours=2), 30)
+        self.assertFalse(ScheduleSlot.objects.filter(
+            doctor=self.doctor, start=first, state=ScheduleSlot.HELD
+        ).exists())
+
+
+class ConcurrentBookingTests(TransactionTestCase):
+    """Параллельные попытки занять одно время: побеждает ровно одна"""
+
+    workers = 8
+
+    def test_only_one_concurrent_booking_wins(self):
+        doctor = create_doctor()
+        service = create_service(doctor)
+        schedule = create_schedule(doctor)
+        appointment_time = make_aware_datetime(schedule.date, time(10, 0))
+        patients = [create_patient(index) for index in range(self.workers)]
+
+        barrier = threading.Barrier(self.workers)
+        results = []
+        lock = threading.Lock()
+
+        def worker(patient):
+            try:
+                barrier.wait()
+                book_appointment(patient, doctor, service, schedule, appointment_time)
+                outcome = 'booked'
+            except SlotUnavailable:
+                outcome = 'unavailable'
+            except Exception as exc:
+                outcome = exc
+            finally:
+                connection.close()
+            with lock:
+                results.append(outcome)
+
+        threads = [threading.Thread(target=worker, args=(patient,)) for patient in patients]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(results.count('booked'), 1, results)
+        self.assertEqual(results.count('unavailable'), self.workers - 1, results)
+        self.assertEqual(
+            Appointment.objects.filter(doctor=doctor, status__in=Appointment.ACTIVE_STATUSES).count(), 1
+        )
+        self.assertEqual(
+            ScheduleSlot.objects.filter(doctor=doctor, state=ScheduleSlot.BOOKED).count(), 1
+        )
+
+
+def build_clinic(scale):
+    """Тестовая клиника, размер которой растет с scale.
+
+    Врачи, услуги, расписания на 11 дней, пациенты с прошедшими и
+    предстоящими записями, отзывы, новости и лист ожидания. Возвращает
+    словарь с объектами, от имени которых открываются страницы.
+    """
+    department = Department.objects.create(name='Терапевтическое отделение', floor=2)
+    specializations = [Specialization.objects.create(name=name) for name in ('Терапевт', 'Кардиолог', 'Невролог')]
+
+    doctors = []
+    for index in range(3 * scale):
+        doctors.append(create_doctor(
+            username=f'doctor{index}',
+            last_name=f'Врач{index}',
+            specialization=specializations[index % 3],
+            department=department,
+        ))
+
+    services = []
+    for index in range(2 * scale):
+        service = Service.objects.create(
+            name=f'Услуга {index}',
+            description='Описание услуги',
+            price=1000 + index,
+            duration=30,
+        )
+        service.doctors.add(*doctors[index % 3::3])
+        services.append(service)
+
+    today = timezone.localdate()
+    for doctor in doctors:
+        DoctorSchedule.bulk_create_with_slots(doctor, [
+            DoctorSchedule(doctor=doctor, date=today + timedelta(days=offset),
+                           start_time=time(9, 0), end_time=time(18, 0), room='101')
+            for offset in range(-3, 8)
+        ])
+    schedules = {(schedule.doctor_id, schedule.date): schedule for schedule in DoctorSchedule.objects.all()}
+
+    patients = [create_patient(index) for index in range(4 * scale)]
+    doctor, patient = doctors[0], patients[0]
+    appointments = []
+    for index, visitor in enumerate(patients):
+        # Каждый пациент был у основного врача и записан к нему же и к другому врачу
+        visits = [
+            (doctor, -1 - index % 3, 'completed'),
+            (doctor, 1 + index % 7, 'confirmed' if index % 2 else 'pending'),
+            (doctors[1 + index % (len(doctors) - 1)], 2 + index % 5, 'pending'),
+        ]
+        for visit_doctor, offset, status in visits:
+            day = today + timedelta(days=offset)
+            minutes = 30 * (index // 3 + (visit_doctor != doctor))
+            appointments.append(Appointment.objects.create(
+                patient=visitor,
+                doctor=visit_doctor,
+                service=services[0],
+                schedule=schedules[(visit_doctor.id, day)],
+                appointment_time=make_aware_datetime(day, time(9, 0)) + timedelta(minutes=minutes),
+                status=status,
+            ))
+        Review.objects.create(patient=visitor, doctor=doctor, rating=1 + index % 5,
+                              comment='Отзыв', is_published=True)
+
+    # Основной пациент был у всех врачей, поэтому его кабинет растет вместе с клиникой
+    for index, visit_doctor in enumerate(doctors[1:]):
+        day = today - timedelta(days=1 + index % 3)
+        appointments.append(Appointment.objects.create(
+            patient=patient, doctor=visit_doctor, service=services[0],
+            schedule=schedules[(visit_doctor.id, day)],
+            appointment_time=make_aware_datetime(day, time(17, 0)), status='completed',
+        ))
+        WaitlistEntry.objects.create(patient=patient, doctor=visit_doctor, date_from=today,
+                                     date_to=today + timedelta(days=7))
+
+    for index in range(3 * scale):
+        News.objects.create(title=f'Новость {index}', slug=f'news-{index}', content='Текст',
+                            is_published=True, published_at=timezone.now() - timedelta(days=index))
+
+    staff = User.objects.create_user(username='staff', password='password', is_staff=True)
+    return {
+        'doctor': doctor,
+        'patient': patient,
+        'staff': staff,
+        'service': services[0],
+        'specialization': specializations[0],
+        'appointment': next(item for item in appointments
+                            if item.patient_id == patient.id and item.status == 'pending'),
+        'news': News.objects.first(),
+        'today': today,
+        'tomorrow': today + timedelta(days=1),
+    }
+
+
+@override_settings(ALLOWED_HOSTS=['testserver'], BACKGROUND_ASYNC=False)
+class ViewQueryBudgetTests(TestCase):
+    """Число запросов и время ответа каждой именованной страницы из main/urls.py.
+
+    Фикстура в SCALE раз больше минимальной, поэтому N+1 в шаблоне или
+    представлении сразу выходит за бюджет. Бюджеты не зависят от объема
+    данных: страница должна выполнять одинаковое число запросов и для
+    трех врачей, и для тысячи.
+    """
+
+    SCALE = 3
+    # Максимальное время ответа одной страницы, секунды
+    RENDER_TIME_BUDGET = 2.0
+
+    QUERY_BUDGETS = {
+        'home': 3,
+        'about': 4,
+        'contacts': 5,
+        'doctors_list': 4,
+        'doctor_detail': 9,
+        'doctor_login': 1,
+        'doctor_dashboard': 9,
+        'doctor_schedule': 8,
+        'doctor_schedule_day': 10,
+        'doctor_working_schedule': 8,
+        'doctor_appointment_detail': 9,
+        'doctor_statistics': 6,
+        'services_list': 3,
+        'service_detail': 4,
+        'appointment_step1': 6,
+        'appointment_step2': 6,
+        'appointment_step2_service': 6,
+        'appointment_step2_doctors': 6,
+        'appointment_step3': 8,
+        'appointment_step4': 10,
+        'appointment_step5': 10,
+        'get_available_slots': 5,
+        'register': 1,
+        'profile': 9,
+        'profile_edit': 5,
+        'appointment_list': 5,
+        'appointment_detail': 7,
+        'appointment_cancel': 9,
+        'waitlist': 9,
+        'waitlist_accept': 19,
+        'waitlist_cancel': 5,
+        'add_review': 8,
+        'news_list': 3,
+        'news_detail': 3,
+        'search': 4,
+        'clinic_analytics': 8,
+        'api_doctor_schedule': 5,
+        'api_available_dates': 4,
+        'api_availability_matrix': 4,
+        'api_earliest_slots': 2,
+        'api_book_appointment': 17,
+        'api_book_batch': 16,
+        'api_availability_cache_stats': 3,
+        'api_sql_profile': 3,
+        'login': 1,
+        'logout': 4,
+        'dashboard': 4,
+    }
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.clinic = build_clinic(cls.SCALE)
+        analytics.refresh()
+        doctor, patient = cls.clinic['doctor'], cls.clinic['patient']
+        tomorrow = cls.clinic['tomorrow']
+
+        # Предложение из листа ожидания, которое пациент может принять
+        other_doctor = Doctor.objects.exclude(pk=doctor.pk).order_by('id').first()
+        slot = ScheduleSlot.objects.get(doctor=other_doctor, start=make_aware_datetime(tomorrow, time(15, 0)))
+        cls.offer = waitlist.offer_slot(slot)
+        cls.waiting = WaitlistEntry.objects.filter(patient=patient, status=WaitlistEntry.WAITING).first()
+
+        # Пакет: по одной записи на каждого пациента клиники
+        doctors = list(Doctor.objects.order_by('id'))
+        cls.batch = [
+            {
+                'insurance_policy': visitor.insurance_policy,
+                'doctor': doctors[index % len(doctors)].id,
+                'service': cls.clinic['service'].id,
+                'datetime': (make_aware_datetime(tomorrow, time(13, 0))
+                             + timedelta(minutes=30 * (index // len(doctors)))).isoformat(),
+            }
+            for index, visitor in enumerate(Patient.objects.order_by('id'))
+        ]
+
+    def wizard_session(self):
+        clinic = self.clinic
+        return {
+            'appointment_doctor_id': clinic['doctor'].id,
+            'appointment_service_id': clinic['service'].id,
+            'appointment_specialization_id': clinic['specialization'].id,
+            'appointment_date': clinic['tomorrow'].isoformat(),
+            'appointment_time': '16:00:00',
+        }
+
+    def pages(self):
+        """(имя, роль, аргументы, метод, данные, ожидаемый статус) для каждой страницы"""
+        clinic = self.clinic
+        doctor, service = clinic['doctor'], clinic['service']
+        appointment = clinic['appointment']
+        tomorrow = clinic['tomorrow'].isoformat()
+        book = {'doctor': doctor.id, 'service': service.id, 'date': tomorrow, 'time': '15:00'}
+        # Курсор из глубины истории врача: страница оттуда стоит столько же, сколько первая
+        deepest = Appointment.objects.filter(doctor=doctor).order_by('appointment_time', 'pk')[5]
+        deep_cursor = pagination.encode_cursor(deepest.appointment_time, deepest.pk)
+        return [
+            ('home', None, [], 'get', {}, 200),
+            ('about', None, [], 'get', {}, 200),
+            ('contacts', None, [], 'get', {}, 200),
+            ('doctors_list', None, [], 'get', {}, 200),
+            ('doctor_detail', None, [doctor.pk], 'get', {}, 200),
+            ('doctor_login', None, [], 'get', {}, 200),
+            ('doctor_dashboard', 'doctor', [], 'get', {}, 200),
+            ('doctor_schedule', 'doctor', [], 'get', {}, 200),
+            ('doctor_schedule', 'doctor', [], 'get', {'format': 'json', 'size': 5, 'cursor': deep_cursor}, 200),
+            ('doctor_schedule_day', 'doctor', [tomorrow], 'get', {}, 200),
+            ('doctor_working_schedule', 'doctor', [], 'get', {}, 200),
+            ('doctor_appointment_detail', 'doctor', [appointment.pk], 'get', {}, 200),
+            ('doctor_statistics', 'doctor', [], 'get', {}, 200),
+            ('services_list', None, [], 'get', {}, 200),
+            ('service_detail', None, [service.pk], 'get', {}, 200),
+            ('appointment_step1', 'patient', [], 'get', {}, 200),
+            ('appointment_step2', 'patient', [], 'get', {}, 200),
+            ('appointment_step2_service', 'patient', [service.pk], 'get', {}, 200),
+            ('appointment_step2_doctors', 'patient', [], 'get', {}, 200),
+            ('appointment_step3', 'patient', [], 'get', {}, 200),
+            ('appointment_step4', 'patient', [], 'get', {}, 200),
+            ('appointment_step5', 'patient', [], 'get', {}, 200),
+            ('get_available_slots', 'patient', [], 'get', {'doctor_id': doctor.id, 'date': tomorrow}, 200),
+            ('register', None, [], 'get', {}, 200),
+            ('profile', 'patient', [], 'get', {}, 200),
+            ('profile_edit', 'patient', [], 'get', {}, 200),
+            ('appointment_list', 'patient', [], 'get', {}, 200),
+            ('appointment_list', 'patient', [], 'get', {'format': 'json'}, 200),
+            ('appointment_detail', 'patient', [appointment.pk], 'get', {}, 200),
+            ('appointment_cancel', 'patient', [appointment.pk], 'get', {}, 200),
+            ('waitlist', 'patient', [], 'get', {}, 200),
+            ('waitlist_accept', 'patient', [self.offer.pk], 'post', {}, 302),
+            ('waitlist_cancel', 'patient', [self.waiting.pk], 'post', {}, 302),
+            ('add_review', 'patient', [doctor.pk], 'get', {}, 200),
+            ('news_list', None, [], 'get', {}, 200),
+            ('news_detail', None, [clinic['news'].pk], 'get', {}, 200),
+            ('search', None, [], 'get', {'q': 'Врач'}, 200),
+            ('clinic_analytics', 'staff', [], 'get', {'by': 'specialization'}, 200),
+            ('api_doctor_schedule', None, [doctor.pk], 'get', {}, 200),
+            ('api_available_dates', None, [doctor.pk], 'get', {}, 200),
+            ('api_availability_matrix', None, [], 'get', {'specialization': clinic['specialization'].id}, 200),
+            ('api_earliest_slots', None, [], 'get', {'specialization': clinic['specialization'].id}, 200),
+            ('api_book_appointment', 'patient', [], 'json', book, 201),
+            ('api_book_batch', 'staff', [], 'json', self.batch, 200),
+            ('api_availability_cache_stats', 'staff', [], 'get', {}, 200),
+            ('api_sql_profile', 'staff', [], 'get', {}, 200),
+            ('login', None, [], 'get', {}, 200),
+            ('logout', 'patient', [], 'post', {}, 302),
+            ('dashboard', 'patient', [], 'get', {}, 302),
+        ]
+
+    def login(self, role, name):
+        users = {
+            'doctor': self.clinic['doctor'].user,
+            'patient': self.clinic['patient'].user,
+            'staff': self.clinic['staff'],
+        }
+        self.client.logout()
+        if role:
+            self.client.force_login(users[role])
+        if name.startswith('appointment_step'):
+            session = self.client.session
+            session.update(self.wizard_session())
+            session.save()
+
+    def render(self, name, args, method, data):
+        url = reverse(name, args=args)
+        with CaptureQueriesContext(connection) as queries:
+            started = timer.perf_counter()
+            if method == 'json':
+                response = self.client.post(url, json.dumps(data), content_type='application/json')
+            else:
+                response = getattr(self.client, method)(url, data)
+            elapsed = timer.perf_counter() - started
+        return response, queries, elapsed
+
+    def test_every_named_url_has_budget(self):
+        names = {pattern.name for pattern in get_resolver('main.urls').url_patterns if pattern.name}
+        self.assertEqual(names - set(self.QUERY_BUDGETS), set())
+        self.assertEqual({page[0] for page in self.pages()}, set(self.QUERY_BUDGETS))
+
+    def test_pages_fit_query_and_time_budget(self):
+        for name, role, args, method, data, status in self.pages():
+            with self.subTest(view=name):
+                self.login(role, name)
+                cache.clear()
+                # Каждая страница видит исходное состояние клиники
+                with transaction.atomic():
+                    response, queries, elapsed = self.render(name, args, method, data)
+                    transaction.set_rollback(True)
+
+                self.assertEqual(response.status_code, status)
+                budget = self.QUERY_BUDGETS[name]
+                self.assertLessEqual(
+                    len(queries), budget,
+                    f'{name}: {len(queries)} запросов при бюджете {budget}\n' +
+                    '\n'.join(query['sql'] for query in queries.captured_queries)
+                )
+                self.assertLess(
+                    elapsed, self.RENDER_TIME_BUDGET,
+                    f'{name}: ответ за {elapsed:.3f} с при бюджете {self.RENDER_TIME_BUDGET} с'
+                )
+
+
+@skipUnless(connection.vendor == 'sqlite', 'EXPLAIN QUERY PLAN - синтаксис SQLite')
+class HotQueryPlanTests(TestCase):
+    """Горячие запросы представлений идут по индексам, а не полным сканированием таблиц"""
+
+    # Таблицы, полное сканирование которых недопустимо: они растут вместе с клиникой
+    LARGE_TABLES = {
+        Appointment._meta.db_table,
+        DoctorSchedule._meta.db_table,
+        ScheduleSlot._meta.db_table,
+        News._meta.db_table,
+        Service._meta.db_table,
+        WaitlistEntry._meta.db_table,
+    }
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.clinic = build_clinic(1)
+
+    def hot_queries(self):
+        clinic = self.clinic
+        doctor, patient = clinic['doctor'], clinic['patient']
+        today, now = clinic['today'], timezone.now()
+        active = Appointment.ACTIVE_STATUSES
+        return {
+            'doctor_schedule': self.page(Appointment.objects.filter(doctor=doctor)),
+            'doctor_upcoming': Appointment.objects.filter(
+                doctor=doctor, appointment_time__gte=now, status__in=active
+            ).order_by('appointment_time')[:5],
+            'doctor_day': Appointment.objects.filter(
+                on_day('appointment_time', today), doctor=doctor
+            ).order_by('appointment_time'),
+            'doctor_today_count': Appointment.objects.filter(
+                on_day('appointment_time', today), doctor=doctor, status__in=active
+            ),
+            'doctor_window': Appointment.objects.filter(
+                between_days('appointment_time', today - timedelta(days=30), today), doctor=doctor
+            ),
+            'doctor_slot': Appointment.objects.filter(
+                in_slot('appointment_time', now), doctor=doctor
+            ),
+            'doctor_mornings': Appointment.objects.filter(
+                in_hours('appointment_time', today - timedelta(days=6), today, 9, 12), doctor=doctor
+            ),
+            'patient_active': Appointment.objects.filter(
+                patient=patient, status__in=active, appointment_time__gte=now
+            ).order_by('appointment_time'),
+            'patient_past': Appointment.objects.filter(
+                patient=patient, status__in=['completed', 'cancelled', 'no_show']
+            ).order_by('-appointment_time')[:10],
+            'patient_list': self.page(Appointment.objects.filter(patient=patient)),
+            'changed_appointments': Appointment.objects.filter(updated_at__gt=now - timedelta(minutes=5)),
+            'bookable_days': DoctorSchedule.objects.filter(
+                doctor=doctor, date__range=[today, today + timedelta(days=7)],
+                is_available=True, is_working_day=True
+            ).order_by('date'),
+            'availability_matrix': DoctorSchedule.objects.filter(
+                doctor_id__in=[doctor.id], date__in=[today, today + timedelta(days=1)],
+                is_available=True, is_working_day=True
+            ),
+            'free_slots': ScheduleSlot.objects.filter(
+                ScheduleSlot.available_q(), schedule_id__in=[1, 2]
+            ).order_by('start'),
+            'news_list': News.objects.filter(
+                is_published=True, published_at__lte=now
+            ).order_by('-published_at'),
+            'services_list': Service.objects.filter(is_active=True).order_by('order', 'name'),
+        }
+
+    def page(self, queryset):
+        """Запрос страницы keyset_page после курсора из середины истории"""
+        middle = queryset.order_by('appointment_time', 'pk')[queryset.count() // 2]
+        cursor = pagination.encode_cursor(middle.appointment_time, middle.pk)
+        return pagination.keyset_queryset(queryset, cursor, descending=True)[:pagination.PAGE_SIZE + 1]
+
+    def explain(self, queryset):
+        sql, params = queryset.query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+            return [row[-1] for row in cursor.fetchall()]
+
+    def test_hot_queries_use_indexes(self):
+        for name, queryset in self.hot_queries().items():
+            with self.subTest(query=name):
+                plan = self.explain(queryset)
+                full_scans = [
+                    detail for detail in plan
+                    if detail.split()[:1] == ['SCAN'] and 'USING' not in detail
+                    and detail.split()[1] in self.LARGE_TABLES
+                ]
+                self.assertEqual(full_scans, [], f'{name}: ' + '; '.join(plan))
+
+    def test_appointment_lookups_share_page_indexes(self):
+        # Отдельных индексов (врач, время, статус) и (пациент, статус, время) нет:
+        # записи врача и пациента ищутся по индексам постраничной истории
+        for name, queryset in self.hot_queries().items():
+            owner = name.split('_')[0]
+            if owner not in ('doctor', 'patient'):
+                continue
+            with self.subTest(query=name):
+                plan = self.explain(queryset)
+                self.assertTrue(
+                    any(f'USING INDEX appointment_{owner}_page_idx' in detail for detail in plan),
+                    f'{name}: ' + '; '.join(plan)
+                )
+
+    def test_history_pages_read_index_order(self):
+        # Страница истории берется из индекса по порядку, без сортировки всей истории
+        queries = self.hot_queries()
+        for name in ('doctor_schedule', 'patient_list'):
+            with self.subTest(query=name):
+                plan = self.explain(queries[name])
+                self.assertEqual([detail for detail in plan if 'TEMP B-TREE' in detail], [],
+                                 f'{name}: ' + '; '.join(plan))
+
+
+class TimeRangeTests(TestCase):
+    """Диапазоны timeranges отбирают те же записи, что и __date/__hour"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.clinic = build_clinic(1)
+
+    def assertSameRows(self, condition, **lookups):
+        self.assertEqual(
+            set(Appointment.objects.filter(condition).values_list('pk', flat=True)),
+            set(Appointment.objects.filter(**lookups).values_list('pk', flat=True)),
+        )
+
+    def test_ranges_match_function_lookups(self):
+        today = self.clinic['today']
+        for offset in range(-3, 8):
+            day = today + timedelta(days=offset)
+            self.assertSameRows(on_day('appointment_time', day), appointment_time__date=day)
+        self.assertSameRows(between_days('appointment_time', today - timedelta(days=2), today + timedelta(days=2)),
+                            appointment_time__date__range=[today - timedelta(days=2), today + timedelta(days=2)])
+        self.assertSameRows(in_hours('appointment_time', today - timedelta(days=3), today + timedelta(days=7), 9, 10),
+                            appointment_time__date__range=[today - timedelta(days=3), today + timedelta(days=7)],
+                            appointment_time__hour=9)
+
+    def test_slot_matches_exact_minute(self):
+        appointment = self.clinic['appointment']
+        moment = timezone.localtime(appointment.appointment_time)
+        matched = Appointment.objects.filter(in_slot('appointment_time', moment), doctor=appointment.doctor)
+        self.assertEqual(list(matched), [appointment])
+
+
+class KeysetPaginationTests(TestCase):
+    """Постраничная история записей по курсору (время, id)"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.clinic = build_clinic(2)
+
+    def walk(self, queryset, size):
+        rows, cursor = pagination.keyset_page(queryset, size=size, descending=True)
+        pages = [rows]
+        while cursor:
+            rows, cursor = pagination.keyset_page(queryset, cursor, size=size, descending=True)
+            pages.append(rows)
+        return pages
+
+    def test_pages_cover_history_once_in_order(self):
+        # Одинаковое время у нескольких записей различается по id
+        queryset = Appointment.objects.all()
+        expected = list(queryset.order_by('-appointment_time', '-pk').values_list('pk', flat=True))
+        pages = self.walk(queryset, 4)
+        self.assertEqual([row.pk for rows in pages for row in rows], expected)
+        self.assertTrue(all(len(rows) == 4 for rows in pages[:-1]))
+
+    def test_bad_cursor_starts_from_first_page(self):
+        queryset = Appointment.objects.filter(doctor=self.clinic['doctor'])
+        first, _ = pagination.keyset_page(queryset, size=3)
+        for cursor in ('', 'мусор', 'bm90LWEtY3Vyc29y'):
+            with self.subTest(cursor=cursor):
+                self.assertEqual(pagination.keyset_page(queryset, cursor, size=3)[0], first)
+
+    def test_json_variant_continues_from_next(self):
+        patient = self.clinic['patient']
+        self.client.force_login(patient.user)
+        seen = []
+        url = reverse('appointment_list') + '?size=1'
+        while url:
+            data = self.client.get(url + '&format=json').json()
+            self.assertEqual(len(data['results']), 1)
+            self.assertIn(data['results'][0]['number'], data['html'])
+            seen.append(data['results'][0]['id'])
+            url = data['next']
+        self.assertEqual(seen, list(
+            Appointment.objects.filter(patient=patient).order_by('-appointment_time', '-pk').values_list('pk', flat=True)
+        ))
+
+
+# Без запаса на поздние коммиты: иначе все только что созданные записи считаются измененными
+@override_settings(STATS_REFRESH_OVERLAP=0, BACKGROUND_ASYNC=False)
+class RollupRefreshTests(TestCase):
+    """Инкрементальный пересчет сводок дает тот же результат, что и полный"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.clinic = build_clinic(1)
+
+    def daily_stats(self):
+        return sorted(DoctorDailyStats.objects.values_list('doctor_id', 'day', 'total', 'completed', 'pending'))
+
+    def assertIncrementalMatchesFull(self, refresh, snapshot):
+        refresh()
+        incremental = snapshot()
+        refresh(full=True)
+        self.assertEqual(incremental, snapshot())
+
+    def move(self, **changes):
+        appointment = Appointment.objects.filter(status='completed', doctor=self.clinic['doctor']).first()
+        for field, value in changes.items():
+            setattr(appointment, field, value)
+        appointment.save()
+
+    def test_sweep_queued_apart_from_waitlist(self):
+        cache.delete(stats.REFRESH_KEY)
+        with mock.patch.object(background, 'schedule') as scheduled:
+            stats.schedule_sweep()
+        scheduled.assert_called_once_with('stats', stats.sweep)
+        self.assertNotEqual(scheduled.call_args.args[0], waitlist.QUEUE)
+
+    def test_daily_stats_forget_rescheduled_day(self):
+        stats.refresh(full=True)
+        self.move(appointment_time=timezone.now() - timedelta(days=20))
+        self.assertIncrementalMatchesFull(stats.refresh, self.daily_stats)
+
+    def test_daily_stats_forget_reassigned_doctor(self):
+        stats.refresh(full=True)
+        self.move(doctor=Doctor.objects.exclude(pk=self.clinic['doctor'].pk).first())
+        self.assertIncrementalMatchesFull(stats.refresh, self.daily_stats)
+
+    def facts(self):
+        return sorted(AppointmentFact.objects.values_list('doctor_id', 'day', 'service_id', 'status', 'count'))
+
+    def test_facts_forget_rescheduled_day(self):
+        analytics.refresh(full=True)
+        self.move(appointment_time=timezone.now() - timedelta(days=20))
+        self.assertIncrementalMatchesFull(analytics.refresh, self.facts)
+
+    def test_facts_forget_reassigned_doctor(self):
+        analytics.refresh(full=True)
+        self.move(doctor=Doctor.objects.exclude(pk=self.clinic['doctor'].pk).first())
+        self.assertIncrementalMatchesFull(analytics.refresh, self.facts)
+
+    def test_statistics_page_refreshes_after_response(self):
+        self.client.force_login(self.clinic['doctor'].user)
+        cache.clear()
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.assertEqual(self.client.get(reverse('doctor_statistics')).status_code, 200)
+        # Страница не пересчитывает сводку сама, а ставит пересчет после ответа
+        self.assertFalse(DoctorDailyStats.objects.exists())
+        for callback in callbacks:
+            callback()
+        self.assertTrue(DoctorDailyStats.objects.exists())
+
+
+class ScheduleMinutesTests(SimpleTestCase):
+    """Минуты приема по расписанию для емкости в аналитике"""
+
+    def minutes(self, start, end, break_start=None, break_end=None):
+        return analytics._schedule_minutes({
+            'date': date(2026, 1, 5), 'start_time': start, 'end_time': end,
+            'break_start': break_start, 'break_end': break_end,
+        })
+
+    def test_working_day_minus_break(self):
+        self.assertEqual(self.minutes(time(9, 0), time(18, 0), time(13, 0), time(14, 0)), 480)
+
+    def test_inverted_intervals_count_as_zero(self):
+        self.assertEqual(self.minutes(time(18, 0), time(9, 0)), 0)
+        self.assertEqual(self.minutes(time(9, 0), time(18, 0), time(14, 0), time(13, 0)), 540)
+
+
+class RatingDeltaTests(TestCase):
+    """Рейтинг, обновляемый по отзывам приращениями, совпадает с полным пересчетом"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.clinic = build_clinic(1)
+
+    def setUp(self):
+        self.doctor = self.clinic['doctor']
+        self.other = Doctor.objects.exclude(pk=self.doctor.pk).order_by('id').first()
+        self.review = Review.objects.filter(doctor=self.doctor, is_published=True).first()
+
+    def ratings(self, *doctors):
+        return list(Doctor.objects.filter(pk__in=[doctor.pk for doctor in doctors]).order_by('id').values_list(
+            'rating_sum', 'rating_count', 'rating_avg', 'popularity_score'
+        ))
+
+    def assertMatchesRebuild(self, *doctors):
+        incremental = self.ratings(*doctors)
+        Doctor.rebuild_ratings()
+        self.assertEqual(incremental, self.ratings(*doctors))
+
+    def test_create(self):
+        Review.objects.create(patient=self.clinic['patient'], doctor=self.other, rating=5,
+                              comment='Спасибо', is_published=True)
+        self.assertMatchesRebuild(self.other)
+
+    def test_edit_rating(self):
+        self.review.rating = 6 - self.review.rating
+        self.review.save()
+        self.assertMatchesRebuild(self.doctor)
+
+    def test_reassign_doctor(self):
+        self.review.doctor = self.other
+        self.review.save()
+        self.assertMatchesRebuild(self.doctor, self.other)
+
+    def test_delete(self):
+        self.review.delete()
+        self.assertMatchesRebuild(self.doctor)
+
+    def test_new_doctor_gets_clinic_mean(self):
+        newcomer = create_doctor('newcomer')
+        self.assertGreater(newcomer.popularity_score, 0)
+        self.assertMatchesRebuild(newcomer)
+
+    def test_review_touches_only_its_doctor(self):
+        Doctor.objects.exclude(pk=self.doctor.pk).update(popularity_score=-1)
+        self.review.rating = 6 - self.review.rating
+        self.review.save()
+        self.assertEqual(Doctor.objects.filter(popularity_score=-1).count(), Doctor.objects.count() - 1)
+
+
+class SqlFingerprintTests(SimpleTestCase):
+    """Отпечатки SQL и поиск повторов для профилировщика"""
+
+    def test_literals_and_in_lists_collapse(self):
+        first = sql_profiling.fingerprint(
+            "SELECT * FROM main_doctor WHERE id = 5 AND name = 'Иван' AND id IN (1, 2, 3)"
+        )
+        second = sql_profiling.fingerprint(
+            "SELECT *  FROM main_doctor\nWHERE id = 17 AND name = 'O''Brien' AND id IN (4)"
+        )
+        self.assertEqual(first, second)
+        self.assertEqual(first, 'SELECT * FROM main_doctor WHERE id = %s AND name = %s AND id IN (...)')
+        self.assertNotEqual(first, sql_profiling.fingerprint('SELECT * FROM main_service WHERE id = 5'))
+
+    def test_repeated_respects_threshold(self):
+        recorder = sql_profiling.QueryRecorder()
+        execute = mock.Mock(return_value=None)
+        for pk in range(4):
+            recorder(execute, f'SELECT * FROM main_review WHERE doctor_id = {pk}', None, False, {})
+        recorder(execute, 'SELECT COUNT(*) FROM main_doctor', None, False, {})
+
+        self.assertEqual(recorder.count, 5)
+        self.assertEqual(execute.call_count, 5)
+        self.assertEqual(recorder.repeated(3), [
+            {'fingerprint': 'SELECT * FROM main_review WHERE doctor_id = %s', 'count': 4},
+        ])
+        self.assertEqual(recorder.repeated(4), [])
+
+
+class SqlProfilingMiddlewareTests(TestCase):
+    """Выборка запросов, кольцевой буфер и сводка профилировщика SQL"""
+
+    def setUp(self):
+        patcher = mock.patch.object(sql_profiling, '_buffer', deque(maxlen=3))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.request = RequestFactory().get('/doctors/')
+
+    def view(self, queries):
+        def get_response(request):
+            for _ in range(queries):
+                Doctor.objects.filter(pk=1).exists()
+            return mock.Mock(status_code=200)
+        return sql_profiling.SQLProfilingMiddleware(get_response)
+
+    @override_settings(SQL_PROFILE_SAMPLE_RATE=0)
+    def test_requests_outside_sample_are_not_wrapped(self):
+        with mock.patch.object(sql_profiling, 'QueryRecorder') as recorder:
+            response = self.view(2)(self.request)
+        self.assertEqual(response.status_code, 200)
+        recorder.assert_not_called()
+        self.assertEqual(sql_profiling.recent(), [])
+
+    @override_settings(SQL_PROFILE_SAMPLE_RATE=1.0, SQL_PROFILE_N_PLUS_ONE_THRESHOLD=2)
+    def test_sampled_request_recorded(self):
+        self.view(3)(self.request)
+        entry, = sql_profiling.recent()
+        self.assertEqual((entry['path'], entry['method'], entry['status'], entry['queries']),
+                         ('/doctors/', 'GET', 200, 3))
+        self.assertEqual(entry['n_plus_one'][0]['count'], 3)
+
+    @override_settings(SQL_PROFILE_SAMPLE_RATE=1.0)
+    def test_ring_buffer_and_summary(self):
+        for queries in (1, 2, 3, 4):
+            self.view(queries)(self.request)
+        self.assertEqual([entry['queries'] for entry in sql_profiling.recent()], [4, 3, 2])
+        self.assertEqual([entry['queries'] for entry in sql_profiling.recent(2)], [4, 3])
+
+        group, = sql_profiling.summary()
+        self.assertEqual((group['url_name'], group['requests'], group['queries_total'],
+                          group['queries_max'], group['queries_avg']), ('/doctors/', 3, 9, 4, 3.0))
+
+        sql_profiling.reset()
+        self.assertEqual(sql_profiling.summary(), [])
@@ -0,0 +1,51 @@
+# main/timeranges.py
+"""Условия по datetime-полям в виде полуоткрытых диапазонов [начало, конец).
+
+Фильтры вида field__date, field__hour и field__minute оборачивают
+столбец в функцию, и индекс по нему не используется. Здесь те же
+условия строятся как сравнения самого столбца с границами в текущем
+часовом поясе, что дает поиск по диапазону индекса.
+"""
+from datetime import time, timedelta
+from functools import reduce
+from operator import or_
+
+from django.db.models import Q
+
+from .scheduling import make_aware_datetime
+
+
+def day_bounds(day):
+    """Начало дня и начало следующего дня (aware, текущий часовой пояс)"""
+    return make_aware_datetime(day, time.min), make_aware_datetime(day + timedelta(days=1), time.min)
+
+
+def _range(field, start, end):
+    return Q(**{f'{field}__gte': start, f'{field}__lt': end})
+
+
+def on_day(field, day):
+    """Вместо field__date=day"""
+    return _range(field, *day_bounds(day))
+
+
+def between_days(field, first_day, last_day):
+    """Вместо field__date__range=[first_day, last_day] (обе даты включительно)"""
+    return _range(field, day_bounds(first_day)[0], day_bounds(last_day)[1])
+
+
+def in_hours(field, first_day, last_day, start_hour, end_hour):
+    """Вместо field__hour в [start_hour, end_hour) за дни диапазона - по диапазону на день"""
+    days = (last_day - first_day).days + 1
+    return reduce(or_, (
+        _range(field,
+               make_aware_datetime(day, time(start_hour)),
+               make_aware_datetime(day, time(end_hour)) if end_hour < 24 else day_bounds(day)[1])
+        for day in (first_day + timedelta(days=offset) for offset in range(days))
+    ))
+
+
+def in_slot(field, moment, minutes=1):
+    """Вместо совпадения по field__date, field__hour и field__minute: [moment, moment + minutes)"""
+    start = moment.replace(second=0, microsecond=0)
+    return _range(field, start, start + timedelta(minutes=minutes))
@@ -41,6 +41,9 @@ urlpatterns = [
     path('appointments/', views.appointment_list, name='appointment_list'),
     path('appointments/<int:pk>/', views.appointment_detail, name='appointment_detail'),
     path('appointments/<int:pk>/cancel/', views.appointment_cancel, name='appointment_cancel'),
+    path('waitlist/', views.waitlist_view, name='waitlist'),
+    path('waitlist/<int:pk>/accept/', views.waitlist_accept, name='waitlist_accept'),
+    path('waitlist/<int:pk>/cancel/', views.waitlist_cancel, name='waitlist_cancel'),
     
     # Отзывы
     path('doctors/<int:doctor_id>/review/', views.add_review, name='add_review'),
@@ -52,9 +55,18 @@ urlpatterns = [
     # Поиск
     path('search/', views.search, name='search'),
     
+    # Аналитика клиники (для персонала)
+    path('analytics/', views.clinic_analytics, name='clinic_analytics'),
+    
     # API
     path('api/doctor/<int:doctor_id>/schedule/', views.api_doctor_schedule, name='api_doctor_schedule'),
     path('api/doctor/<int:doctor_id>/available-dates/', views.api_available_dates, name='api_available_dates'),
+    path('api/availability/matrix/', views.api_availability_matrix, name='api_availability_matrix'),
+    path('api/availability/earliest/', views.api_earliest_slots, name='api_earliest_slots'),
+    path('api/appointments/book/', views.api_book_appointment, name='api_book_appointment'),
+    path('api/appointments/batch/', views.api_book_batch, name='api_book_batch'),
+    path('api/availability/cache-stats/', views.api_availability_cache_stats, name='api_availability_cache_stats'),
+    path('api/sql-profile/', views.api_sql_profile, name='api_sql_profile'),
     
     path('login/', auth_views.LoginView.as_view(template_name='main/auth/login.html'), name='login'),
     path('logout/', views.logout_view, name='logout'),
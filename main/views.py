@@ -1,26 +1,36 @@
 from django.shortcuts import render, get_object_or_404, redirect
 from django.contrib import messages
 from django.contrib.auth import login, authenticate, logout as auth_logout
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.mixins import LoginRequiredMixin
-from django.db.models import Q
+from django.db.models import Case, Q, Value, When
 from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from django.views.decorators.http import require_POST
 from django.views.generic import ListView, DetailView, CreateView, UpdateView, DeleteView
 from django.urls import reverse_lazy, reverse
 from django.http import JsonResponse, HttpResponseRedirect
-from datetime import datetime, timedelta, date
+from django.template.loader import render_to_string
+from datetime import datetime, timedelta, date, time
+from itertools import groupby
 
 import json
-from django.db import models
+import random
+from django.db import IntegrityError, models, transaction
 
 from .models import (
     Doctor, Service, Specialization, Department,
-    Appointment, Patient, DoctorSchedule, Review,
-    News, Contact, Slider
+    Appointment, Patient, DoctorSchedule, WeeklyScheduleTemplate, Review,
+    News, Contact, Slider, WaitlistEntry
 )
+from . import analytics, availability, pagination, sql_profiling, stats, timeranges, waitlist
+from .booking import (book_appointment, book_batch, hold_slot, parse_batch,
+                      sweep_expired_holds, SlotUnavailable)
+from .scheduling import make_aware_datetime
 from .forms import (
     PatientRegistrationForm, AppointmentForm, 
-    ReviewForm, PatientProfileForm, DoctorLoginForm
+    ReviewForm, PatientProfileForm, DoctorLoginForm, WaitlistForm
 )
 
 # ==================== ГЛАВНАЯ СТРАНИЦА И ОСНОВНЫЕ РАЗДЕЛЫ ====================
@@ -36,10 +46,10 @@ def home(request):
         published_at__lte=timezone.now()
     ).order_by('-published_at')[:3]
     
-    # Получаем популярных врачей (с лучшим рейтингом)
+    # Получаем популярных врачей (по индексу популярности)
     popular_doctors = Doctor.objects.filter(
         is_active=True
-    ).order_by('-reviews__rating')[:6]
+    ).select_related('specialization').order_by('-popularity_score', '-rating_count', 'order', 'id')[:6]
     
     # Получаем основные услуги
     main_services = Service.objects.filter(
@@ -101,6 +111,31 @@ def contacts(request):
 
 # ==================== ВРАЧИ ====================
 
+def filter_doctors(queryset, params):
+    """Фильтрует врачей по параметрам запроса (specialization, department, search)"""
+    # Фильтрация по специализации
+    specialization_id = params.get('specialization')
+    if specialization_id:
+        queryset = queryset.filter(specialization_id=specialization_id)
+    
+    # Фильтрация по отделению
+    department_id = params.get('department')
+    if department_id:
+        queryset = queryset.filter(department_id=department_id)
+    
+    # Поиск по имени
+    search_query = params.get('search')
+    if search_query:
+        queryset = queryset.filter(
+            Q(last_name__icontains=search_query) |
+            Q(first_name__icontains=search_query) |
+            Q(middle_name__icontains=search_query) |
+            Q(specialization__name__icontains=search_query)
+        )
+    
+    return queryset
+
+
 class DoctorListView(ListView):
     """Список всех врачей"""
     model = Doctor
@@ -109,29 +144,8 @@ class DoctorListView(ListView):
     paginate_by = 12
     
     def get_queryset(self):
-        queryset = Doctor.objects.filter(is_active=True)
-        
-        # Фильтрация по специализации
-        specialization_id = self.request.GET.get('specialization')
-        if specialization_id:
-            queryset = queryset.filter(specialization_id=specialization_id)
-        
-        # Фильтрация по отделению
-        department_id = self.request.GET.get('department')
-        if department_id:
-            queryset = queryset.filter(department_id=department_id)
-        
-        # Поиск по имени
-        search_query = self.request.GET.get('search')
-        if search_query:
-            queryset = queryset.filter(
-                Q(last_name__icontains=search_query) |
-                Q(first_name__icontains=search_query) |
-                Q(middle_name__icontains=search_query) |
-                Q(specialization__name__icontains=search_query)
-            )
-        
-        return queryset.order_by('order', 'last_name', 'first_name')
+        queryset = filter_doctors(Doctor.objects.filter(is_active=True), self.request.GET)
+        return queryset.select_related('specialization').order_by('order', 'last_name', 'first_name')
     
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
@@ -162,7 +176,7 @@ class DoctorDetailView(DetailView):
         reviews = Review.objects.filter(
             doctor=doctor,
             is_published=True
-        ).order_by('-created_at')[:10]
+        ).select_related('patient__user').order_by('-created_at')[:10]
         
         # Получаем услуги врача
         services = doctor.services.filter(is_active=True)
@@ -171,12 +185,17 @@ class DoctorDetailView(DetailView):
         today = timezone.now().date()
         next_week = today + timedelta(days=7)
         
-        schedule = DoctorSchedule.objects.filter(
+        schedule = list(DoctorSchedule.objects.filter(
             doctor=doctor,
             date__range=[today, next_week],
             is_available=True,
             is_working_day=True
-        ).order_by('date')
+        ).order_by('date'))
+        
+        # Количество свободных слотов по дням - из кэша доступности
+        slots_by_date = availability.get_availability(doctor.id, today, next_week)
+        for day in schedule:
+            day.free_slots_count = len(slots_by_date[day.date])
         
         context.update({
             'title': f'Доктор {doctor.full_name()}',
@@ -263,26 +282,39 @@ def doctor_dashboard(request):
         doctor=doctor,
         appointment_time__gte=timezone.now(),
         status__in=['pending', 'confirmed']
-    ).order_by('appointment_time')[:5]
-    
-    # Сегодняшние записи
-    todays_appointments = Appointment.objects.filter(
-        doctor=doctor,
-        appointment_time__date=today,
-        status__in=['pending', 'confirmed']
-    ).order_by('appointment_time')
+    ).select_related('patient__user', 'service').order_by('appointment_time')[:5]
     
     context = {
         'title': 'Личный кабинет врача',
         'doctor': doctor,
         'upcoming_appointments': upcoming_appointments,
-        'todays_appointments': todays_appointments,
+        # Все счетчики (всего, на сегодня, по статусам) - одним запросом
+        'stats': Appointment.status_counts(doctor=doctor),
         'today': today,
     }
     
     return render(request, 'main/doctor/dashboard.html', context)
 
 
+def _next_page_url(request, next_cursor):
+    """Адрес следующей страницы с текущими фильтрами; None на последней странице"""
+    if not next_cursor:
+        return None
+    query = request.GET.copy()
+    query.pop('format', None)
+    query['cursor'] = next_cursor
+    return f'{request.path}?{query.urlencode()}'
+
+
+def _page_json(request, rows_template, context, results):
+    """JSON-вариант страницы для бесконечной прокрутки: данные, разметка строк и следующая страница"""
+    return JsonResponse({
+        'results': results,
+        'html': render_to_string(rows_template, context, request=request),
+        'next': context['next_page'],
+    })
+
+
 @login_required
 def doctor_schedule(request):
     """Просмотр расписания врача"""
@@ -298,13 +330,15 @@ def doctor_schedule(request):
     status_filter = request.GET.get('status', 'all')
     
     # Базовый запрос
-    appointments = Appointment.objects.filter(doctor=doctor)
+    appointments = Appointment.objects.filter(doctor=doctor).select_related(
+        'patient__user', 'service', 'schedule'
+    )
     
     # Фильтрация по дате
     if date_filter:
         try:
             filter_date = datetime.strptime(date_filter, '%Y-%m-%d').date()
-            appointments = appointments.filter(appointment_time__date=filter_date)
+            appointments = appointments.filter(timeranges.on_day('appointment_time', filter_date))
         except ValueError:
             messages.error(request, 'Некорректный формат даты')
     
@@ -312,37 +346,31 @@ def doctor_schedule(request):
     if status_filter != 'all':
         appointments = appointments.filter(status=status_filter)
     
-    # Сортируем по времени
-    appointments = appointments.order_by('appointment_time')
-    
-    # Получаем уникальные даты для фильтра
-    appointment_dates = Appointment.objects.filter(
-        doctor=doctor
-    ).dates('appointment_time', 'day').order_by('-appointment_time')
-    
-    # Группируем записи по дате для удобного отображения
-    appointments_by_date = {}
-    for appointment in appointments:
-        date_key = appointment.appointment_time.date()
-        if date_key not in appointments_by_date:
-            appointments_by_date[date_key] = []
-        appointments_by_date[date_key].append(appointment)
+    # Одна страница от новых записей к старым, продолжение - по курсору
+    appointments, next_cursor = pagination.keyset_page(
+        appointments, request.GET.get('cursor'), pagination.page_size(request.GET.get('size')),
+        descending=True,
+    )
     
-    # Сортируем даты
-    sorted_dates = sorted(appointments_by_date.keys(), reverse=True)
+    # Группируем записи страницы по дате: они уже идут по времени
+    days = [
+        (day, list(day_appointments))
+        for day, day_appointments in groupby(
+            appointments, key=lambda appointment: timezone.localtime(appointment.appointment_time).date()
+        )
+    ]
     
     # Вычисляем завтрашнюю дату
-    from datetime import timedelta
-    today = timezone.now().date()
+    today = timezone.localdate()
     tomorrow = today + timedelta(days=1)
     
     context = {
         'title': 'Мое расписание',
         'doctor': doctor,
         'appointments': appointments,
-        'appointments_by_date': appointments_by_date,
-        'sorted_dates': sorted_dates,
-        'appointment_dates': appointment_dates[:10],  # последние 10 дат
+        'days': days,
+        'appointment_dates': [day for day, _ in days],  # даты текущей страницы
+        'next_page': _next_page_url(request, next_cursor),
         'status_filter': status_filter,
         'date_filter': date_filter,
         'status_choices': Appointment.STATUS_CHOICES,
@@ -350,6 +378,21 @@ def doctor_schedule(request):
         'tomorrow': tomorrow,
     }
     
+    if request.GET.get('format') == 'json':
+        return _page_json(request, 'main/doctor/schedule_days.html', context, [
+            {
+                'id': appointment.pk,
+                'number': appointment.appointment_number,
+                'time': appointment.appointment_time.isoformat(),
+                'status': appointment.status,
+                'status_display': appointment.get_status_display(),
+                'patient': appointment.patient.user.get_full_name(),
+                'service': appointment.service.name,
+                'url': reverse('doctor_appointment_detail', args=[appointment.pk]),
+            }
+            for appointment in appointments
+        ])
+    
     return render(request, 'main/doctor/schedule.html', context)
 
 
@@ -364,7 +407,9 @@ def doctor_appointment_detail(request, pk):
         return redirect('home')
     
     # Получаем запись
-    appointment = get_object_or_404(Appointment, pk=pk)
+    appointment = get_object_or_404(
+        Appointment.objects.select_related('patient__user', 'service', 'schedule'), pk=pk
+    )
     
     # Проверяем, что запись принадлежит этому врачу
     if appointment.doctor != doctor:
@@ -387,7 +432,13 @@ def doctor_appointment_detail(request, pk):
                 else:
                     appointment.notes = f"--- Заметки врача ({timezone.now().strftime('%d.%m.%Y %H:%M')}) ---\n{notes}"
             
-            appointment.save()
+            try:
+                with transaction.atomic():
+                    appointment.save()
+            except (IntegrityError, SlotUnavailable):
+                # Возврат отмененной записи в активный статус на время, уже занятое другими
+                messages.error(request, 'Это время уже занято другой записью - статус не изменен')
+                return redirect('doctor_appointment_detail', pk=appointment.pk)
             
             messages.success(request, f'Статус записи изменен с "{dict(Appointment.STATUS_CHOICES)[old_status]}" на "{dict(Appointment.STATUS_CHOICES)[new_status]}"')
             return redirect('doctor_appointment_detail', pk=appointment.pk)
@@ -396,7 +447,7 @@ def doctor_appointment_detail(request, pk):
         patient=appointment.patient
     ).exclude(
         id=appointment.id
-    ).order_by('-appointment_time')[:5]
+    ).select_related('service').order_by('-appointment_time')[:5]
     
     context = {
         'title': f'Запись #{appointment.appointment_number}',
@@ -443,10 +494,11 @@ def doctor_working_schedule(request):
     else:
         end_date = date(current_year, current_month + 1, 1) - timedelta(days=1)
     
-    schedules = DoctorSchedule.objects.filter(
+    # Счетчики записей и свободных слотов приходят тем же запросом
+    schedules = list(DoctorSchedule.annotate_counts(DoctorSchedule.objects.filter(
         doctor=doctor,
         date__range=[start_date, end_date]
-    ).order_by('date')
+    )).order_by('date'))
     
     # Создаем календарь на месяц
     import calendar
@@ -467,6 +519,24 @@ def doctor_working_schedule(request):
         date_str = request.POST.get('date')
         action = request.POST.get('action')
         
+        if action == 'apply_template':
+            # Разворачиваем недельный шаблон на несколько недель вперед
+            try:
+                weeks = min(max(int(request.POST.get('weeks', 4)), 1), 12)
+            except ValueError:
+                weeks = 4
+            created = WeeklyScheduleTemplate.materialize(doctor, weeks=weeks)
+            if created:
+                messages.success(request, f'По шаблону создано дней расписания: {created}')
+            else:
+                messages.info(request, 'Новых дней по шаблону не создано')
+            return redirect('doctor_working_schedule')
+        
+        if action and request.POST.get('start_date') and request.POST.get('end_date'):
+            # Операция над диапазоном дат с маской дней недели
+            apply_schedule_range(request, doctor, action)
+            return redirect('doctor_working_schedule')
+        
         if date_str and action:
             try:
                 schedule_date = datetime.strptime(date_str, '%Y-%m-%d').date()
@@ -491,7 +561,14 @@ def doctor_working_schedule(request):
                         messages.info(request, f'Расписание на {schedule_date.strftime("%d.%m.%Y")} уже существует')
                 
                 elif action == 'remove':
-                    # Удаляем расписание
+                    # Удаление расписания каскадно удалит его записи
+                    if Appointment.objects.filter(schedule__doctor=doctor, schedule__date=schedule_date).exists():
+                        messages.error(
+                            request,
+                            f'На {schedule_date.strftime("%d.%m.%Y")} есть записи пациентов - '
+                            'закройте прием в этот день вместо удаления расписания'
+                        )
+                        return redirect('doctor_working_schedule')
                     deleted, _ = DoctorSchedule.objects.filter(
                         doctor=doctor,
                         date=schedule_date
@@ -531,11 +608,103 @@ def doctor_working_schedule(request):
         'next_month': next_month,
         'next_year': next_year,
         'today': today,
+        'working_days_count': sum(1 for schedule in schedules if schedule.is_available),
+        'appointments_count': sum(schedule.appointments_active for schedule in schedules),
+        'free_slots_count': sum(schedule.free_slots for schedule in schedules if schedule.is_available),
+        'schedule_templates': doctor.schedule_templates.filter(is_active=True),
     }
     
     return render(request, 'main/doctor/working_schedule.html', context)
 
 
+def apply_schedule_range(request, doctor, action):
+    """Добавляет, удаляет или переключает расписание на диапазон дат.
+    
+    Каждая операция выполняется одной транзакцией набором запросов
+    bulk_create / update / delete, число измененных дней выводится в сообщении.
+    """
+    try:
+        start_date = datetime.strptime(request.POST['start_date'], '%Y-%m-%d').date()
+        end_date = datetime.strptime(request.POST['end_date'], '%Y-%m-%d').date()
+        weekdays = {int(day) for day in request.POST.getlist('days_of_week')} or set(range(7))
+    except ValueError:
+        messages.error(request, 'Некорректный диапазон дат')
+        return
+    
+    if start_date > end_date or (end_date - start_date).days > 366:
+        messages.error(request, 'Некорректный диапазон дат (не более года)')
+        return
+    
+    dates = [
+        start_date + timedelta(days=offset)
+        for offset in range((end_date - start_date).days + 1)
+        if (start_date + timedelta(days=offset)).weekday() in weekdays
+    ]
+    period = f'{start_date.strftime("%d.%m.%Y")} - {end_date.strftime("%d.%m.%Y")}'
+    
+    if action == 'add':
+        try:
+            start_time = datetime.strptime(request.POST.get('start_time', '09:00'), '%H:%M').time()
+            end_time = datetime.strptime(request.POST.get('end_time', '18:00'), '%H:%M').time()
+        except ValueError:
+            messages.error(request, 'Некорректное время работы')
+            return
+        if start_time >= end_time:
+            messages.error(request, 'Время начала должно быть раньше времени окончания')
+            return
+        
+        with_break = bool(request.POST.get('with_break'))
+        schedules = [
+            DoctorSchedule(
+                doctor=doctor,
+                date=day,
+                start_time=start_time,
+                end_time=end_time,
+                slot_duration=doctor.consultation_duration,
+                break_start=time(13, 0) if with_break else None,
+                break_end=time(14, 0) if with_break else None,
+                room=request.POST.get('room', 'Основной кабинет')[:20],
+                is_available=True,
+                is_working_day=True,
+            )
+            for day in dates
+        ]
+        changed = DoctorSchedule.bulk_create_with_slots(doctor, schedules)
+        messages.success(request, f'Расписание добавлено на {period}. Создано дней: {changed}')
+    
+    elif action == 'remove':
+        with transaction.atomic():
+            schedules = DoctorSchedule.objects.select_for_update().filter(doctor=doctor, date__in=dates)
+            # Удаление расписания каскадно удалит его записи - дни с записями
+            # пациентов не удаляем, а только закрываем для новых записей
+            kept = sorted(set(Appointment.objects.filter(
+                schedule__in=schedules
+            ).values_list('schedule__date', flat=True)))
+            schedules.filter(date__in=kept).update(is_available=False)
+            changed = schedules.exclude(date__in=kept).delete()[1].get(DoctorSchedule._meta.label, 0)
+        messages.success(request, f'Расписание на {period} удалено. Удалено дней: {changed}')
+        if kept:
+            availability.invalidate(doctor.id, *kept)
+            messages.warning(
+                request,
+                'Дни с записями пациентов не удалены, прием в них закрыт: '
+                + ', '.join(day.strftime('%d.%m.%Y') for day in kept)
+                + '. Перенесите или отмените записи и повторите удаление.'
+            )
+    
+    elif action == 'toggle':
+        with transaction.atomic():
+            changed = DoctorSchedule.objects.filter(doctor=doctor, date__in=dates).update(
+                is_available=Case(When(is_available=True, then=Value(False)), default=Value(True))
+            )
+        # update() не вызывает сигналы - сбрасываем кэш свободных слотов сами
+        availability.invalidate(doctor.id, *dates)
+        messages.success(request, f'Доступность приема на {period} изменена. Изменено дней: {changed}')
+    
+    else:
+        messages.error(request, 'Неизвестное действие')
+
+
 @login_required
 def doctor_schedule_day(request, date_str):
     """Расписание врача на конкретный день"""
@@ -559,9 +728,9 @@ def doctor_schedule_day(request, date_str):
     
     # Получаем записи на этот день
     appointments = Appointment.objects.filter(
-        doctor=doctor,
-        appointment_time__date=schedule_date
-    ).order_by('appointment_time')
+        timeranges.on_day('appointment_time', schedule_date),
+        doctor=doctor
+    ).select_related('patient__user', 'service').order_by('appointment_time')
     
     # Если нет расписания, создаем временное
     if not schedule:
@@ -578,7 +747,7 @@ def doctor_schedule_day(request, date_str):
     # Получаем доступные слоты
     available_slots = []
     if schedule and schedule.is_available and schedule.is_working_day:
-        available_slots = schedule.get_available_slots()
+        available_slots = availability.get_free_slots(doctor.id, schedule_date)
     
     context = {
         'title': f'Расписание на {schedule_date.strftime("%d.%m.%Y")}',
@@ -592,6 +761,10 @@ def doctor_schedule_day(request, date_str):
     return render(request, 'main/doctor/schedule_day.html', context)
 
 
+# Периоды страницы статистики врача, дней
+STATISTICS_PERIODS = [7, 30, 90, 180, 365]
+
+
 @login_required
 def doctor_statistics(request):
     """Статистика врача"""
@@ -601,66 +774,37 @@ def doctor_statistics(request):
         messages.error(request, 'Доступ только для врачей')
         return redirect('home')
     
-    # Период для статистики (последние 30 дней)
-    end_date = timezone.now().date()
-    start_date = end_date - timedelta(days=30)
-    
-    # Статистика по записям
-    appointments = Appointment.objects.filter(
-        doctor=doctor,
-        appointment_time__date__range=[start_date, end_date]
-    )
+    # Период статистики: 30 дней по умолчанию или один из STATISTICS_PERIODS
+    try:
+        days = int(request.GET.get('days', 30))
+    except ValueError:
+        days = 30
+    if days not in STATISTICS_PERIODS:
+        days = 30
+    end_date = timezone.localdate()
+    start_date = end_date - timedelta(days=days)
     
-    # По статусам
-    by_status = appointments.values('status').annotate(count=models.Count('id'))
-    status_stats = {item['status']: item['count'] for item in by_status}
-    
-    # По дням недели
-    appointments_by_weekday = appointments.extra({
-        'weekday': "strftime('%w', appointment_time)"
-    }).values('weekday').annotate(count=models.Count('id'))
-    
-    # По времени суток
-    morning_appointments = appointments.filter(
-        appointment_time__hour__gte=9,
-        appointment_time__hour__lt=12
-    ).count()
-    
-    day_appointments = appointments.filter(
-        appointment_time__hour__gte=12,
-        appointment_time__hour__lt=17
-    ).count()
-    
-    evening_appointments = appointments.filter(
-        appointment_time__hour__gte=17,
-        appointment_time__hour__lt=20
-    ).count()
-    
-    # Самые популярные услуги
-    popular_services = appointments.values(
-        'service__name'
-    ).annotate(
-        count=models.Count('id')
-    ).order_by('-count')[:5]
-    
-    # Отзывы
-    reviews = Review.objects.filter(doctor=doctor, is_published=True)
-    avg_rating = reviews.aggregate(models.Avg('rating'))['rating__avg'] or 0
+    # Сводка читается из дневной таблицы, а не из записей; пересчет - в фоне
+    stats.schedule_sweep()
+    summary = stats.doctor_summary(doctor, start_date, end_date)
     
     context = {
         'title': 'Моя статистика',
         'doctor': doctor,
+        'days': days,
+        'periods': STATISTICS_PERIODS,
         'start_date': start_date,
         'end_date': end_date,
-        'total_appointments': appointments.count(),
-        'status_stats': status_stats,
-        'appointments_by_weekday': appointments_by_weekday,
-        'morning_appointments': morning_appointments,
-        'day_appointments': day_appointments,
-        'evening_appointments': evening_appointments,
-        'popular_services': popular_services,
-        'avg_rating': avg_rating,
-        'reviews_count': reviews.count(),
+        'total_appointments': summary['total'],
+        'status_stats': summary['by_status'],
+        'status_choices': Appointment.STATUS_CHOICES,
+        'appointments_by_weekday': summary['by_weekday'],
+        'morning_appointments': summary['by_day_part']['morning'],
+        'day_appointments': summary['by_day_part']['afternoon'],
+        'evening_appointments': summary['by_day_part']['evening'],
+        'popular_services': summary['popular_services'],
+        'avg_rating': doctor.rating_avg,
+        'reviews_count': doctor.rating_count,
     }
     
     return render(request, 'main/doctor/statistics.html', context)
@@ -698,7 +842,7 @@ class ServiceListView(ListView):
                 Q(description__icontains=search_query)
             )
         
-        return queryset.order_by('order', 'name')
+        return queryset.annotate(doctor_count=models.Count('doctors')).order_by('order', 'name')
     
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
@@ -725,11 +869,12 @@ class ServiceDetailView(DetailView):
         service = self.object
         
         # Получаем врачей, оказывающих эту услугу
-        doctors = service.doctors.filter(is_active=True)
+        doctors = list(service.doctors.filter(is_active=True).select_related('specialization'))
         
         context.update({
             'title': service.name,
             'doctors': doctors,
+            'doctor_count': service.doctors.count(),
         })
         
         return context
@@ -768,16 +913,20 @@ def appointment_step2(request, service_id=None):
     """Шаг 2: Выбор врача (через услугу)"""
     if service_id:
         service = get_object_or_404(Service, id=service_id)
-        doctors = service.doctors.filter(is_active=True)
+        doctors = service.doctors.filter(is_active=True).select_related('specialization')
     else:
         service_id = request.session.get('appointment_service_id')
         if not service_id:
             return redirect('appointment_step1')
         
         service = get_object_or_404(Service, id=service_id)
-        doctors = service.doctors.filter(is_active=True)
+        doctors = service.doctors.filter(is_active=True).select_related('specialization')
     
     if request.method == 'POST':
+        if request.POST.get('earliest'):
+            request.session['appointment_service_id'] = service_id
+            return book_earliest_slot(request, doctors)
+        
         doctor_id = request.POST.get('doctor')
         if doctor_id:
             request.session['appointment_doctor_id'] = doctor_id
@@ -804,9 +953,12 @@ def appointment_step2_doctors(request):
     doctors = Doctor.objects.filter(
         specialization=specialization,
         is_active=True
-    )
+    ).select_related('specialization', 'department')
     
     if request.method == 'POST':
+        if request.POST.get('earliest'):
+            return book_earliest_slot(request, doctors)
+        
         doctor_id = request.POST.get('doctor')
         if doctor_id:
             request.session['appointment_doctor_id'] = doctor_id
@@ -821,6 +973,84 @@ def appointment_step2_doctors(request):
     return render(request, 'main/appointment/step2_doctors.html', context)
 
 
+def get_consultation_service(doctor):
+    """Услуга консультации по специализации врача (создается при первом обращении)"""
+    service, created = Service.objects.get_or_create(
+        name=f"Консультация {doctor.specialization.name.lower()}",
+        defaults={
+            'price': doctor.consultation_price or 0,
+            'duration': doctor.consultation_duration or 30,
+            'category': 'consultation',
+            'is_active': True,
+        }
+    )
+    return service
+
+
+def appointment_time_error(schedule, appointment_datetime, duration):
+    """Проверка выбранного времени приема по расписанию врача.
+    
+    Время не должно быть в прошлом, прием - укладываться в рабочие часы,
+    а начало - совпадать с сеткой слотов. Возвращает текст ошибки или None.
+    """
+    if appointment_datetime < timezone.now():
+        return 'Нельзя записаться на прошедшее время.'
+    
+    schedule_start = make_aware_datetime(schedule.date, schedule.start_time)
+    schedule_end = make_aware_datetime(schedule.date, schedule.end_time)
+    if not (schedule_start <= appointment_datetime
+            and appointment_datetime + timedelta(minutes=duration) <= schedule_end):
+        return 'Выбранное время не входит в рабочие часы врача.'
+    
+    offset = (appointment_datetime - schedule_start).total_seconds() // 60
+    if offset % (schedule.slot_duration or 30):
+        return 'Выбранное время не совпадает с сеткой приема врача.'
+    return None
+
+
+def selected_service_duration(request):
+    """Длительность выбранной в мастере услуги, минут; None - услуга не выбрана"""
+    service_id = request.session.get('appointment_service_id')
+    service = Service.objects.filter(id=service_id).only('duration').first() if service_id else None
+    return service.duration if service else None
+
+
+def hold_selected_time(request, doctor, appointment_datetime):
+    """Удерживает выбранное время за пользователем до подтверждения на шаге 5"""
+    duration = selected_service_duration(request) or doctor.consultation_duration or 30
+    
+    held_until = hold_slot(request.user, doctor, appointment_datetime, duration)
+    request.session['appointment_hold_until'] = held_until.isoformat()
+
+
+# Сколько ближайших начал пробует удержать быстрая запись
+EARLIEST_ATTEMPTS = 5
+
+
+def book_earliest_slot(request, doctors):
+    """Быстрая запись: подставляет ближайший свободный слот и ведет к подтверждению"""
+    slots = availability.find_earliest_slots(doctors, limit=EARLIEST_ATTEMPTS,
+                                             duration=selected_service_duration(request))
+    if not slots:
+        messages.warning(request, 'В ближайшее время свободных слотов нет. Выберите врача вручную.')
+        return redirect(request.path)
+    
+    # Время могут занять между поиском и удержанием - пробуем следующее
+    for slot in slots:
+        slot_start = timezone.localtime(slot.start)
+        try:
+            hold_selected_time(request, slot.doctor, slot_start)
+        except SlotUnavailable:
+            continue
+        request.session['appointment_doctor_id'] = slot.doctor_id
+        request.session['appointment_date'] = slot_start.strftime('%Y-%m-%d')
+        request.session['appointment_time'] = slot_start.strftime('%H:%M:%S')
+        return redirect('appointment_step5')
+    
+    messages.warning(request, 'Ближайшее время только что заняли. Попробуйте еще раз.')
+    return redirect(request.path)
+
+
 @login_required
 def appointment_step3(request):
     """Шаг 3: Выбор даты"""
@@ -832,22 +1062,10 @@ def appointment_step3(request):
     
     # Получаем доступные даты на ближайшие 14 дней
     today = timezone.now().date()
-    end_date = today + timedelta(days=14)
+    end_date = today + timedelta(days=13)
     
-    available_dates = []
-    for i in range(14):
-        check_date = today + timedelta(days=i)
-        
-        # Проверяем, есть ли расписание на эту дату
-        schedule = DoctorSchedule.objects.filter(
-            doctor=doctor,
-            date=check_date,
-            is_available=True,
-            is_working_day=True
-        ).first()
-        
-        if schedule and schedule.get_available_slots():
-            available_dates.append(check_date)
+    dates_slots = availability.get_availability(doctor.id, today, end_date)
+    available_dates = [day for day, slots in dates_slots.items() if slots]
     
     if request.method == 'POST':
         appointment_date = request.POST.get('appointment_date')
@@ -893,8 +1111,11 @@ def appointment_step4(request):
         messages.error(request, 'На выбранную дату нет свободных слотов')
         return redirect('appointment_step3')
     
+    # Истекшие удержания возвращаются в свободные до расчета слотов
+    sweep_expired_holds()
+    
     # Получаем доступные временные слоты
-    available_slots = schedule.get_available_slots()
+    available_slots = availability.get_free_slots(doctor.id, appointment_date)
     
     if not available_slots:
         messages.error(request, 'На выбранную дату нет свободных слотов')
@@ -903,6 +1124,19 @@ def appointment_step4(request):
     if request.method == 'POST':
         appointment_time = request.POST.get('appointment_time')
         if appointment_time:
+            try:
+                appointment_datetime = timezone.make_aware(datetime.combine(
+                    appointment_date, datetime.strptime(appointment_time, '%H:%M:%S').time()
+                ))
+                # Время удерживается за пациентом, пока он подтверждает запись
+                hold_selected_time(request, doctor, appointment_datetime)
+            except ValueError:
+                messages.error(request, 'Некорректное время')
+                return redirect('appointment_step4')
+            except SlotUnavailable:
+                messages.error(request, 'Это время только что выбрал другой пациент. Пожалуйста, выберите другое.')
+                return redirect('appointment_step4')
+            
             request.session['appointment_time'] = appointment_time
             return redirect('appointment_step5')
     
@@ -955,15 +1189,7 @@ def appointment_step5(request):
             return redirect('appointment_step1')
     else:
         # Если услуга не выбрана, используем консультацию врача
-        service, created = Service.objects.get_or_create(
-            name=f"Консультация {doctor.specialization.name.lower()}",
-            defaults={
-                'price': doctor.consultation_price or 0,
-                'duration': doctor.consultation_duration or 30,
-                'category': 'consultation',
-                'is_active': True,
-            }
-        )
+        service = get_consultation_service(doctor)
     
     # Преобразуем дату и время
     try:
@@ -1017,50 +1243,36 @@ def appointment_step5(request):
                 )
                 print(f"Создано расписание для врача {doctor.full_name()} на {appointment_datetime.date()}")
             
-            # Проверяем, что время попадает в рабочие часы врача
-            schedule_start = datetime.combine(appointment_datetime.date(), schedule.start_time)
-            schedule_end = datetime.combine(appointment_datetime.date(), schedule.end_time)
-            
-            if timezone.is_naive(schedule_start):
-                schedule_start = timezone.make_aware(schedule_start)
-            if timezone.is_naive(schedule_end):
-                schedule_end = timezone.make_aware(schedule_end)
-            
-            if not (schedule_start <= appointment_datetime <= schedule_end):
-                messages.error(request, 'Выбранное время не входит в рабочие часы врача.')
+            # Проверяем время по расписанию врача: рабочие часы и сетка слотов
+            error = appointment_time_error(
+                schedule, appointment_datetime, service.duration or doctor.consultation_duration or 30
+            )
+            if error:
+                messages.error(request, error)
                 return redirect('appointment_step4')
             
-            # Проверяем, не занят ли уже этот слот
-            existing_appointment = Appointment.objects.filter(
-                doctor=doctor,
-                appointment_time__date=appointment_datetime.date(),
-                appointment_time__hour=appointment_datetime.hour,
-                appointment_time__minute=appointment_datetime.minute,
-                status__in=['pending', 'confirmed']
-            ).exists()
-            
-            if existing_appointment:
+            # Создаем запись и занимаем слот (атомарно)
+            try:
+                appointment = book_appointment(
+                    patient=patient,
+                    doctor=doctor,
+                    service=service,
+                    schedule=schedule,
+                    appointment_time=appointment_datetime,
+                    created_by=request.user,
+                )
+            except SlotUnavailable:
                 messages.error(request, 'Это время уже занято. Пожалуйста, выберите другое время.')
                 return redirect('appointment_step4')
             
-            # Создаем запись
-            appointment = Appointment.objects.create(
-                patient=patient,
-                doctor=doctor,
-                service=service,
-                schedule=schedule,
-                appointment_time=appointment_datetime,
-                status='pending',
-                created_by=request.user,
-            )
-            
             # Очищаем сессию
             session_keys_to_remove = [
                 'appointment_doctor_id',
                 'appointment_service_id', 
                 'appointment_specialization_id',
                 'appointment_date', 
-                'appointment_time'
+                'appointment_time',
+                'appointment_hold_until'
             ]
             
             for key in session_keys_to_remove:
@@ -1102,6 +1314,7 @@ def appointment_step5(request):
         'service': service,
         'patient': patient,
         'appointment_datetime': appointment_datetime,
+        'hold_until': parse_datetime(request.session.get('appointment_hold_until', '')),
     }
     
     return render(request, 'main/appointment/step5.html', context)
@@ -1131,7 +1344,7 @@ def get_available_slots(request):
     ).first()
     
     if schedule:
-        slots = schedule.get_available_slots()
+        slots = availability.get_free_slots(doctor.id, appointment_date)
         slots_str = [slot.strftime('%H:%M') for slot in slots]
         return JsonResponse({'slots': slots_str})
     else:
@@ -1177,19 +1390,20 @@ def profile(request):
         patient=patient,
         status__in=['pending', 'confirmed'],
         appointment_time__gte=timezone.now()
-    ).order_by('appointment_time')
+    ).select_related('doctor', 'service', 'schedule').order_by('appointment_time')
     
     # Получаем прошедшие записи
     past_appointments = Appointment.objects.filter(
         patient=patient,
         status__in=['completed', 'cancelled', 'no_show']
-    ).order_by('-appointment_time')[:10]
+    ).select_related('doctor', 'service').order_by('-appointment_time')[:10]
     
     context = {
         'title': 'Личный кабинет',
         'patient': patient,
         'active_appointments': active_appointments,
         'past_appointments': past_appointments,
+        'stats': Appointment.status_counts(patient=patient),
     }
     
     return render(request, 'main/profile/index.html', context)
@@ -1232,20 +1446,43 @@ def appointment_list(request):
         messages.warning(request, 'Пожалуйста, заполните профиль пациента')
         return redirect('profile_edit')
     
-    appointments = Appointment.objects.filter(patient=patient).order_by('-appointment_time')
+    # Одна страница истории от новых записей к старым, продолжение - по курсору
+    appointments, next_cursor = pagination.keyset_page(
+        Appointment.objects.filter(patient=patient).select_related('doctor', 'service'),
+        request.GET.get('cursor'), pagination.page_size(request.GET.get('size')),
+        descending=True,
+    )
     
     context = {
         'title': 'Мои записи',
         'appointments': appointments,
+        'next_page': _next_page_url(request, next_cursor),
     }
     
+    if request.GET.get('format') == 'json':
+        return _page_json(request, 'main/appointment/list_rows.html', context, [
+            {
+                'id': appointment.pk,
+                'number': appointment.appointment_number,
+                'time': appointment.appointment_time.isoformat(),
+                'status': appointment.status,
+                'status_display': appointment.get_status_display(),
+                'doctor': appointment.doctor.full_name(),
+                'service': appointment.service.name,
+                'url': reverse('appointment_detail', args=[appointment.pk]),
+            }
+            for appointment in appointments
+        ])
+    
     return render(request, 'main/appointment/list.html', context)
 
 
 @login_required
 def appointment_detail(request, pk):
     """Детальная страница записи"""
-    appointment = get_object_or_404(Appointment, pk=pk)
+    appointment = get_object_or_404(
+        Appointment.objects.select_related('patient__user', 'doctor', 'service', 'schedule'), pk=pk
+    )
     
     # Проверяем, что запись принадлежит текущему пользователю
     if appointment.patient.user != request.user and not request.user.is_staff:
@@ -1289,6 +1526,96 @@ def appointment_cancel(request, pk):
     return render(request, 'main/appointment/cancel.html', context)
 
 
+# ==================== ЛИСТ ОЖИДАНИЯ ====================
+
+@login_required
+def waitlist_view(request):
+    """Лист ожидания пациента: заявки, предложения и постановка в очередь"""
+    try:
+        patient = Patient.objects.get(user=request.user)
+    except Patient.DoesNotExist:
+        messages.error(request, 'Пожалуйста, заполните профиль пациента.')
+        return redirect('profile_edit')
+    
+    if request.method == 'POST':
+        form = WaitlistForm(request.POST)
+        if form.is_valid():
+            entry = form.save(commit=False)
+            entry.patient = patient
+            entry.save()
+            messages.success(request, 'Вы добавлены в лист ожидания. Мы закрепим за вами время, как только оно освободится.')
+            return redirect('waitlist')
+    else:
+        form = WaitlistForm(initial={
+            'doctor': request.GET.get('doctor'),
+            'specialization': request.GET.get('specialization'),
+            'date_from': timezone.localdate(),
+            'date_to': timezone.localdate() + timedelta(days=14),
+        })
+    
+    entries = patient.waitlist_entries.filter(
+        status__in=[WaitlistEntry.WAITING, WaitlistEntry.OFFERED]
+    ).select_related('doctor', 'specialization', 'service', 'offered_slot__doctor')
+    
+    context = {
+        'title': 'Лист ожидания',
+        'form': form,
+        'entries': entries,
+    }
+    
+    return render(request, 'main/waitlist/list.html', context)
+
+
+@login_required
+@require_POST
+def waitlist_accept(request, pk):
+    """Принятие предложенного из листа ожидания времени"""
+    entry = get_object_or_404(
+        WaitlistEntry.objects.select_related('patient', 'service', 'offered_slot__schedule',
+                                             'offered_slot__doctor__specialization'),
+        pk=pk, patient__user=request.user
+    )
+    
+    if not entry.offer_is_active or entry.offered_slot is None:
+        messages.error(request, 'Предложение больше не действует')
+        return redirect('waitlist')
+    
+    slot = entry.offered_slot
+    try:
+        appointment = book_appointment(
+            patient=entry.patient,
+            doctor=slot.doctor,
+            service=entry.service or get_consultation_service(slot.doctor),
+            schedule=slot.schedule,
+            appointment_time=slot.start,
+            created_by=request.user,
+        )
+    except SlotUnavailable:
+        messages.error(request, 'К сожалению, это время уже занято')
+        return redirect('waitlist')
+    
+    entry.status = WaitlistEntry.BOOKED
+    entry.appointment = appointment
+    entry.save(update_fields=['status', 'appointment'])
+    
+    messages.success(request, f'Запись создана! Номер записи: {appointment.appointment_number}')
+    return redirect('appointment_detail', pk=appointment.pk)
+
+
+@login_required
+@require_POST
+def waitlist_cancel(request, pk):
+    """Отказ от заявки или предложенного времени"""
+    entry = get_object_or_404(
+        WaitlistEntry.objects.select_related('patient', 'offered_slot'),
+        pk=pk, patient__user=request.user,
+        status__in=[WaitlistEntry.WAITING, WaitlistEntry.OFFERED]
+    )
+    waitlist.withdraw(entry)
+    messages.success(request, 'Заявка в листе ожидания отменена')
+    return redirect('waitlist')
+
+
 # ==================== ОТЗЫВЫ ====================
 
 @login_required
@@ -1386,32 +1713,33 @@ def search(request):
     
     if query:
         # Поиск врачей
-        doctors = Doctor.objects.filter(
+        doctors = list(Doctor.objects.filter(
             Q(last_name__icontains=query) |
             Q(first_name__icontains=query) |
             Q(middle_name__icontains=query) |
             Q(specialization__name__icontains=query) |
             Q(bio__icontains=query)
-        ).filter(is_active=True)
+        ).filter(is_active=True).select_related('specialization'))
         
         # Поиск услуг
-        services = Service.objects.filter(
+        services = list(Service.objects.filter(
             Q(name__icontains=query) |
             Q(description__icontains=query) |
             Q(short_description__icontains=query)
-        ).filter(is_active=True)
+        ).filter(is_active=True).annotate(doctor_count=models.Count('doctors')))
         
         # Поиск новостей
-        news = News.objects.filter(
+        news = list(News.objects.filter(
             Q(title__icontains=query) |
             Q(content__icontains=query) |
             Q(excerpt__icontains=query)
-        ).filter(is_published=True, published_at__lte=timezone.now())
+        ).filter(is_published=True, published_at__lte=timezone.now()))
         
         results = {
             'doctors': doctors,
             'services': services,
             'news': news,
+            'total': len(doctors) + len(services) + len(news),
         }
     
     context = {
@@ -1435,18 +1763,10 @@ def api_doctor_schedule(request, doctor_id):
         end_date = today + timedelta(days=14)
         
         schedule_data = []
-        schedules = DoctorSchedule.objects.filter(
-            doctor=doctor,
-            date__range=[today, end_date],
-            is_available=True,
-            is_working_day=True
-        ).order_by('date')
-        
-        for schedule in schedules:
-            slots = schedule.get_available_slots()
+        for day, slots in availability.get_availability(doctor.id, today, end_date).items():
             if slots:
                 schedule_data.append({
-                    'date': schedule.date.strftime('%Y-%m-%d'),
+                    'date': day.strftime('%Y-%m-%d'),
                     'slots': [slot.strftime('%H:%M') for slot in slots],
                 })
         
@@ -1463,6 +1783,292 @@ def api_doctor_schedule(request, doctor_id):
         return JsonResponse({'error': 'Врач не найден'}, status=404)
 
 
+def api_availability_matrix(request):
+    """API для матрицы свободных слотов: врачи × даты"""
+    try:
+        days = min(max(int(request.GET.get('days', 14)), 1), 31)
+    except ValueError:
+        return JsonResponse({'error': 'Некорректное количество дней'}, status=400)
+    
+    today = timezone.now().date()
+    dates = [today + timedelta(days=i) for i in range(days)]
+    
+    doctors = list(filter_doctors(
+        Doctor.objects.filter(is_active=True), request.GET
+    ).select_related('specialization').order_by('order', 'last_name', 'first_name'))
+    
+    # Слоты берутся из кэша, промахи досчитываются для всех врачей сразу
+    free_slots = availability.get_availability_matrix([doctor.id for doctor in doctors], dates)
+    
+    return JsonResponse({
+        'dates': [day.strftime('%Y-%m-%d') for day in dates],
+        'doctors': [
+            {
+                'id': doctor.id,
+                'name': doctor.short_name(),
+                'specialization': doctor.specialization.name,
+            }
+            for doctor in doctors
+        ],
+        'matrix': [
+            [len(free_slots[(doctor.id, day)]) for day in dates]
+            for doctor in doctors
+        ],
+    })
+
+
+def api_earliest_slots(request):
+    """API ближайших свободных слотов по специализации или услуге"""
+    specialization_id = request.GET.get('specialization')
+    service_id = request.GET.get('service')
+    
+    duration = None
+    try:
+        limit = min(max(int(request.GET.get('limit', 5)), 1), 50)
+        if service_id:
+            service = get_object_or_404(Service, id=int(service_id))
+            doctors = service.doctors.filter(is_active=True)
+            duration = service.duration
+        elif specialization_id:
+            doctors = Doctor.objects.filter(specialization_id=int(specialization_id), is_active=True)
+        else:
+            return JsonResponse({'error': 'Укажите специализацию или услугу'}, status=400)
+    except ValueError:
+        return JsonResponse({'error': 'Некорректные данные'}, status=400)
+    
+    slots = []
+    for slot in availability.find_earliest_slots(doctors, limit=limit, duration=duration):
+        slot_start = timezone.localtime(slot.start)
+        slots.append({
+            'doctor': {
+                'id': slot.doctor_id,
+                'name': slot.doctor.full_name(),
+            },
+            'date': slot_start.strftime('%Y-%m-%d'),
+            'time': slot_start.strftime('%H:%M'),
+            'room': slot.schedule.room,
+        })
+    
+    return JsonResponse({'slots': slots})
+
+
+@require_POST
+def api_book_appointment(request):
+    """API записи на прием одним запросом (без пошагового мастера).
+    
+    Принимает JSON или форму с полями doctor, service (необязательно), date
+    (ГГГГ-ММ-ДД) и time (ЧЧ:ММ). Персонал может указать patient, чтобы
+    записать пациента от его имени.
+    """
+    if not request.user.is_authenticated:
+        return JsonResponse({'error': 'Требуется авторизация'}, status=401)
+    
+    if request.content_type == 'application/json':
+        try:
+            data = json.loads(request.body)
+        except ValueError:
+            return JsonResponse({'error': 'Некорректный JSON'}, status=400)
+        if not isinstance(data, dict):
+            return JsonResponse({'error': 'Некорректный JSON'}, status=400)
+    else:
+        data = request.POST
+    
+    try:
+        doctor_id = int(data['doctor'])
+        service_id = int(data['service']) if data.get('service') else None
+        patient_id = int(data['patient']) if data.get('patient') else None
+        appointment_date = datetime.strptime(str(data['date']), '%Y-%m-%d').date()
+        appointment_time = time.fromisoformat(str(data['time']))
+        if appointment_time.tzinfo:
+            # Время приема задается в часовом поясе клиники, смещение не принимается
+            raise ValueError('time with offset')
+    except (KeyError, TypeError, ValueError):
+        return JsonResponse({'error': 'Укажите врача, дату (ГГГГ-ММ-ДД) и время (ЧЧ:ММ)'}, status=400)
+    
+    doctor = Doctor.objects.filter(id=doctor_id, is_active=True).select_related('specialization').first()
+    if not doctor:
+        return JsonResponse({'error': 'Врач не найден или недоступен'}, status=404)
+    
+    if service_id:
+        service = Service.objects.filter(id=service_id, is_active=True).first()
+        if not service:
+            return JsonResponse({'error': 'Услуга не найдена'}, status=404)
+    else:
+        service = get_consultation_service(doctor)
+    
+    appointment_datetime = timezone.make_aware(datetime.combine(appointment_date, appointment_time))
+    
+    if patient_id and request.user.is_staff:
+        patient = Patient.objects.filter(id=patient_id).first()
+    else:
+        patient = Patient.objects.filter(user=request.user).first()
+    if not patient:
+        return JsonResponse({'error': 'Профиль пациента не найден'}, status=403)
+    
+    schedule = DoctorSchedule.objects.filter(
+        doctor=doctor,
+        date=appointment_date,
+        is_available=True,
+        is_working_day=True
+    ).first()
+    if not schedule:
+        return JsonResponse({'error': 'Врач не ведет прием в этот день'}, status=409)
+    
+    # Те же правила, что и на шаге 5 мастера записи
+    error = appointment_time_error(
+        schedule, appointment_datetime, service.duration or doctor.consultation_duration or 30
+    )
+    if error:
+        return JsonResponse({'error': error.rstrip('.')}, status=400)
+    
+    try:
+        appointment = book_appointment(
+            patient=patient,
+            doctor=doctor,
+            service=service,
+            schedule=schedule,
+            appointment_time=appointment_datetime,
+            created_by=request.user,
+            symptoms=str(data.get('symptoms', '')),
+            notes=str(data.get('notes', '')),
+        )
+    except SlotUnavailable:
+        return JsonResponse({'error': 'Это время уже занято'}, status=409)
+    
+    return JsonResponse({
+        'id': appointment.id,
+        'number': appointment.appointment_number,
+        'status': appointment.status,
+        'doctor': {
+            'id': doctor.id,
+            'name': doctor.full_name(),
+        },
+        'service': {
+            'id': service.id,
+            'name': service.name,
+            'price': str(service.price),
+            'duration': service.duration,
+        },
+        'patient': patient.id,
+        'date': appointment_date.strftime('%Y-%m-%d'),
+        'time': appointment_time.strftime('%H:%M'),
+        'room': schedule.room,
+    }, status=201)
+
+
+@staff_member_required
+@require_POST
+def api_book_batch(request):
+    """API пакетной записи для колл-центра (для персонала).
+    
+    Тело - CSV с заголовком (text/csv) или JSON-список строк, параметр
+    ?dry_run=1 только проверяет пакет. Возвращает результат по каждой строке.
+    """
+    dry_run = request.GET.get('dry_run') == '1'
+    fmt = 'csv' if request.content_type == 'text/csv' else 'json'
+    try:
+        rows = parse_batch(request.body.decode('utf-8-sig'), fmt)
+    except ValueError as exc:
+        return JsonResponse({'error': f'Некорректный пакет: {exc}'}, status=400)
+    
+    if len(rows) > 1000:
+        return JsonResponse({'error': 'Не более 1000 строк в пакете'}, status=400)
+    
+    results = book_batch(rows, created_by=request.user, dry_run=dry_run)
+    return JsonResponse({
+        'dry_run': dry_run,
+        'total': len(results),
+        'succeeded': sum(result['status'] != 'error' for result in results),
+        'results': results,
+    })
+
+
+@staff_member_required
+def api_availability_cache_stats(request):
+    """API статистики кэша свободных слотов (для персонала)"""
+    if request.method == 'POST' and request.POST.get('reset'):
+        availability.reset_cache_stats()
+    return JsonResponse(availability.get_cache_stats())
+
+
+@staff_member_required
+def clinic_analytics(request):
+    """Аналитика клиники для персонала: загрузка и неявки по отделениям, специализациям и услугам.
+    
+    Читает только таблицу фактов (обновляется командой
+    refresh_appointment_facts), поэтому не зависит от объема записей.
+    """
+    try:
+        days = int(request.GET.get('days', 30))
+    except ValueError:
+        days = 30
+    if days not in STATISTICS_PERIODS:
+        days = 30
+    group_by = request.GET.get('by', 'department')
+    if group_by not in analytics.GROUPINGS:
+        group_by = 'department'
+    
+    def selected_id(name):
+        value = request.GET.get(name, '')
+        return int(value) if value.isdigit() else None
+    
+    department = selected_id('department')
+    specialization = selected_id('specialization')
+    category = request.GET.get('category') or None
+    if category not in dict(Service.SERVICE_CATEGORIES):
+        category = None
+    
+    end_date = timezone.localdate()
+    start_date = end_date - timedelta(days=days)
+    rows = analytics.report(start_date, end_date, group_by=group_by, department=department,
+                            specialization=specialization, category=category)
+    
+    context = {
+        'title': 'Аналитика клиники',
+        'rows': rows,
+        'days': days,
+        'periods': STATISTICS_PERIODS,
+        'start_date': start_date,
+        'end_date': end_date,
+        'group_by': group_by,
+        'groupings': [('department', 'Отделения'), ('specialization', 'Специализации'),
+                      ('category', 'Категории услуг'), ('service', 'Услуги')],
+        'departments': Department.objects.all(),
+        'specializations': Specialization.objects.all(),
+        'categories': Service.SERVICE_CATEGORIES,
+        'selected_department': department,
+        'selected_specialization': specialization,
+        'selected_category': category,
+        'show_capacity': bool(rows) and 'utilization' in rows[0],
+        'totals': {
+            field: sum(row[field] for row in rows)
+            for field in ('total', 'completed', 'no_show', 'cancelled', 'active', 'booked_minutes')
+        },
+    }
+    
+    return render(request, 'main/analytics/index.html', context)
+
+
+@staff_member_required
+def api_sql_profile(request):
+    """API профиля SQL по страницам из кольцевого буфера (для персонала).
+    
+    Итоги по имени URL и последние запросы; ?limit= ограничивает их
+    число, POST с reset очищает буфер.
+    """
+    if request.method == 'POST' and request.POST.get('reset'):
+        sql_profiling.reset()
+    try:
+        limit = max(int(request.GET.get('limit', 50)), 0)
+    except ValueError:
+        limit = 50
+    return JsonResponse({
+        'sample_rate': sql_profiling.sample_rate(),
+        'summary': sql_profiling.summary(),
+        'recent': sql_profiling.recent(limit),
+    })
+
+
 def api_available_dates(request, doctor_id):
     """API для получения доступных дат врача"""
     try:
@@ -1470,21 +2076,12 @@ def api_available_dates(request, doctor_id):
         
         # Получаем доступные даты на ближайшие 14 дней
         today = timezone.now().date()
-        end_date = today + timedelta(days=14)
+        end_date = today + timedelta(days=13)
         
-        available_dates = []
-        for i in range(14):
-            check_date = today + timedelta(days=i)
-            
-            schedule = DoctorSchedule.objects.filter(
-                doctor=doctor,
-                date=check_date,
-                is_available=True,
-                is_working_day=True
-            ).first()
-            
-            if schedule and schedule.get_available_slots():
-                available_dates.append(check_date.strftime('%Y-%m-%d'))
+        dates_slots = availability.get_availability(doctor.id, today, end_date)
+        available_dates = [
+            day.strftime('%Y-%m-%d') for day, slots in dates_slots.items() if slots
+        ]
         
         return JsonResponse({'available_dates': available_dates})
     
@@ -0,0 +1,110 @@
+# main/waitlist.py
+"""Лист ожидания: предложение освободившихся слотов ожидающим пациентам"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from . import availability, background
+from .models import ScheduleSlot, WaitlistEntry
+
+QUEUE = 'waitlist'
+
+
+def _offer_minutes():
+    return getattr(settings, 'WAITLIST_OFFER_MINUTES', 30)
+
+
+def schedule(func, *args):
+    """Запускает обработку листа ожидания после фиксации транзакции в его фоновой очереди"""
+    background.schedule(QUEUE, func, *args)
+
+
+def find_waiter(slot, exclude_ids=()):
+    """Первая по времени постановки заявка, подходящая под слот"""
+    day = timezone.localtime(slot.start).date()
+    return WaitlistEntry.objects.filter(
+        Q(doctor_id=slot.doctor_id) | Q(doctor__isnull=True, specialization_id=slot.doctor.specialization_id),
+        status=WaitlistEntry.WAITING,
+        date_from__lte=day,
+        date_to__gte=day,
+    ).exclude(id__in=exclude_ids).select_related('patient__user').order_by('created_at', 'id').first()
+
+
+def offer_slot(slot):
+    """Удерживает слот за первым подходящим пациентом из листа ожидания.
+
+    Возвращает заявку, которой сделано предложение, или None.
+    """
+    skipped = []
+    while True:
+        entry = find_waiter(slot, skipped)
+        if entry is None:
+            return None
+
+        offered_until = timezone.now() + timedelta(minutes=_offer_minutes())
+        with transaction.atomic():
+            held = ScheduleSlot.objects.filter(ScheduleSlot.available_q(), pk=slot.pk).update(
+                state=ScheduleSlot.HELD, held_until=offered_until, held_by=entry.patient.user
+            )
+            if not held:
+                # Слот успели занять - предлагать нечего
+                return None
+            # Заявку могли отменить, пока шел поиск
+            updated = WaitlistEntry.objects.filter(pk=entry.pk, status=WaitlistEntry.WAITING).update(
+                status=WaitlistEntry.OFFERED, offered_slot=slot, offered_until=offered_until
+            )
+            if not updated:
+                transaction.set_rollback(True)
+
+        if updated:
+            availability.invalidate(slot.doctor_id, timezone.localtime(slot.start).date())
+            return entry
+        skipped.append(entry.pk)
+
+
+def offer_freed_slots(doctor_id, start, end):
+    """Предлагает ожидающим освободившиеся слоты врача в интервале [start, end)"""
+    slots = ScheduleSlot.objects.filter(
+        ScheduleSlot.available_q(),
+        doctor_id=doctor_id,
+        start__lt=end,
+        end__gt=start,
+        start__gte=timezone.now(),
+        schedule__is_available=True,
+        schedule__is_working_day=True,
+    ).select_related('doctor').order_by('start')
+    return [entry for entry in map(offer_slot, slots) if entry is not None]
+
+
+def expire_offers():
+    """Закрывает просроченные предложения и передает их слоты следующим в очереди"""
+    expired = list(WaitlistEntry.objects.filter(
+        status=WaitlistEntry.OFFERED,
+        offered_until__lte=timezone.now()
+    ).select_related('offered_slot__doctor'))
+    if not expired:
+        return 0
+
+    WaitlistEntry.objects.filter(
+        pk__in=[entry.pk for entry in expired], status=WaitlistEntry.OFFERED
+    ).update(status=WaitlistEntry.EXPIRED)
+    for entry in expired:
+        if entry.offered_slot:
+            offer_slot(entry.offered_slot)
+    return len(expired)
+
+
+def withdraw(entry):
+    """Отменяет заявку; удерживаемый для нее слот уходит следующему в очереди"""
+    slot = entry.offered_slot if entry.status == WaitlistEntry.OFFERED else None
+    entry.status = WaitlistEntry.CANCELLED
+    entry.save(update_fields=['status'])
+    if slot:
+        ScheduleSlot.objects.filter(
+            pk=slot.pk, state=ScheduleSlot.HELD, held_by_id=entry.patient.user_id
+        ).update(state=ScheduleSlot.FREE, held_until=None, held_by=None)
+        availability.invalidate(slot.doctor_id, timezone.localtime(slot.start).date())
+        schedule(offer_freed_slots, slot.doctor_id, slot.start, slot.end)
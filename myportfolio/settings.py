@@ -42,6 +42,7 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'main.sql_profiling.SQLProfilingMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -80,6 +81,17 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # Запись берет блокировку сразу при BEGIN: параллельные бронирования
+        # ждут друг друга, а не падают с "database is locked"
+        'OPTIONS': {
+            'transaction_mode': 'IMMEDIATE',
+            'timeout': 20,
+        },
+        # Файловая тестовая БД: потоки в тестах конкурентности работают
+        # с обычными файловыми блокировками SQLite
+        'TEST': {
+            'NAME': BASE_DIR / 'test_db.sqlite3',
+        },
     }
 }
 
@@ -120,6 +132,35 @@ LOGIN_REDIRECT_URL = 'profile'  # куда перенаправлять посл
 LOGOUT_REDIRECT_URL = 'home'  # куда перенаправлять после выхода
 
 
+# Кэш свободных слотов (врач, дата): время жизни записи в секундах.
+# Инвалидация идет по событиям, поэтому в продакшене нужен общий для всех
+# процессов бэкенд CACHES (Redis/Memcached), а не локальный по умолчанию.
+AVAILABILITY_CACHE_TIMEOUT = 300
+
+# Сколько минут выбранное на шаге 4 время удерживается за пациентом
+SLOT_HOLD_MINUTES = 5
+
+# Лист ожидания: сколько минут освободившееся время ждет ответа пациента
+WAITLIST_OFFER_MINUTES = 30
+
+# Выполняются ли фоновые задачи (лист ожидания, пересчет сводок) в рабочих
+# потоках (False - сразу после коммита в потоке запроса)
+BACKGROUND_ASYNC = True
+
+# Вес среднего по клинике в индексе популярности врача (в условных оценках)
+POPULARITY_PRIOR_WEIGHT = 5
+
+# Дневная сводка статистики врачей: запас в секундах при поиске измененных
+# записей по updated_at (транзакции, зафиксированные позже своей отметки)
+STATS_REFRESH_OVERLAP = 300
+
+# Профилирование SQL: доля запросов, попадающих в выборку (0 - выключено),
+# размер кольцевого буфера и порог повторов одного запроса для N+1
+SQL_PROFILE_SAMPLE_RATE = 1.0 if DEBUG else 0.05
+SQL_PROFILE_BUFFER_SIZE = 500
+SQL_PROFILE_N_PLUS_ONE_THRESHOLD = 10
+
+
 # Static files (CSS, JavaScript, Images)
 # https://docs.djangoproject.com/en/4.2/howto/static-files/
 